@@ -0,0 +1,99 @@
+"""Compares the peak memory used to serialize SQL Lab payloads
+
+Each method runs in its own process, which reports its peak resident set
+size once the payload of a result set of ``--rows`` rows is serialized:
+
+- ``legacy``: the frame rewritten with ``df.where(pd.notnull(df), None)``
+  then turned into records, as SQL Lab used to
+- ``records``: the records built column by column from null masks
+- ``columns``: the columnar payload, without a dict per row
+
+Usage: python scripts/benchmark_payload.py --rows 1000000
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+
+METHODS = ('legacy', 'records', 'columns')
+
+
+def make_df(rows):
+    import numpy as np
+    import pandas as pd
+    floats = np.random.rand(rows)
+    floats[::10] = np.nan
+    strings = np.array(['name_{}'.format(i % 1000) for i in range(rows)],
+                       dtype=object)
+    strings[::7] = None
+    return pd.DataFrame({
+        'id': np.arange(rows),
+        'value': floats,
+        'name': strings,
+        'ds': pd.date_range('2017-01-01', periods=rows, freq='s'),
+    })
+
+
+def serialize(method, df):
+    import pandas as pd
+    from superset import dataframe, utils
+    if method == 'legacy':
+        data = df.where(pd.notnull(df), None).to_dict(orient='records')
+    elif method == 'records':
+        data = dataframe.SupersetDataFrame(df).data
+    else:
+        cdf = dataframe.SupersetDataFrame(df)
+        data = dict(zip(cdf.column_names, cdf.columnar_data))
+    return json.dumps(data, default=utils.json_iso_dttm_ser)
+
+
+def peak_rss_kb():
+    # kilobytes on Linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run(method, rows):
+    # importing superset sets the app up, which is left out of the baseline
+    from superset import dataframe  # noqa
+    df = make_df(rows)
+    baseline = peak_rss_kb()
+    payload = serialize(method, df)
+    print(json.dumps({
+        'method': method,
+        'bytes': len(payload),
+        'baseline_rss_kb': baseline,
+        'peak_rss_kb': peak_rss_kb(),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--method', choices=METHODS)
+    args = parser.parse_args()
+    if args.method:
+        run(args.method, args.rows)
+        return
+
+    print('{:<10}{:>16}{:>16}{:>16}'.format(
+        'method', 'payload MB', 'baseline MB', 'peak MB'))
+    for method in METHODS:
+        output = subprocess.check_output([
+            sys.executable, __file__,
+            '--method', method, '--rows', str(args.rows)])
+        result = json.loads(output.decode('utf-8').strip().split('\n')[-1])
+        print('{:<10}{:>16.1f}{:>16.1f}{:>16.1f}'.format(
+            method,
+            result['bytes'] / 1024 ** 2,
+            result['baseline_rss_kb'] / 1024,
+            result['peak_rss_kb'] / 1024))
+
+
+if __name__ == '__main__':
+    main()
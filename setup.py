@@ -70,6 +70,7 @@ setup(
         'werkzeug==0.11.15',
     ],
     extras_require={
+        'arrow': ['pyarrow>=0.7.0'],
         'cors': ['Flask-Cors>=2.0.0'],
     },
     tests_require=[
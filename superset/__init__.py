@@ -15,7 +15,7 @@ from flask_appbuilder.baseviews import expose
 from flask_migrate import Migrate
 from superset.connectors.connector_registry import ConnectorRegistry
 from werkzeug.contrib.fixers import ProxyFix
-from superset import utils, config  # noqa
+from superset import utils, config, pubsub  # noqa
 
 
 APP_DIR = os.path.dirname(__file__)
@@ -100,6 +100,10 @@ sm = appbuilder.sm
 
 get_session = appbuilder.get_session
 results_backend = app.config.get("RESULTS_BACKEND")
+pubsub_backend = app.config.get("PUBSUB_BACKEND")
+if pubsub_backend is not None and not isinstance(
+        pubsub_backend, pubsub.PubSub):
+    pubsub_backend = pubsub.CachePubSub(pubsub_backend)
 
 # Registering sources
 module_datasource_map = app.config.get("DEFAULT_MODULE_DS_MAP")
@@ -30,6 +30,7 @@ export const START_QUERY = 'START_QUERY';
 export const STOP_QUERY = 'STOP_QUERY';
 export const REQUEST_QUERY_RESULTS = 'REQUEST_QUERY_RESULTS';
 export const QUERY_SUCCESS = 'QUERY_SUCCESS';
+export const QUERY_PARTIAL_RESULTS = 'QUERY_PARTIAL_RESULTS';
 export const QUERY_FAILED = 'QUERY_FAILED';
 export const CLEAR_QUERY_RESULTS = 'CLEAR_QUERY_RESULTS';
 export const REMOVE_DATA_PREVIEW = 'REMOVE_DATA_PREVIEW';
@@ -54,6 +55,10 @@ export function querySuccess(query, results) {
   return { type: QUERY_SUCCESS, query, results };
 }
 
+export function queryPartialResults(query, results) {
+  return { type: QUERY_PARTIAL_RESULTS, query, results };
+}
+
 export function queryFailed(query, msg) {
   return { type: QUERY_FAILED, query, msg };
 }
@@ -74,8 +79,11 @@ export function requestQueryResults(query) {
   return { type: REQUEST_QUERY_RESULTS, query };
 }
 
+// delay between the fetches of the results of a query still running
+const PARTIAL_RESULTS_POLL_MS = 2000;
+
 export function fetchQueryResults(query) {
-  return function (dispatch) {
+  return function (dispatch, getState) {
     dispatch(requestQueryResults(query));
     const sqlJsonUrl = `/superset/results/${query.resultsKey}/`;
     $.ajax({
@@ -83,7 +91,19 @@ export function fetchQueryResults(query) {
       dataType: 'json',
       url: sqlJsonUrl,
       success(results) {
-        dispatch(querySuccess(query, results));
+        if (results.complete !== false) {
+          dispatch(querySuccess(query, results));
+          return;
+        }
+        // the first pages are in while the query keeps fetching the rest
+        dispatch(queryPartialResults(query, results));
+        setTimeout(() => {
+          const current = getState().queries[query.id];
+          if (current && current.state !== 'stopped' && current.state !== 'failed' &&
+              current.resultsKey === query.resultsKey) {
+            dispatch(fetchQueryResults(current));
+          }
+        }, PARTIAL_RESULTS_POLL_MS);
       },
       error(err) {
         let msg = 'Failed at retrieving results from the results backend';
@@ -6,13 +6,52 @@ import * as Actions from '../actions';
 const $ = require('jquery');
 const QUERY_UPDATE_FREQ = 1000;
 const QUERY_UPDATE_BUFFER_MS = 5000;
+// delay before long polling again after a failed long poll
+const LONG_POLL_RETRY_MS = 5000;
 
 class QueryAutoRefresh extends React.PureComponent {
   componentWillMount() {
-    this.startTimer();
+    // the changes are pushed when the server has a pubsub backend, the
+    // queries are polled otherwise
+    $.getJSON('/superset/queries_updates/', (data) => {
+      if (!this.unmounted) {
+        this.longPoll(data.seq);
+      }
+    })
+    .fail(() => {
+      if (!this.unmounted) {
+        this.startTimer();
+      }
+    });
   }
   componentWillUnmount() {
+    this.unmounted = true;
     this.stopTimer();
+    if (this.longPollRequest) {
+      this.longPollRequest.abort();
+    }
+  }
+  longPoll(seq) {
+    this.longPollRequest = $.getJSON('/superset/queries_updates/' + seq, (data) => {
+      if (Object.keys(data.queries).length > 0) {
+        this.props.actions.refreshQueries(data.queries);
+      }
+      this.props.actions.setNetworkStatus(true);
+      if (!this.unmounted) {
+        this.longPoll(data.seq);
+      }
+    })
+    .fail((xhr, status) => {
+      if (status === 'abort' || this.unmounted) {
+        return;
+      }
+      this.props.actions.setNetworkStatus(false);
+      setTimeout(() => {
+        if (!this.unmounted) {
+          this.longPoll(seq);
+        }
+      }, LONG_POLL_RETRY_MS);
+    });
   }
   startTimer() {
     if (!(this.timer)) {
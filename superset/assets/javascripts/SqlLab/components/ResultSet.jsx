@@ -129,6 +129,32 @@ class ResultSet extends React.PureComponent {
   reFetchQueryResults(query) {
     this.props.actions.reFetchQueryResults(query);
   }
+  renderTable(results, data) {
+    return (
+      <div className="ResultSet">
+        <Table
+          data={data.map(function (row) {
+            const newRow = {};
+            for (const k in row) {
+              const val = row[k];
+              if (typeof(val) === 'string') {
+                newRow[k] = val;
+              } else {
+                newRow[k] = JSON.stringify(val);
+              }
+            }
+            return newRow;
+          })}
+          columns={results.columns.map((col) => col.name)}
+          sortable
+          className="table table-condensed table-bordered"
+          filterBy={this.state.searchText}
+          filterable={results.columns.map((c) => c.name)}
+          hideFilterInput
+        />
+      </div>
+    );
+  }
   render() {
     const query = this.props.query;
     const results = query.results;
@@ -148,8 +174,24 @@ class ResultSet extends React.PureComponent {
     if (this.props.showSql) {
       sql = <HighlightedSql sql={query.sql} />;
     }
-    if (['running', 'pending', 'fetching'].indexOf(query.state) > -1) {
+    let ctasAlert;
+    if (query.state === 'success' && query.ctas) {
+      ctasAlert = (
+        <Alert bsStyle="info">
+          Table [<strong>{query.tempTable}</strong>] was
+          created &nbsp;
+          <Button
+            bsSize="small"
+            className="m-r-5"
+            onClick={this.popSelectStar.bind(this)}
+          >
+            Query in a new tab
+          </Button>
+        </Alert>);
+    }
+    if (['running', 'pending', 'queued', 'fetching'].indexOf(query.state) > -1) {
       let progressBar;
+      let queuePosition;
       if (query.progress > 0 && query.state === 'running') {
         progressBar = (
           <ProgressBar
@@ -158,30 +200,32 @@ class ResultSet extends React.PureComponent {
             label={`${query.progress}%`}
           />);
       }
+      if (query.state === 'queued' && query.queuePosition) {
+        queuePosition = (
+          <Alert bsStyle="info">
+            Waiting for the database, position in queue: {query.queuePosition}
+          </Alert>);
+      }
+      let partialResults;
+      if (results && data && data.length > 0) {
+        // the first pages of the results while the rest is fetched
+        partialResults = this.renderTable(results, data);
+      }
       return (
         <div>
           <img className="loading" alt="Loading..." src="/static/assets/images/loading.gif" />
+          {queuePosition}
           {progressBar}
+          {partialResults}
         </div>
       );
     } else if (query.state === 'failed') {
       return <Alert bsStyle="danger">{query.errorMessage}</Alert>;
-    } else if (query.state === 'success' && query.ctas) {
-      return (
-        <div>
-          <Alert bsStyle="info">
-            Table [<strong>{query.tempTable}</strong>] was
-            created &nbsp;
-            <Button
-              bsSize="small"
-              className="m-r-5"
-              onClick={this.popSelectStar.bind(this)}
-            >
-              Query in a new tab
-            </Button>
-          </Alert>
-        </div>);
+    } else if (query.state === 'success' && query.ctas && !query.results_truncated) {
+      return <div>{ctasAlert}</div>;
     } else if (query.state === 'success') {
+      // the truncated results of the queries spilled to a table are kept
+      // as a preview of the table
       if (results && data && data.length > 0) {
         return (
           <div>
@@ -190,30 +234,10 @@ class ResultSet extends React.PureComponent {
               query={this.props.query}
               onHide={this.hideModal.bind(this)}
             />
+            {ctasAlert}
             {this.getControls.bind(this)()}
             {sql}
-            <div className="ResultSet">
-              <Table
-                data={data.map(function (row) {
-                  const newRow = {};
-                  for (const k in row) {
-                    const val = row[k];
-                    if (typeof(val) === 'string') {
-                      newRow[k] = val;
-                    } else {
-                      newRow[k] = JSON.stringify(val);
-                    }
-                  }
-                  return newRow;
-                })}
-                columns={results.columns.map((col) => col.name)}
-                sortable
-                className="table table-condensed table-bordered"
-                filterBy={this.state.searchText}
-                filterable={results.columns.map((c) => c.name)}
-                hideFilterInput
-              />
-            </div>
+            {this.renderTable(results, data)}
           </div>
         );
       }
@@ -13,7 +13,7 @@ const propTypes = {
 export default function RunQueryActionButton(props) {
   const runBtnText = props.selectedText ? 'Run Selected Query' : 'Run Query';
   const btnStyle = props.selectedText ? 'warning' : 'primary';
-  const shouldShowStopBtn = ['running', 'pending'].indexOf(props.queryState) > -1;
+  const shouldShowStopBtn = ['running', 'pending', 'queued'].indexOf(props.queryState) > -1;
   const asyncToolTip = 'Run query asynchronously';
 
   const commonBtnProps = {
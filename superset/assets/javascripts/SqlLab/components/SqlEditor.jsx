@@ -118,6 +118,19 @@ class SqlEditor extends React.PureComponent {
         </OverlayTrigger>
       );
     }
+    if (this.props.latestQuery && this.props.latestQuery.results_truncated) {
+      const tooltip = (
+        <Tooltip id="tooltip">
+          The query results were too large and were truncated
+          to {this.props.latestQuery.rows} rows.
+        </Tooltip>
+      );
+      limitWarning = (
+        <OverlayTrigger placement="left" overlay={tooltip}>
+          <Label bsStyle="warning" className="m-r-5">TRUNCATED</Label>
+        </OverlayTrigger>
+      );
+    }
     let ctasControls;
     if (this.props.database && this.props.database.allow_ctas) {
       const ctasToolTip = 'Create table as with query results';
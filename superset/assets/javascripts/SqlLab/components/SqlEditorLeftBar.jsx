@@ -128,6 +128,9 @@ ${this.props.queryEditor.schema}/${input}`;
     if (!this.props.networkOn) {
       networkAlert = <p><Label bsStyle="danger">OFFLINE</Label></p>;
     }
+    // the server only sends the first page of the tables of large schemas,
+    // the others are searched as the user types
+    const tablesTruncated = this.state.tableLength > this.state.tableOptions.length;
     const shouldShowReset = window.location.search === '?reset=1';
     return (
       <div className="scrollbar-container">
@@ -164,7 +167,7 @@ ${this.props.queryEditor.schema}/${input}`;
             />
           </div>
           <div className="m-t-5">
-            {this.props.queryEditor.schema &&
+            {this.props.queryEditor.schema && !tablesTruncated &&
               <Select
                 name="select-table"
                 ref="selectTable"
@@ -176,12 +179,14 @@ ${this.props.queryEditor.schema}/${input}`;
                 options={this.state.tableOptions}
               />
             }
-            {!this.props.queryEditor.schema &&
+            {(!this.props.queryEditor.schema || tablesTruncated) &&
               <Select.Async
                 name="async-select-table"
                 ref="selectTable"
                 value={this.state.tableName}
-                placeholder={"Type to search ..."}
+                placeholder={tablesTruncated ?
+                  `Type to search (${this.state.tableLength})` :
+                  'Type to search ...'}
                 autosize={false}
                 onChange={this.changeTable.bind(this)}
                 loadOptions={this.getTableNamesBySubStr.bind(this)}
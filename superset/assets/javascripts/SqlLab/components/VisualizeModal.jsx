@@ -115,6 +115,7 @@ class VisualizeModal extends React.PureComponent {
       columns: this.state.columns,
       sql: this.props.query.executedSql,
       dbId: this.props.query.dbId,
+      resultsKey: this.props.query.resultsKey,
     };
     $.ajax({
       type: 'POST',
@@ -180,6 +180,18 @@ export const sqlLabReducer = function (state, action) {
       };
       return alterInObject(state, 'queries', action.query, alts);
     },
+    [actions.QUERY_PARTIAL_RESULTS]() {
+      if (action.query.state === 'stopped') {
+        return state;
+      }
+      const alts = {
+        results: action.results,
+        rows: action.results.data ? action.results.data.length : undefined,
+        state: 'running',
+        cached: false,
+      };
+      return alterInObject(state, 'queries', action.query, alts);
+    },
     [actions.QUERY_FAILED]() {
       if (action.query.state === 'stopped') {
         return state;
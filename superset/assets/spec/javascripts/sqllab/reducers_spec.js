@@ -38,6 +38,19 @@ describe('sqlLabReducer', () => {
       expect(newState.alerts).to.have.lengthOf(0);
     });
   });
+  describe('Partial results', () => {
+    const testQuery = { id: 'partial1', state: 'running', resultsKey: 'key' };
+    const results = { complete: false, columns: [{ name: 'a' }], data: [{ a: 1 }] };
+    let newState = Object.assign({}, initialState, { queries: { [testQuery.id]: testQuery } });
+    newState = r.sqlLabReducer(newState, actions.queryPartialResults(testQuery, results));
+    it('should keep the query running', () => {
+      expect(newState.queries[testQuery.id].state).to.equal('running');
+    });
+    it('should show the first rows', () => {
+      expect(newState.queries[testQuery.id].rows).to.equal(1);
+      expect(newState.queries[testQuery.id].results).to.equal(results);
+    });
+  });
   describe('Query editors actions', () => {
     let newState;
     let defaultQueryEditor;
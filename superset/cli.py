@@ -7,7 +7,7 @@ from __future__ import unicode_literals
 import logging
 import celery
 from celery.bin import worker as celery_worker
-from datetime import datetime
+from datetime import datetime, timedelta
 from subprocess import Popen
 
 from flask_migrate import MigrateCommand
@@ -152,21 +152,69 @@ def refresh_druid(datasource, merge):
 
 @manager.command
 def update_datasources_cache():
-    """Refresh sqllab datasources cache"""
-    from superset import models
+    """Refresh sqllab datasources cache and table name indexes"""
+    from superset import models, table_index
     for database in db.session.query(models.Database).all():
         print('Fetching {} datasources ...'.format(database.name))
         try:
-            database.all_table_names(force=True)
-            database.all_view_names(force=True)
+            spec = database.db_engine_spec
+            schemas = set(spec.refresh_result_sets(database, 'table'))
+            schemas |= set(spec.refresh_result_sets(database, 'view'))
+            # the names were just refreshed, only the indexes are rebuilt
+            for schema in sorted(schemas):
+                table_index.refresh_index(database, schema, force=False)
+            if schemas:
+                table_index.refresh_index(database, force=False)
+            print('Refreshed {} schemas'.format(len(schemas)))
         except Exception as e:
             print('{}'.format(e.message))
 
 
+@manager.option(
+    '-a', '--max-age', dest='max_age', default=None,
+    help="Also delete the results of the queries last changed more than "
+         "this many hours ago")
+def clean_results(max_age):
+    """Cleans up the expired SQL Lab results"""
+    from superset import models, results_backend, results_store
+    if not results_backend:
+        print("No results backend is configured")
+        return
+    if hasattr(results_backend, 'sweep'):
+        print("Removed {} expired results backend entries".format(
+            results_backend.sweep()))
+
+    session = db.session()
+    min_changed_on = None
+    if max_age:
+        min_changed_on = datetime.utcnow() - timedelta(hours=float(max_age))
+    queries = (
+        session.query(models.Query)
+        .filter(models.Query.results_key.isnot(None))
+    )
+    cleaned = 0
+    for query in queries:
+        if (
+                min_changed_on and query.changed_on and
+                query.changed_on < min_changed_on):
+            results_store.delete_results(results_backend, query.results_key)
+        elif results_store.get_index(results_backend, query.results_key):
+            continue
+        # the results are gone, the query has to be re-run to get them
+        query.results_key = None
+        cleaned += 1
+    session.commit()
+    print("Cleaned up the results of {} queries".format(cleaned))
+
+
 @manager.option(
     '-w', '--workers', default=config.get("SUPERSET_CELERY_WORKERS", 32),
     help="Number of celery server workers to fire up")
-def worker(workers):
+@manager.option(
+    '-q', '--queues', default=None,
+    help="Comma separated list of the queues to consume from, the databases "
+         "route their queries to the queue set as their Celery queue")
+def worker(workers, queues):
     """Starts a Superset worker for async SQL query execution."""
     # celery -A tasks worker --loglevel=info
     print("Starting SQL Celery worker.")
@@ -182,4 +230,6 @@ def worker(workers):
         'traceback': True,
         'concurrency': int(workers),
     }
+    if queues:
+        options['queues'] = queues
     c_worker.run(**options)
@@ -31,6 +31,9 @@ with open(PACKAGE_FILE) as package_file:
 
 ROW_LIMIT = 50000
 VIZ_ROW_LIMIT = 10000
+# Maximum number of independent queries a single visualization runs at once
+# (one per filter box field, time comparison, ...)
+VIZ_QUERY_CONCURRENCY = 4
 SUPERSET_WORKERS = 2
 SUPERSET_CELERY_WORKERS = 32
 
@@ -85,6 +88,28 @@ DRUID_IS_ACTIVE = True
 DRUID_TZ = tz.tzutc()
 DRUID_ANALYSIS_TYPES = ['cardinality']
 
+# The Druid query planner relies on the dimensions' cardinality collected
+# above to pick the query type. A single dimension with at least
+# DRUID_HIGH_CARDINALITY_THRESHOLD distinct values is queried with a topN
+# where each segment returns DRUID_HIGH_CARDINALITY_TOPN_THRESHOLD local
+# results. Multiple dimensions whose combined cardinality stays under
+# DRUID_LOW_CARDINALITY_THRESHOLD get their groupBy limit pushed down.
+DRUID_HIGH_CARDINALITY_THRESHOLD = 100000
+DRUID_HIGH_CARDINALITY_TOPN_THRESHOLD = 10000
+DRUID_LOW_CARDINALITY_THRESHOLD = 10000
+
+# Default context sent along with every Druid query, clusters and
+# datasources can override it. For instance:
+# DRUID_QUERY_CONTEXT = {'timeout': 60000, 'priority': 0, 'useCache': True}
+# When a timeout is set, queries exceeding it are also cancelled through the
+# broker.
+DRUID_QUERY_CONTEXT = {}
+
+# The time range used to look up the values of a Druid dimension for filter
+# dropdowns is widened to multiples of this many seconds, so that lookups
+# made within the same bucket share their cache entries.
+DRUID_VALUES_INTERVAL_BUCKET = 3600
+
 # ----------------------------------------------------
 # AUTHENTICATION CONFIG
 # ----------------------------------------------------
@@ -154,8 +179,25 @@ IMG_UPLOAD_URL = '/static/uploads/'
 
 CACHE_DEFAULT_TIMEOUT = 60 * 60 * 24
 CACHE_CONFIG = {'CACHE_TYPE': 'null'}
+
+# Number of seconds the JSON bootstrapping a dashboard is kept in the cache,
+# changes to the dashboard, its slices or their datasources invalidate it
+DASHBOARD_JSON_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Number of seconds the permissions of a user are kept in the cache, changes
+# to roles and permissions invalidate them
+PERMISSIONS_CACHE_TIMEOUT = 60
 TABLE_NAMES_CACHE_CONFIG = {'CACHE_TYPE': 'null'}
 
+# Number of seconds the table and view names of each schema are kept in the
+# table names cache, and number of threads listing the schemas of a
+# database at once. `superset update_datasources_cache` only lists the
+# schemas which changed again when the database tells which ones did, which
+# MySQL does. The other databases, Presto and Hive included, get all their
+# schemas listed, only the indexes of the ones which changed are rebuilt
+TABLE_NAMES_CACHE_TIMEOUT = 600
+TABLE_NAMES_FETCH_THREADS = 8
+
 # CORS Options
 ENABLE_CORS = False
 CORS_OPTIONS = {}
@@ -217,6 +259,16 @@ DISPLAY_SQL_MAX_ROW = 1000
 # Maximum number of tables/views displayed in the dropdown window in SQL Lab.
 MAX_TABLE_NAMES = 3000
 
+# Number of seconds the index searched for the table names of a schema is
+# used before being rebuilt from TABLE_NAMES_CACHE_CONFIG, and the maximum
+# number of schemas each process keeps indexes for.
+# `superset update_datasources_cache` rebuilds the indexes of all schemas.
+# With TABLE_NAMES_CACHE_CONFIG and CELERY_CONFIG set, the expired indexes
+# are rebuilt by a Celery worker while the stale ones keep being searched,
+# otherwise they are rebuilt by the request finding them expired
+TABLE_NAMES_INDEX_TIMEOUT = 600
+TABLE_NAMES_INDEX_MAX_SCHEMAS = 100
+
 # If defined, shows this text in an alert-warning box in the navbar
 # one example use case may be "STAGING" to make it clear that this is
 # not the production version of the site.
@@ -238,6 +290,46 @@ CELERY_CONFIG = None
 SQL_CELERY_DB_FILE_PATH = os.path.join(DATA_DIR, 'celerydb.sqlite')
 SQL_CELERY_RESULTS_DB_FILE_PATH = os.path.join(DATA_DIR, 'celery_results.sqlite')
 
+# CSV exports are streamed in chunks of this many rows, and gzip compressed
+# when the client accepts it and CSV_EXPORT_GZIP is set
+CSV_EXPORT_CHUNK_SIZE = 10000
+CSV_EXPORT_GZIP = True
+
+# Priorities of the async SQL Lab tasks, CREATE TABLE AS queries are batch
+# jobs and run after the interactive queries. Priorities are only honored
+# by brokers supporting them, RabbitMQ queues need x-max-priority set
+SQLLAB_INTERACTIVE_PRIORITY = 9
+SQLLAB_BATCH_PRIORITY = 0
+
+# Number of seconds after which the SQL Lab workers recycle their pooled
+# connections to the metadata database, -1 to keep them open
+SQLLAB_WORKER_POOL_RECYCLE = 3600
+
+# Running queries poll their database for progress at intervals growing from
+# SQLLAB_POLL_INTERVAL_MIN to SQLLAB_POLL_INTERVAL_MAX seconds while they
+# make no progress. Their progress goes through the cache and is only written
+# to the metadata database every SQLLAB_PROGRESS_WRITE_STEP percents, the
+# kill signal is also read from the metadata database every
+# SQLLAB_STOP_DB_CHECK_INTERVAL seconds. Without CACHE_CONFIG, the metadata
+# database is used on every poll.
+SQLLAB_POLL_INTERVAL_MIN = 0.5
+SQLLAB_POLL_INTERVAL_MAX = 5
+SQLLAB_PROGRESS_WRITE_STEP = 10
+SQLLAB_STOP_DB_CHECK_INTERVAL = 10
+SQLLAB_CHANNEL_TIMEOUT = 60 * 60 * 6
+
+# Number of seconds after which a query queued because its database runs
+# `max_concurrent_queries` already checks again for a free slot
+SQLLAB_QUEUED_RETRY_DELAY = 2
+
+# Number of times a queued query checks for a free slot before failing
+SQLLAB_QUEUED_MAX_RETRIES = 1800
+
+# Number of seconds an async SQL Lab query is given to run, running queries
+# not updated for longer than that no longer count towards the
+# `max_concurrent_queries` of their database
+SQLLAB_ASYNC_TIME_LIMIT_SEC = 60 * 60 * 6
+
 # static http headers to be served by your Superset server.
 # The following example prevents iFrame from other domains
 # and "clickjacking" as a result
@@ -255,9 +347,50 @@ SQLLAB_DEFAULT_DBID = None
 
 # An instantiated derivative of werkzeug.contrib.cache.BaseCache
 # if enabled, it can be used to store the results of long-running queries
-# in SQL Lab by using the "Run Async" button/feature
+# in SQL Lab by using the "Run Async" button/feature. On premise, results
+# can be kept on a volume shared by the web servers and the workers with
+# superset.results_backends.FileResultsCache, for instance
+# FileResultsCache('/var/lib/superset/results', max_bytes=50 * 1024 ** 3)
+# and expired results cleaned up periodically with `superset clean_results`
 RESULTS_BACKEND = None
 
+# Number of seconds the results of the SQL Lab queries are kept in the
+# results backend, 0 keeping them until they are evicted or cleaned up
+SQLLAB_RESULTS_TIMEOUT = 60 * 60 * 24
+
+# An instantiated derivative of werkzeug.contrib.cache.BaseCache shared by
+# the web servers and the Celery workers, used to push the state changes of
+# the SQL Lab queries to the browsers, or a superset.pubsub.InProcessPubSub
+# for a single web server process running the queries itself. SQL Lab then
+# long polls for the changes instead of polling the queries every second.
+# Each long poll holds a web server worker, so set it only with threaded or
+# async workers, `gunicorn -k gevent` for instance. When not set, SQL Lab
+# polls the queries
+PUBSUB_BACKEND = None
+
+# Number of seconds a long poll for SQL Lab query updates waits for changes,
+# it should be kept below SUPERSET_WEBSERVER_TIMEOUT
+SQLLAB_LONG_POLL_TIMEOUT = 25
+
+# Query results are fetched and stored in the results backend in pages of
+# this many rows, the memory used by workers grows with the page size
+# rather than with the size of the result set
+RESULTS_PAGE_SIZE = 10000
+
+# SQL Lab stops fetching results once they take more than this many bytes in
+# memory and flags them as truncated. With SQLLAB_SPILL_TO_CTAS set, queries
+# against databases allowing CREATE TABLE AS are then run again to store
+# their whole results in a table, the truncated results being kept as a
+# preview. The query runs twice then, which is why it is off by default
+SQLLAB_RESULTS_MAX_BYTES = 512 * 1024 * 1024
+SQLLAB_SPILL_TO_CTAS = False
+
+# The encoding of the pages stored in the results backend, either 'json' or
+# 'arrow'. Arrow pages keep columns in their native types and dictionary
+# encode strings, they are smaller and faster to load into DataFrames but
+# require pyarrow to be installed
+RESULTS_STORAGE_FORMAT = 'json'
+
 # A dictionary of items that gets merged into the Jinja context for
 # SQL Lab. The existing context gets updated with this dictionary,
 # meaning values for existing keys get overwritten by the content of this
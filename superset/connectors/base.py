@@ -1,6 +1,7 @@
 import json
 
 from sqlalchemy import Column, Integer, String, Text, Boolean
+from sqlalchemy.orm import subqueryload
 
 from superset import utils
 from superset.models.helpers import AuditMixinNullable, ImportMixin
@@ -15,6 +16,27 @@ class BaseDatasource(AuditMixinNullable, ImportMixin):
     # Used to do code highlighting when displaying the query in the UI
     query_language = None
 
+    # Whether the independent queries of a visualization can run on
+    # concurrent threads
+    concurrent_queries = True
+
+    def iter_query(self, query_obj, chunk_size):
+        """Yields the results of a query ``chunk_size`` rows at a time
+
+        The results are fetched whole and then split, the datasources able
+        to read their rows a chunk at a time override it.
+        """
+        df = self.query(query_obj).df
+        if df is None:
+            return
+        for i in range(0, max(len(df.index), 1), chunk_size):
+            yield df[i:i + chunk_size]
+
+    @classmethod
+    def eager_load_options(cls):
+        """Query options loading what rendering the datasource needs"""
+        return [subqueryload(cls.columns), subqueryload(cls.metrics)]
+
     @property
     def column_names(self):
         return sorted([c.column_name for c in self.columns])
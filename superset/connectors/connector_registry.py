@@ -1,3 +1,6 @@
+from collections import defaultdict
+
+from flask import g, has_request_context
 from sqlalchemy.orm import subqueryload
 
 
@@ -6,6 +9,19 @@ class ConnectorRegistry(object):
 
     sources = {}
 
+    @staticmethod
+    def request_datasources():
+        """Identity map of the datasources fetched during the request
+
+        Maps ``(datasource_type, datasource_id)`` to the datasources, None
+        outside of requests.
+        """
+        if not has_request_context():
+            return None
+        if not hasattr(g, 'datasources'):
+            g.datasources = {}
+        return g.datasources
+
     @classmethod
     def register_sources(cls, datasource_config):
         for module_name, class_names in datasource_config.items():
@@ -17,11 +33,54 @@ class ConnectorRegistry(object):
 
     @classmethod
     def get_datasource(cls, datasource_type, datasource_id, session):
-        return (
+        """Returns a datasource, fetched once per request"""
+        datasources = cls.request_datasources()
+        key = (datasource_type, datasource_id)
+        if datasources is not None and key in datasources:
+            return datasources[key]
+        datasource = (
             session.query(cls.sources[datasource_type])
             .filter_by(id=datasource_id)
             .first()
         )
+        if datasources is not None:
+            datasources[key] = datasource
+        return datasource
+
+    @classmethod
+    def get_eager_datasources(cls, session, datasource_keys):
+        """Fetches datasources along with their database, columns and metrics
+
+        The datasources are fetched with a query per datasource type and kept
+        in the identity map of the request.
+
+        :param datasource_keys: ``(datasource_type, datasource_id)`` tuples
+        :returns: dict of the datasources found, by key
+        """
+        datasources = cls.request_datasources()
+        if datasources is None:
+            datasources = {}
+        ids_by_type = defaultdict(set)
+        for datasource_type, datasource_id in datasource_keys:
+            if (datasource_type, datasource_id) not in datasources:
+                ids_by_type[datasource_type].add(datasource_id)
+        for datasource_type, datasource_ids in ids_by_type.items():
+            datasource_class = cls.sources.get(datasource_type)
+            if not datasource_class:
+                continue
+            qry = (
+                session.query(datasource_class)
+                .options(*datasource_class.eager_load_options())
+                .filter(datasource_class.id.in_(datasource_ids))
+            )
+            for datasource in qry:
+                datasources[(datasource_type, datasource.id)] = datasource
+            for datasource_id in datasource_ids:
+                # missing datasources aren't looked up again either
+                datasources.setdefault((datasource_type, datasource_id), None)
+        return {
+            key: datasources[key] for key in datasource_keys
+            if datasources.get(key) is not None}
 
     @classmethod
     def get_all_datasources(cls, session):
@@ -1,9 +1,12 @@
-from collections import OrderedDict
+from collections import namedtuple, OrderedDict
 import json
 import logging
+import math
 from copy import deepcopy
+import hashlib
 from datetime import datetime, timedelta
 from six import string_types
+import uuid
 
 import requests
 import sqlalchemy as sa
@@ -11,8 +14,9 @@ from sqlalchemy import (
     Column, Integer, String, ForeignKey, Text, Boolean,
     DateTime,
 )
-from sqlalchemy.orm import backref, relationship
+from sqlalchemy.orm import backref, joinedload, relationship
 from dateutil.parser import parse as dparse
+import pandas as pd
 
 from pydruid.client import PyDruid
 from pydruid.utils.aggregators import count
@@ -22,21 +26,25 @@ from pydruid.utils.postaggregator import (
 )
 from pydruid.utils.having import Aggregation
 
-from flask import Markup, escape
+from flask import g, Markup, escape
 from flask_appbuilder.models.decorators import renders
 from flask_appbuilder import Model
 
 from flask_babel import lazy_gettext as _
 
-from superset import conf, db, import_util, utils, sm, get_session
+from superset import cache, conf, db, import_util, utils, get_session
 from superset.utils import (
     flasher, MetricPermException, DimSelector, DTTM_ALIAS
 )
 from superset.connectors.base import BaseDatasource, BaseColumn, BaseMetric
+from superset.models.core import datasource_changed
 from superset.models.helpers import AuditMixinNullable, QueryResult, set_perm
 
 DRUID_TZ = conf.get("DRUID_TZ")
 
+DruidQueryPlan = namedtuple(
+    'DruidQueryPlan', ['query_type', 'threshold', 'context', 'reason'])
+
 
 class JavascriptPostAggregator(Postaggregator):
     def __init__(self, name, field_names, function):
@@ -67,16 +75,36 @@ class DruidCluster(Model, AuditMixinNullable):
     broker_endpoint = Column(String(255), default='druid/v2')
     metadata_last_refreshed = Column(DateTime)
     cache_timeout = Column(Integer)
+    query_context_json = Column(Text)
 
     def __repr__(self):
         return self.cluster_name
 
+    @property
+    def query_context(self):
+        if self.query_context_json:
+            return json.loads(self.query_context_json)
+        return {}
+
     def get_pydruid_client(self):
         cli = PyDruid(
             "http://{0}:{1}/".format(self.broker_host, self.broker_port),
             self.broker_endpoint)
         return cli
 
+    def cancel_query(self, query_id):
+        """Asks the broker to cancel the query tagged with ``query_id``"""
+        endpoint = (
+            "http://{obj.broker_host}:{obj.broker_port}/"
+            "{obj.broker_endpoint}/{query_id}"
+        ).format(obj=self, query_id=query_id)
+        try:
+            requests.delete(endpoint, timeout=5)
+        except requests.exceptions.RequestException as e:
+            logging.warning(
+                "Failed to cancel Druid query [{}]".format(query_id))
+            logging.exception(e)
+
     def get_datasources(self):
         endpoint = (
             "http://{obj.coordinator_host}:{obj.coordinator_port}/"
@@ -124,6 +152,7 @@ class DruidColumn(Model, BaseColumn):
         backref=backref('columns', cascade='all, delete-orphan'),
         enable_typechecks=False)
     dimension_spec_json = Column(Text)
+    cardinality = Column(Integer)
 
     export_fields = (
         'datasource_name', 'column_name', 'is_active', 'type', 'groupby',
@@ -310,6 +339,8 @@ class DruidDatasource(Model, BaseDatasource):
     query_langtage = "json"
     metric_class = DruidMetric
     cluster_class = DruidCluster
+    # the query timeout relies on SIGALRM, which only the main thread gets
+    concurrent_queries = False
 
     baselink = "druiddatasourcemodelview"
 
@@ -334,6 +365,7 @@ class DruidDatasource(Model, BaseDatasource):
     cache_timeout = Column(Integer)
     params = Column(String(1000))
     perm = Column(String(1000))
+    query_context_json = Column(Text)
 
     metric_cls = DruidMetric
     column_cls = DruidColumn
@@ -349,10 +381,55 @@ class DruidDatasource(Model, BaseDatasource):
             [(m.metric_name, m.verbose_name) for m in self.metrics],
             key=lambda x: x[1])
 
+    @classmethod
+    def eager_load_options(cls):
+        return (
+            super(DruidDatasource, cls).eager_load_options() +
+            [joinedload(cls.cluster)])
+
     @property
     def database(self):
         return self.cluster
 
+    @property
+    def query_context(self):
+        if self.query_context_json:
+            return json.loads(self.query_context_json)
+        return {}
+
+    def get_query_context(self, query_id):
+        """Druid query context for this datasource
+
+        Settings from ``DRUID_QUERY_CONTEXT`` are overridden by the cluster
+        ones, which are themselves overridden by the datasource ones.
+        """
+        context = dict(conf.get('DRUID_QUERY_CONTEXT') or {})
+        context.update(self.cluster.query_context)
+        context.update(self.query_context)
+        context['queryId'] = query_id
+        return context
+
+    def run_query(self, query_ids, run):
+        """Calls ``run`` within the query context's timeout budget
+
+        Druid enforces the context's timeout on its own, the client side
+        budget only kicks in when the broker doesn't answer in time. When
+        ``run`` fails, the queries tagged with ``query_ids`` get cancelled
+        as the broker would otherwise keep running the abandoned queries.
+        """
+        budget = self.get_query_context(query_ids[0]).get('timeout')
+        try:
+            if budget:
+                with utils.timeout(
+                        seconds=int(math.ceil(budget / 1000.0)) + 1,
+                        error_message="Druid query timed out"):
+                    return run()
+            return run()
+        except Exception:
+            for query_id in query_ids:
+                self.cluster.cancel_query(query_id)
+            raise
+
     @property
     def num_cols(self):
         return [c.column_name for c in self.columns if c.is_num]
@@ -470,7 +547,16 @@ class DruidDatasource(Model, BaseDatasource):
     def latest_metadata(self):
         """Returns segment metadata from the latest segment"""
         client = self.cluster.get_pydruid_client()
-        results = client.time_boundary(datasource=self.datasource_name)
+
+        def run(query_type, **kwargs):
+            query_id = self.new_query_id()
+            kwargs['context'] = self.get_query_context(query_id)
+            return self.run_query(
+                [query_id],
+                lambda: getattr(client, query_type)(
+                    datasource=self.datasource_name, **kwargs))
+
+        results = run('time_boundary')
         if not results:
             return
         max_time = results[0]['result']['maxTime']
@@ -485,8 +571,8 @@ class DruidDatasource(Model, BaseDatasource):
             rbound = (max_time - timedelta(1)).isoformat()
         segment_metadata = None
         try:
-            segment_metadata = client.segment_metadata(
-                datasource=self.datasource_name,
+            segment_metadata = run(
+                'segment_metadata',
                 intervals=lbound + '/' + rbound,
                 merge=self.merge_flag,
                 analysisTypes=conf.get('DRUID_ANALYSIS_TYPES'))
@@ -500,8 +586,8 @@ class DruidDatasource(Model, BaseDatasource):
             if not self.version_higher(self.cluster.druid_version, '0.8.2'):
                 rbound = datetime.now().isoformat()[:10]
             try:
-                segment_metadata = client.segment_metadata(
-                    datasource=self.datasource_name,
+                segment_metadata = run(
+                    'segment_metadata',
                     intervals=lbound + '/' + rbound,
                     merge=self.merge_flag,
                     analysisTypes=conf.get('DRUID_ANALYSIS_TYPES'))
@@ -629,6 +715,7 @@ class DruidDatasource(Model, BaseDatasource):
                 col_obj.count_distinct = True
             if col_obj:
                 col_obj.type = cols[col]['type']
+                col_obj.cardinality = cols[col].get('cardinality')
             session.flush()
             col_obj.datasource = datasource
             col_obj.generate_metrics()
@@ -692,31 +779,142 @@ class DruidDatasource(Model, BaseDatasource):
                           column_name,
                           from_dttm,
                           to_dttm,
-                          limit=500):
-        """Retrieve some values for the given column"""
-        # TODO: Use Lexicographic TopNMetricSpec once supported by PyDruid
+                          limit=500,
+                          prefix=None,
+                          page_after=None):
+        """Retrieve some values for the given column
+
+        Values come back in lexicographic order, optionally restricted to
+        the ones starting with ``prefix`` (case insensitive). Passing the
+        last value of a page as ``page_after`` returns the next page.
+        Pages are cached per datasource, column, prefix and time bucket so
+        that reopening a filter dropdown doesn't hit the broker again.
+        """
+        bucket = conf.get('DRUID_VALUES_INTERVAL_BUCKET')
+        if bucket:
+            from_dttm = utils.floor_datetime(from_dttm, bucket)
+            to_dttm = (
+                utils.floor_datetime(to_dttm, bucket) +
+                timedelta(seconds=bucket))
         from_dttm = from_dttm.replace(tzinfo=DRUID_TZ)
         to_dttm = to_dttm.replace(tzinfo=DRUID_TZ)
-
+        intervals = from_dttm.isoformat() + '/' + to_dttm.isoformat()
+
+        cache_key = 'druid_values:{}'.format(hashlib.md5(json.dumps([
+            self.id, column_name, prefix, page_after, limit, intervals,
+        ]).encode('utf-8')).hexdigest())
+        df = cache.get(cache_key) if cache else None
+        if df is not None:
+            return df
+
+        metric = {'type': 'lexicographic'}
+        if page_after:
+            metric['previousStop'] = page_after
         qry = dict(
             datasource=self.datasource_name,
             granularity="all",
-            intervals=from_dttm.isoformat() + '/' + to_dttm.isoformat(),
+            intervals=intervals,
             aggregations=dict(count=count("count")),
             dimension=column_name,
-            metric="count",
+            metric=metric,
             threshold=limit,
         )
-
+        if prefix:
+            qry['filter'] = Filter(
+                type="regex",
+                dimension=column_name,
+                pattern='(?i)^\\Q{}\\E'.format(prefix.replace('\\E', '')))
+
+        query_id = self.new_query_id()
+        qry['context'] = self.get_query_context(query_id)
         client = self.cluster.get_pydruid_client()
-        client.topn(**qry)
+        self.run_query([query_id], lambda: client.topn(**qry))
         df = client.export_pandas()
 
         if df is None or df.size == 0:
-            raise Exception(_("No data was returned."))
-
+            if not (prefix or page_after):
+                raise Exception(_("No data was returned."))
+            df = pd.DataFrame(columns=[column_name])
+
+        if cache:
+            cache_timeout = (
+                self.cache_timeout or self.cluster.cache_timeout or
+                conf.get('CACHE_DEFAULT_TIMEOUT'))
+            cache.set(cache_key, df, timeout=cache_timeout)
         return df
 
+    def get_query_plan(
+            self, groupby, granularity,
+            having_filters=None,
+            timeseries_limit=None,
+            row_limit=None):
+        """Picks the Druid query type for the given dimensions
+
+        The choice relies on the cardinality of the dimensions as collected
+        by ``segmentMetadata`` during the last metadata sync. Dimensions
+        for which the cardinality is unknown are treated the same way
+        they were before the planner existed.
+        """
+        high_cardinality = conf.get('DRUID_HIGH_CARDINALITY_THRESHOLD')
+        low_cardinality = conf.get('DRUID_LOW_CARDINALITY_THRESHOLD')
+        columns_dict = {c.column_name: c for c in self.columns}
+        cardinalities = [
+            columns_dict[gb].cardinality if gb in columns_dict else None
+            for gb in groupby]
+
+        if not groupby:
+            return DruidQueryPlan(
+                'timeseries', None, {}, "no dimension to group by")
+        if having_filters:
+            return DruidQueryPlan(
+                'groupBy', None, {}, "having filters require a groupBy")
+
+        if len(groupby) == 1:
+            threshold = timeseries_limit or 1000
+            if row_limit and granularity == 'all':
+                threshold = row_limit
+            cardinality = cardinalities[0]
+            if (
+                    cardinality and high_cardinality and
+                    cardinality >= high_cardinality):
+                # Raising minTopNThreshold makes every segment return more
+                # local candidates, which keeps the approximate topN
+                # accurate on dimensions with many distinct values
+                min_threshold = max(
+                    threshold,
+                    conf.get('DRUID_HIGH_CARDINALITY_TOPN_THRESHOLD') or 0)
+                context = {}
+                if min_threshold > threshold:
+                    context['minTopNThreshold'] = min_threshold
+                return DruidQueryPlan(
+                    'topN', threshold, context,
+                    "single dimension of high cardinality ({})".format(
+                        cardinality))
+            reason = "single dimension"
+            if cardinality:
+                reason += " of cardinality {}".format(cardinality)
+            return DruidQueryPlan('topN', threshold, {}, reason)
+
+        combined = None
+        if all(cardinalities):
+            combined = 1
+            for cardinality in cardinalities:
+                combined *= cardinality
+        if (
+                combined and row_limit and low_cardinality and
+                combined <= low_cardinality):
+            # With few combinations every historical holds all the
+            # candidate groups, so applying the limit before the merge on
+            # the broker doesn't change the results
+            return DruidQueryPlan(
+                'groupBy', None, {'forceLimitPushDown': True},
+                "low cardinality combination ({}), "
+                "limit pushed down".format(combined))
+        reason = "multiple dimensions"
+        if combined:
+            reason += " of combined cardinality {}".format(combined)
+        return DruidQueryPlan('groupBy', None, {}, reason)
+
     def get_query_str(  # noqa / druid
             self, client, qry_start_dttm,
             groupby, metrics,
@@ -731,7 +929,7 @@ class DruidDatasource(Model, BaseDatasource):
             orderby=None,
             extras=None,  # noqa
             select=None,  # noqa
-            columns=None, phase=2):
+            columns=None, phase=2, query_id=None):
         """Runs a query against Druid and returns a dataframe.
 
         This query interface is common to SqlAlchemy and Druid
@@ -810,11 +1008,13 @@ class DruidDatasource(Model, BaseDatasource):
             if m.metric_name in all_metrics:
                 aggregations[m.metric_name] = m.json_obj
 
+        # superset.security imports the connectors, which import this module
+        from superset import security
         rejected_metrics = [
             m.metric_name for m in self.metrics
             if m.is_restricted and
             m.metric_name in aggregations.keys() and
-            not sm.has_access('metric_access', m.perm)
+            not security.can_access('metric_access', m.perm, g.user)
         ]
 
         if rejected_metrics:
@@ -853,19 +1053,28 @@ class DruidDatasource(Model, BaseDatasource):
         if having_filters:
             qry['having'] = having_filters
 
+        plan = self.get_query_plan(
+            groupby, granularity,
+            having_filters=having_filters,
+            timeseries_limit=timeseries_limit,
+            row_limit=row_limit)
+        query_str += "// Query plan: {} ({})\n".format(
+            plan.query_type, plan.reason)
+        qry['context'] = self.get_query_context(
+            query_id or self.new_query_id())
+        qry['context'].update(plan.context)
+
         orig_filters = filters
-        if len(groupby) == 0:
+        if plan.query_type == 'timeseries':
             del qry['dimensions']
             client.timeseries(**qry)
-        if not having_filters and len(groupby) == 1:
-            qry['threshold'] = timeseries_limit or 1000
-            if row_limit and granularity == 'all':
-                qry['threshold'] = row_limit
+        elif plan.query_type == 'topN':
+            qry['threshold'] = plan.threshold
             qry['dimension'] = list(qry.get('dimensions'))[0]
             del qry['dimensions']
             qry['metric'] = list(qry['aggregations'].keys())[0]
             client.topn(**qry)
-        elif len(groupby) > 1 or having_filters:
+        else:
             # If grouping on multiple fields or using a having filter
             # we have to force a groupby query
             if timeseries_limit and is_timeseries:
@@ -875,6 +1084,8 @@ class DruidDatasource(Model, BaseDatasource):
                 # Limit on the number of timeseries, doing a two-phases query
                 pre_qry = deepcopy(qry)
                 pre_qry['granularity'] = "all"
+                pre_qry['context']['queryId'] = self.pre_query_id(
+                    qry['context']['queryId'])
                 pre_qry['limit_spec'] = {
                     "type": "default",
                     "limit": timeseries_limit,
@@ -934,10 +1145,23 @@ class DruidDatasource(Model, BaseDatasource):
             client.query_builder.last_query.query_dict, indent=2)
         return query_str
 
+    @staticmethod
+    def new_query_id():
+        return 'superset-{}'.format(uuid.uuid4())
+
+    @staticmethod
+    def pre_query_id(query_id):
+        """Id of the first phase of a two-phase query"""
+        return '{}-phase1'.format(query_id)
+
     def query(self, query_obj):
         qry_start_dttm = datetime.now()
         client = self.cluster.get_pydruid_client()
-        query_str = self.get_query_str(client, qry_start_dttm, **query_obj)
+        query_id = self.new_query_id()
+        query_str = self.run_query(
+            [self.pre_query_id(query_id), query_id],
+            lambda: self.get_query_str(
+                client, qry_start_dttm, query_id=query_id, **query_obj))
         df = client.export_pandas()
 
         if df is None or df.size == 0:
@@ -1060,3 +1284,4 @@ class DruidDatasource(Model, BaseDatasource):
 
 sa.event.listen(DruidDatasource, 'after_insert', set_perm)
 sa.event.listen(DruidDatasource, 'after_update', set_perm)
+sa.event.listen(DruidDatasource, 'after_update', datasource_changed)
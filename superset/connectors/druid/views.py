@@ -23,13 +23,14 @@ class DruidColumnInlineView(CompactCRUDMixin, SupersetModelView):  # noqa
         'groupby', 'count_distinct', 'sum', 'min', 'max']
     add_columns = edit_columns
     list_columns = [
-        'column_name', 'type', 'groupby', 'filterable', 'count_distinct',
-        'sum', 'min', 'max']
+        'column_name', 'type', 'cardinality', 'groupby', 'filterable',
+        'count_distinct', 'sum', 'min', 'max']
     can_delete = False
     page_size = 500
     label_columns = {
         'column_name': _("Column"),
         'type': _("Type"),
+        'cardinality': _("Cardinality"),
         'datasource': _("Datasource"),
         'groupby': _("Groupable"),
         'filterable': _("Filterable"),
@@ -106,6 +107,7 @@ class DruidClusterModelView(SupersetModelView, DeleteMixin):  # noqa
         'cluster_name',
         'coordinator_host', 'coordinator_port', 'coordinator_endpoint',
         'broker_host', 'broker_port', 'broker_endpoint', 'cache_timeout',
+        'query_context_json',
     ]
     edit_columns = add_columns
     list_columns = ['cluster_name', 'metadata_last_refreshed']
@@ -117,9 +119,19 @@ class DruidClusterModelView(SupersetModelView, DeleteMixin):  # noqa
         'broker_host': _("Broker Host"),
         'broker_port': _("Broker Port"),
         'broker_endpoint': _("Broker Endpoint"),
+        'query_context_json': _("Query Context"),
+    }
+    description_columns = {
+        'query_context_json': utils.markdown(
+            "JSON [query context]"
+            "(http://druid.io/docs/latest/querying/query-context.html) "
+            "sent along with every query, for instance `timeout`, "
+            "`priority`, `useCache` or `populateCache`.",
+            True),
     }
 
     def pre_add(self, cluster):
+        utils.validate_json(cluster.query_context_json)
         security.merge_perm(sm, 'database_access', cluster.perm)
 
     def pre_update(self, cluster):
@@ -147,13 +159,20 @@ class DruidDatasourceModelView(SupersetModelView, DeleteMixin):  # noqa
     edit_columns = [
         'datasource_name', 'cluster', 'description', 'owner',
         'is_featured', 'is_hidden', 'filter_select_enabled',
-        'default_endpoint', 'offset', 'cache_timeout']
+        'default_endpoint', 'offset', 'cache_timeout', 'query_context_json']
     add_columns = edit_columns
     show_columns = add_columns + ['perm']
     page_size = 500
     base_order = ('datasource_name', 'asc')
     description_columns = {
         'offset': _("Timezone offset (in hours) for this datasource"),
+        'query_context_json': utils.markdown(
+            "JSON [query context]"
+            "(http://druid.io/docs/latest/querying/query-context.html) "
+            "sent along with every query, for instance `timeout`, "
+            "`priority`, `useCache` or `populateCache`. Overrides the "
+            "cluster's settings.",
+            True),
         'description': Markup(
             "Supports <a href='"
             "https://daringfireball.net/projects/markdown/'>markdown</a>"),
@@ -170,9 +189,11 @@ class DruidDatasourceModelView(SupersetModelView, DeleteMixin):  # noqa
         'default_endpoint': _("Default Endpoint"),
         'offset': _("Time Offset"),
         'cache_timeout': _("Cache Timeout"),
+        'query_context_json': _("Query Context"),
     }
 
     def pre_add(self, datasource):
+        utils.validate_json(datasource.query_context_json)
         number_of_existing_datasources = db.session.query(
             sqla.func.count('*')).filter(
             models.DruidDatasource.datasource_name ==
@@ -191,6 +212,9 @@ class DruidDatasourceModelView(SupersetModelView, DeleteMixin):  # noqa
         if datasource.schema:
             security.merge_perm(sm, 'schema_access', datasource.schema_perm)
 
+    def pre_update(self, datasource):
+        utils.validate_json(datasource.query_context_json)
+
     def post_update(self, datasource):
         self.post_add(datasource)
 
@@ -12,7 +12,7 @@ import sqlalchemy as sa
 from sqlalchemy import asc, and_, desc, select
 from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.sql.expression import ColumnClause, TextAsFrom
-from sqlalchemy.orm import backref, relationship
+from sqlalchemy.orm import backref, joinedload, relationship
 from sqlalchemy.sql import table, literal_column, text, column
 
 from flask import escape, Markup
@@ -26,7 +26,7 @@ from superset.utils import (
     DTTM_ALIAS, QueryStatus
 )
 from superset.models.helpers import QueryResult
-from superset.models.core import Database
+from superset.models.core import Database, datasource_changed
 from superset.jinja_context import get_template_processor
 from superset.models.helpers import set_perm
 
@@ -201,6 +201,12 @@ class SqlaTable(Model, BaseDatasource):
     def __repr__(self):
         return self.name
 
+    @classmethod
+    def eager_load_options(cls):
+        return (
+            super(SqlaTable, cls).eager_load_options() +
+            [joinedload(cls.database)])
+
     @property
     def description_markeddown(self):
         return utils.markdown(self.description)
@@ -289,9 +295,14 @@ class SqlaTable(Model, BaseDatasource):
                           column_name,
                           from_dttm,
                           to_dttm,
-                          limit=500):
+                          limit=500,
+                          prefix=None,
+                          page_after=None):
         """Runs query against sqla to retrieve some
         sample values for the given column.
+
+        ``prefix`` and ``page_after`` narrow and page the values the same
+        way they do for Druid.
         """
         granularity = self.main_dttm_col
 
@@ -304,6 +315,13 @@ class SqlaTable(Model, BaseDatasource):
         qry = qry.distinct(column_name)
         qry = qry.limit(limit)
 
+        if prefix:
+            qry = qry.where(target_col.sqla_col.ilike(prefix + '%'))
+        if page_after:
+            qry = qry.where(target_col.sqla_col > page_after)
+        if prefix or page_after:
+            qry = qry.order_by(target_col.sqla_col)
+
         if granularity:
             dttm_col = cols[granularity]
             timestamp = dttm_col.sqla_col.label('timestamp')
@@ -338,8 +356,14 @@ class SqlaTable(Model, BaseDatasource):
             inner_to_dttm=None,
             orderby=None,
             extras=None,
-            columns=None):
-        """Querying any sqla table from this common interface"""
+            columns=None,
+            grouping_sets=False):
+        """Querying any sqla table from this common interface
+
+        With ``grouping_sets``, each of the ``groupby`` columns is
+        aggregated on its own through ``GROUP BY GROUPING SETS`` in a
+        single scan, rows of the other sets hold NULLs for that column.
+        """
         template_kwargs = {
             'from_dttm': from_dttm,
             'groupby': groupby,
@@ -440,7 +464,14 @@ class SqlaTable(Model, BaseDatasource):
             from_sql = template_processor.process_template(self.sql)
             tbl = TextAsFrom(sa.text(from_sql), []).alias('expr_qry')
 
-        if not columns:
+        if grouping_sets and groupby_exprs:
+            db_engine_spec = self.database.db_engine_spec
+            qry = qry.group_by(literal_column(
+                db_engine_spec.grouping_sets_clause([
+                    '{}'.format(expr.compile(
+                        engine, compile_kwargs={"literal_binds": True}))
+                    for expr in groupby_exprs])))
+        elif not columns:
             qry = qry.group_by(*groupby_exprs)
 
         where_clause_and = []
@@ -539,6 +570,12 @@ class SqlaTable(Model, BaseDatasource):
             query=sql,
             error_message=error_message)
 
+    def iter_query(self, query_obj, chunk_size):
+        """Yields the results of a query read a chunk at a time"""
+        sql = self.get_query_str(
+            self.database.get_sqla_engine(), datetime.now(), **query_obj)
+        return self.database.iter_dfs(sql, None, chunk_size)
+
     def get_sqla_table_object(self):
         return self.database.get_table(self.table_name, schema=self.schema)
 
@@ -670,3 +707,4 @@ class SqlaTable(Model, BaseDatasource):
 
 sa.event.listen(SqlaTable, 'after_insert', set_perm)
 sa.event.listen(SqlaTable, 'after_update', set_perm)
+sa.event.listen(SqlaTable, 'after_update', datasource_changed)
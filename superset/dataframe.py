@@ -13,77 +13,219 @@ from __future__ import unicode_literals
 import pandas as pd
 import numpy as np
 
+from superset import utils
+from superset.db_engine_specs import BaseEngineSpec, ColumnKind
+
 
 INFER_COL_TYPES_THRESHOLD = 95
 INFER_COL_TYPES_SAMPLE_SIZE = 100
 
 
 class SupersetDataFrame(object):
+
+    """Wraps the DataFrame of a result set, which keeps its native dtypes
+
+    Nulls are turned into ``None`` as the values are read, column by column,
+    rather than by rewriting the whole frame as objects.
+    """
+
     def __init__(self, df):
-        self.__df = df.where((pd.notnull(df)), None)
+        self.__df = df
+        self.__columns = None
 
     @property
     def size(self):
         return len(self.__df.index)
 
+    @property
+    def column_names(self):
+        return list(self.__df.columns)
+
+    @property
+    def columnar_data(self):
+        """The list of the values of each column, nulls being None"""
+        return [
+            column_values(self.__df.iloc[:, i])
+            for i in range(len(self.__df.columns))]
+
     @property
     def data(self):
-        return self.__df.to_dict(orient='records')
+        return records_from_columns(self.column_names, self.columnar_data)
 
     @property
     def columns(self):
         """Provides metadata about columns for data visualization.
 
+        The types are inferred the first time the property is read only.
+
         :return: dict, with the fields name, type, is_date, is_dim and agg.
         """
         if self.__df.empty:
             return None
-
-        columns = []
-        sample_size = min(INFER_COL_TYPES_SAMPLE_SIZE, len(self.__df.index))
-        sample = self.__df
-        if sample_size:
-            sample = self.__df.sample(sample_size)
-        for col in self.__df.dtypes.keys():
-            column = {
-                'name': col,
-                'type': self.__df.dtypes[col].name,
-                'is_date': is_date(self.__df.dtypes[col]),
-                'is_dim': is_dimension(self.__df.dtypes[col], col),
-            }
-            agg = agg_func(self.__df.dtypes[col], col)
-            if agg_func:
-                column['agg'] = agg
-
-            if column['type'] == 'object':
-                # check if encoded datetime
-                if (datetime_conversion_rate(sample[col]) >
-                        INFER_COL_TYPES_THRESHOLD):
-                    column.update({
-                        'type': 'datetime_string',
-                        'is_date': True,
-                        'is_dim': False,
-                        'agg': None
-                    })
-            # 'agg' is optional attribute
-            if not column['agg']:
+        if self.__columns is None:
+            self.__columns = infer_columns(self.__df)
+        return self.__columns
+
+
+class DataFrameBuilder(object):
+
+    """Builds DataFrames out of the rows fetched from a DB-API cursor
+
+    The kind of each column is looked up once, from the type code of
+    ``cursor.description`` and the type mappings of the engine spec. Every
+    batch of rows is then transposed and each column copied into a buffer
+    of its type: int, float and bool columns go straight to numpy arrays
+    while the columns of unknown kinds have their type inferred by pandas.
+    Lists and dicts are serialized to JSON in the nested columns, and in the
+    columns of unknown kinds starting with one, when ``serialize_nested``
+    is set.
+    """
+
+    def __init__(
+            self, description, db_engine_spec=None, names=None,
+            serialize_nested=True):
+        db_engine_spec = db_engine_spec or BaseEngineSpec
+        description = description or []
+        self.names = (
+            list(names) if names is not None
+            else [col[0] for col in description])
+        self.kinds = [
+            db_engine_spec.get_column_kind(col[1]) for col in description]
+        self.serialize_nested = serialize_nested
+
+    def build(self, rows):
+        """Returns the DataFrame of a batch of rows"""
+        rows = list(rows)
+        if rows:
+            values = list(zip(*rows))
+        else:
+            values = [() for _ in self.names]
+        data = {}
+        for i, kind in enumerate(self.kinds):
+            data[i] = self.build_column(kind, values[i])
+        df = pd.DataFrame(data, columns=range(len(self.names)))
+        df.columns = self.names
+        return df
+
+    def build_column(self, kind, values):
+        if kind == ColumnKind.NESTED or kind is None:
+            if self.serialize_nested and (
+                    kind == ColumnKind.NESTED or
+                    (values and isinstance(values[0], (list, dict)))):
+                return [
+                    utils.json_dumps_w_dates(v)
+                    if isinstance(v, (list, dict)) else v
+                    for v in values]
+            return list(values)
+
+        has_nulls = None in values
+        if kind == ColumnKind.INT and not has_nulls:
+            dtype = np.int64
+        elif kind in (ColumnKind.INT, ColumnKind.FLOAT):
+            # nulls become NaN, as pandas does
+            dtype = np.float64
+        elif kind == ColumnKind.BOOL and not has_nulls:
+            dtype = np.bool_
+        else:
+            return list(values)
+        buf = np.empty(len(values), dtype=dtype)
+        try:
+            buf[:] = values
+        except (TypeError, ValueError, OverflowError):
+            # values out of the bounds of the type, or not of the type
+            return list(values)
+        return buf
+
+
+def column_values(series):
+    """Returns the values of a series as a list, nulls being None
+
+    Only the positions flagged by the null mask are rewritten.
+
+    >>> column_values(pd.Series([1.5, np.nan, 2]))
+    [1.5, None, 2.0]
+    >>> column_values(pd.Series([1, None], dtype=object))
+    [1, None]
+    """
+    values = series.tolist()
+    mask = pd.isnull(series).values
+    if mask.any():
+        for i in np.flatnonzero(mask):
+            values[i] = None
+    return values
+
+
+def records_from_columns(names, columns):
+    """Turns the lists of values of columns into a list of records
+
+    >>> records = records_from_columns(['a', 'b'], [[1, 2], [3, None]])
+    >>> [(r['a'], r['b']) for r in records]
+    [(1, 3), (2, None)]
+    """
+    return [dict(zip(names, row)) for row in zip(*columns)]
+
+
+def infer_columns(df):
+    """Infers the type of the columns of a DataFrame from a sample of rows"""
+    sample_size = min(INFER_COL_TYPES_SAMPLE_SIZE, len(df.index))
+    sample = df
+    if sample_size:
+        sample = df.sample(sample_size)
+    columns = []
+    for col, dtype in df.dtypes.iteritems():
+        column = {
+            'name': col,
+            'type': dtype.name,
+            'is_date': is_date(dtype),
+            'is_dim': is_dimension(dtype, col),
+        }
+        agg = agg_func(dtype, col)
+        # 'agg' is optional attribute
+        if agg:
+            column['agg'] = agg
+
+        if column['type'] == 'object':
+            # check if encoded datetime
+            if (datetime_conversion_rate(sample[col]) >
+                    INFER_COL_TYPES_THRESHOLD):
+                column.update({
+                    'type': 'datetime_string',
+                    'is_date': True,
+                    'is_dim': False,
+                })
                 column.pop('agg', None)
-            columns.append(column)
-        return columns
+        columns.append(column)
+    return columns
 
 
 # It will give false positives on the numbers that are stored as strings.
 # It is hard to distinguish integer numbers and timestamps
 def datetime_conversion_rate(data_series):
-    success = 0
-    total = 0
-    for value in data_series:
-        total += 1
-        try:
-            pd.to_datetime(value)
-            success += 1
-        except Exception:
-            continue
+    """Percentage of the values of a series that parse as datetimes
+
+    The values are parsed in a single vectorized call, nulls count as parsed.
+
+    >>> datetime_conversion_rate(
+    ...     pd.Series(['2017-01-01', 'a', None, '2017-01-02 10:00']))
+    75.0
+    """
+    values = data_series.dropna()
+    total = len(data_series)
+    if not total:
+        return 0
+    nulls = total - len(values)
+    try:
+        parsed = pd.to_datetime(values, errors='coerce')
+        success = nulls + int(parsed.notnull().sum())
+    except Exception:
+        # mixing timezones for instance fails the conversion as a whole
+        success = nulls
+        for value in values:
+            try:
+                pd.to_datetime(value)
+                success += 1
+            except Exception:
+                continue
     return 100 * success / total
 
 
@@ -19,18 +19,23 @@ from __future__ import unicode_literals
 from collections import namedtuple, defaultdict
 from superset import utils
 
+import hashlib
 import inspect
+from multiprocessing.pool import ThreadPool
 import re
 import sqlparse
 import textwrap
-import time
 
-from superset import cache_util
+from superset import app, cache_util, tables_cache
+from superset.query_channel import QueryMonitor
+import sqlalchemy as sqla
 from sqlalchemy import select
 from sqlalchemy.sql import text
 from superset.utils import SupersetTemplateException
-from superset.utils import QueryStatus
 from flask_babel import lazy_gettext as _
+from past.builtins import basestring
+
+config = app.config
 
 Grain = namedtuple('Grain', 'name label function')
 
@@ -41,11 +46,51 @@ class LimitMethod(object):
     WRAP_SQL = 'wrap_sql'
 
 
+class ColumnKind(object):
+    """Enum of the ways to build the columns of a result set"""
+    INT = 'int'
+    FLOAT = 'float'
+    BOOL = 'bool'
+    # lists, dicts and structs serialized to JSON
+    NESTED = 'nested'
+
+
 class BaseEngineSpec(object):
     engine = 'base'  # str as defined in sqlalchemy.engine.engine
     cursor_execute_kwargs = {}
     time_grains = tuple()
     limit_method = LimitMethod.FETCH_MANY
+    supports_grouping_sets = False
+    # Maps the DB-API type codes of cursor.description to column kinds, for
+    # the drivers describing columns with numeric type codes
+    type_code_kinds = {}
+    # Column kinds of the drivers describing columns with type names
+    type_name_kinds = (
+        (re.compile(r'^(tinyint|smallint|int|integer|bigint)(_type)?$', re.I),
+         ColumnKind.INT),
+        (re.compile(r'^(real|float|double)(_type)?$', re.I), ColumnKind.FLOAT),
+        (re.compile(r'^boolean(_type)?$', re.I), ColumnKind.BOOL),
+        (re.compile(r'^(array|map|row|struct)\b', re.I), ColumnKind.NESTED),
+    )
+
+    @classmethod
+    def get_column_kind(cls, type_code):
+        """Returns the ColumnKind of a DB-API type code, None if unknown
+
+        Columns of unknown kinds have their type inferred from their values.
+        """
+        if type_code is None:
+            return None
+        if isinstance(type_code, basestring):
+            for regex, kind in cls.type_name_kinds:
+                if regex.match(type_code):
+                    return kind
+            return None
+        try:
+            return cls.type_code_kinds.get(type_code)
+        except TypeError:
+            # DB-API type objects aren't always hashable
+            return None
 
     @classmethod
     def fetch_data(cls, cursor, limit):
@@ -53,6 +98,28 @@ class BaseEngineSpec(object):
             return cursor.fetchmany(limit)
         return cursor.fetchall()
 
+    @classmethod
+    def fetch_data_in_batches(cls, cursor, limit, batch_size):
+        """Yields the rows of the cursor ``batch_size`` rows at a time
+
+        When the limit isn't enforced in the SQL itself, no more than
+        ``limit`` rows are fetched.
+        """
+        if not cursor.description:
+            return
+        fetched = 0
+        while True:
+            size = batch_size
+            if limit and cls.limit_method == LimitMethod.FETCH_MANY:
+                size = min(batch_size, limit - fetched)
+                if size <= 0:
+                    return
+            batch = cursor.fetchmany(size)
+            if not batch:
+                return
+            fetched += len(batch)
+            yield batch
+
     @classmethod
     def epoch_to_dttm(cls):
         raise NotImplementedError()
@@ -70,10 +137,69 @@ class BaseEngineSpec(object):
     def convert_dttm(cls, target_type, dttm):
         return "'{}'".format(dttm.strftime('%Y-%m-%d %H:%M:%S'))
 
+    @classmethod
+    def grouping_sets_clause(cls, exprs):
+        """GROUP BY clause of one grouping set per expression
+
+        :param exprs: the SQL of the expressions
+        """
+        return 'GROUPING SETS ({})'.format(
+            ', '.join('({})'.format(expr) for expr in exprs))
+
     @classmethod
     @cache_util.memoized_func(
-        timeout=600,
-        key=lambda *args, **kwargs: 'db:{}:{}'.format(args[0].id, args[1]))
+        timeout=config.get('TABLE_NAMES_CACHE_TIMEOUT'),
+        key=lambda *args, **kwargs: 'db:{}:schemas'.format(args[0].id))
+    def fetch_schema_names(cls, db, force=False):
+        return sorted(db.inspector.get_schema_names())
+
+    @classmethod
+    @cache_util.memoized_func(
+        timeout=config.get('TABLE_NAMES_CACHE_TIMEOUT'),
+        key=lambda *args, **kwargs: 'db:{}:{}:{}'.format(
+            args[0].id, args[1], args[2]))
+    def fetch_schema_result_sets(
+            cls, db, datasource_type, schema, force=False, engine=None):
+        """Returns the sorted names of the tables or views of a schema"""
+        inspector = sqla.inspect(engine) if engine else db.inspector
+        if datasource_type == 'table':
+            return sorted(inspector.get_table_names(schema))
+        elif datasource_type == 'view':
+            try:
+                return sorted(inspector.get_view_names(schema))
+            except NotImplementedError:
+                pass
+        return []
+
+    @classmethod
+    def fetch_schemas_result_sets(
+            cls, db, datasource_type, schemas, force=False):
+        """Returns the dictionary {schema : [result_set_name]} of schemas
+
+        The schemas are listed concurrently by up to
+        ``TABLE_NAMES_FETCH_THREADS`` threads sharing the engine of the
+        database and its connection pool.
+        """
+        engine = db.get_sqla_engine()
+
+        def fetch(schema):
+            return cls.fetch_schema_result_sets(
+                db, datasource_type, schema, force=force, engine=engine)
+
+        threads = min(
+            config.get('TABLE_NAMES_FETCH_THREADS') or 1, len(schemas))
+        if threads > 1:
+            pool = ThreadPool(threads)
+            try:
+                result_sets = pool.map(fetch, schemas)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            result_sets = [fetch(schema) for schema in schemas]
+        return dict(zip(schemas, result_sets))
+
+    @classmethod
     def fetch_result_sets(cls, db, datasource_type, force=False):
         """Returns the dictionary {schema : [result_set_name]}.
 
@@ -81,22 +207,68 @@ class BaseEngineSpec(object):
         Empty schema corresponds to the list of full names of the all
         tables or views: <schema>.<result_set_name>.
         """
-        schemas = db.inspector.get_schema_names()
-        result_sets = {}
+        schemas = cls.fetch_schema_names(db, force=force)
+        result_sets = cls.fetch_schemas_result_sets(
+            db, datasource_type, schemas, force=force)
         all_result_sets = []
         for schema in schemas:
-            if datasource_type == 'table':
-                result_sets[schema] = sorted(
-                    db.inspector.get_table_names(schema))
-            elif datasource_type == 'view':
-                result_sets[schema] = sorted(
-                    db.inspector.get_view_names(schema))
             all_result_sets += [
                 '{}.{}'.format(schema, t) for t in result_sets[schema]]
         if all_result_sets:
             result_sets[""] = all_result_sets
         return result_sets
 
+    @classmethod
+    def fetch_change_markers(cls, db, datasource_type):
+        """Returns the dictionary {schema : marker} of the database
+
+        The marker of a schema changes whenever tables or views are added
+        to it, dropped or renamed, so that only the schemas whose marker
+        changed are listed again. None when the engine can't tell.
+        """
+        return None
+
+    @staticmethod
+    def result_sets_markers(result_sets):
+        """Returns the dictionary {schema : marker} of listed schemas
+
+        The markers are digests of the names of the tables or views of the
+        schemas, for the engines which can't tell which schemas changed
+        without listing them.
+        """
+        return {
+            schema: hashlib.md5(
+                '\n'.join(sorted(names)).encode('utf-8')).hexdigest()
+            for schema, names in result_sets.items()}
+
+    @classmethod
+    def refresh_result_sets(cls, db, datasource_type):
+        """Lists the schemas which changed since the last refresh again
+
+        Every schema is listed when the engine doesn't provide change
+        markers, their listings then tell which ones changed. Returns the
+        names of the schemas which changed.
+        """
+        schemas = cls.fetch_schema_names(db, force=True)
+        markers = cls.fetch_change_markers(db, datasource_type)
+        markers_key = 'db:{}:{}:markers'.format(db.id, datasource_type)
+        previous = tables_cache.get(markers_key) if tables_cache else None
+        if markers is not None and previous is not None:
+            schemas = [
+                schema for schema in schemas
+                if markers.get(schema) != previous.get(schema)]
+        result_sets = cls.fetch_schemas_result_sets(
+            db, datasource_type, schemas, force=True)
+        if markers is None:
+            markers = cls.result_sets_markers(result_sets)
+            if previous is not None:
+                schemas = [
+                    schema for schema in schemas
+                    if markers.get(schema) != previous.get(schema)]
+        if tables_cache:
+            tables_cache.set(markers_key, markers, timeout=0)
+        return schemas
+
     @classmethod
     def handle_cursor(cls, cursor, query, session):
         """Handle a live cursor between the execute and fetchall calls
@@ -156,6 +328,28 @@ class BaseEngineSpec(object):
 
 class PostgresEngineSpec(BaseEngineSpec):
     engine = 'postgresql'
+    supports_grouping_sets = True
+    # type OIDs, from pg_type
+    type_code_kinds = {
+        16: ColumnKind.BOOL,
+        20: ColumnKind.INT,
+        21: ColumnKind.INT,
+        23: ColumnKind.INT,
+        700: ColumnKind.FLOAT,
+        701: ColumnKind.FLOAT,
+        114: ColumnKind.NESTED,  # json
+        3802: ColumnKind.NESTED,  # jsonb
+        199: ColumnKind.NESTED,  # json[]
+        1000: ColumnKind.NESTED,  # bool[]
+        1005: ColumnKind.NESTED,  # int2[]
+        1007: ColumnKind.NESTED,  # int4[]
+        1009: ColumnKind.NESTED,  # text[]
+        1015: ColumnKind.NESTED,  # varchar[]
+        1016: ColumnKind.NESTED,  # int8[]
+        1021: ColumnKind.NESTED,  # float4[]
+        1022: ColumnKind.NESTED,  # float8[]
+        3807: ColumnKind.NESTED,  # jsonb[]
+    }
 
     time_grains = (
         Grain("Time Column", _('Time Column'), "{col}"),
@@ -211,6 +405,17 @@ class SqliteEngineSpec(BaseEngineSpec):
 
 class MySQLEngineSpec(BaseEngineSpec):
     engine = 'mysql'
+    # MySQLdb.constants.FIELD_TYPE
+    type_code_kinds = {
+        1: ColumnKind.INT,  # TINY
+        2: ColumnKind.INT,  # SHORT
+        3: ColumnKind.INT,  # LONG
+        8: ColumnKind.INT,  # LONGLONG
+        9: ColumnKind.INT,  # INT24
+        13: ColumnKind.INT,  # YEAR
+        4: ColumnKind.FLOAT,  # FLOAT
+        5: ColumnKind.FLOAT,  # DOUBLE
+    }
     time_grains = (
         Grain('Time Column', _('Time Column'), '{col}'),
         Grain("second", _('second'), "DATE_ADD(DATE({col}), "
@@ -245,9 +450,23 @@ class MySQLEngineSpec(BaseEngineSpec):
     def epoch_to_dttm(cls):
         return "from_unixtime({col})"
 
+    @classmethod
+    def fetch_change_markers(cls, db, datasource_type):
+        # the number of tables of the schema and a checksum of their names
+        qry = text("""
+            SELECT table_schema, COUNT(*), SUM(CRC32(table_name))
+            FROM information_schema.tables
+            WHERE table_type = :table_type
+            GROUP BY table_schema""")
+        table_type = 'VIEW' if datasource_type == 'view' else 'BASE TABLE'
+        rows = db.get_sqla_engine().execute(qry, table_type=table_type)
+        return {
+            row[0]: '{}:{}'.format(row[1], row[2]) for row in rows}
+
 
 class PrestoEngineSpec(BaseEngineSpec):
     engine = 'presto'
+    supports_grouping_sets = True
 
     time_grains = (
         Grain('Time Column', _('Time Column'), '{col}'),
@@ -298,7 +517,7 @@ class PrestoEngineSpec(BaseEngineSpec):
 
     @classmethod
     @cache_util.memoized_func(
-        timeout=600,
+        timeout=config.get('TABLE_NAMES_CACHE_TIMEOUT'),
         key=lambda *args, **kwargs: 'db:{}:{}'.format(args[0].id, args[1]))
     def fetch_result_sets(cls, db, datasource_type, force=False):
         """Returns the dictionary {schema : [result_set_name]}.
@@ -318,6 +537,19 @@ class PrestoEngineSpec(BaseEngineSpec):
                 row['table_schema'], row['table_name']))
         return result_sets
 
+    @classmethod
+    def fetch_schema_result_sets(
+            cls, db, datasource_type, schema, force=False, engine=None):
+        return cls.fetch_result_sets(
+            db, datasource_type, force=force).get(schema, [])
+
+    @classmethod
+    def fetch_schemas_result_sets(
+            cls, db, datasource_type, schemas, force=False):
+        # a single query lists the tables of all the schemas
+        result_sets = cls.fetch_result_sets(db, datasource_type, force=force)
+        return {schema: result_sets.get(schema, []) for schema in schemas}
+
     @classmethod
     def extra_table_metadata(cls, database, table_name, schema_name):
         indexes = database.get_indexes(table_name, schema_name)
@@ -341,29 +573,26 @@ class PrestoEngineSpec(BaseEngineSpec):
     @classmethod
     def handle_cursor(cls, cursor, query, session):
         """Updates progress information"""
+        monitor = QueryMonitor(query, session)
         polled = cursor.poll()
         # poll returns dict -- JSON status information or ``None``
         # if the query is done
         # https://github.com/dropbox/PyHive/blob/
         # b34bdbf51378b3979eaf5eca9e956f06ddc36ca0/pyhive/presto.py#L178
         while polled:
-            # Update the object and wait for the kill signal.
-            stats = polled.get('stats', {})
-
-            query = session.query(type(query)).filter_by(id=query.id).one()
-            if query.status == QueryStatus.STOPPED:
+            # Update the progress and check for the kill signal.
+            if monitor.is_stopped():
                 cursor.cancel()
                 break
 
+            stats = polled.get('stats', {})
             if stats:
                 completed_splits = float(stats.get('completedSplits'))
                 total_splits = float(stats.get('totalSplits'))
                 if total_splits and completed_splits:
-                    progress = 100 * (completed_splits / total_splits)
-                    if progress > query.progress:
-                        query.progress = progress
-                    session.commit()
-            time.sleep(1)
+                    monitor.update_progress(
+                        100 * (completed_splits / total_splits))
+            monitor.wait()
             polled = cursor.poll()
 
     @classmethod
@@ -509,6 +738,13 @@ class HiveEngineSpec(PrestoEngineSpec):
     engine = 'hive'
     cursor_execute_kwargs = {'async': True}
 
+    @classmethod
+    def grouping_sets_clause(cls, exprs):
+        # Hive lists the grouped expressions ahead of their grouping sets
+        return '{} {}'.format(
+            ', '.join(exprs),
+            super(HiveEngineSpec, cls).grouping_sets_clause(exprs))
+
     @classmethod
     def patch(cls):
         from pyhive import hive
@@ -524,13 +760,24 @@ class HiveEngineSpec(PrestoEngineSpec):
         hive.Cursor.fetch_logs = patched_hive.fetch_logs
 
     @classmethod
-    @cache_util.memoized_func(
-        timeout=600,
-        key=lambda *args, **kwargs: 'db:{}:{}'.format(args[0].id, args[1]))
     def fetch_result_sets(cls, db, datasource_type, force=False):
-        return BaseEngineSpec.fetch_result_sets(
+        # Hive has no information schema, the schemas are listed through
+        # the inspector
+        return super(PrestoEngineSpec, cls).fetch_result_sets(
             db, datasource_type, force=force)
 
+    @classmethod
+    def fetch_schema_result_sets(
+            cls, db, datasource_type, schema, force=False, engine=None):
+        return super(PrestoEngineSpec, cls).fetch_schema_result_sets(
+            db, datasource_type, schema, force=force, engine=engine)
+
+    @classmethod
+    def fetch_schemas_result_sets(
+            cls, db, datasource_type, schemas, force=False):
+        return super(PrestoEngineSpec, cls).fetch_schemas_result_sets(
+            db, datasource_type, schemas, force=force)
+
     @classmethod
     def progress(cls, logs):
         # 17/02/07 19:36:38 INFO ql.Driver: Total jobs = 5
@@ -583,20 +830,17 @@ class HiveEngineSpec(PrestoEngineSpec):
             hive.ttypes.TOperationState.INITIALIZED_STATE,
             hive.ttypes.TOperationState.RUNNING_STATE,
         )
+        monitor = QueryMonitor(query, session)
         polled = cursor.poll()
         while polled.operationState in unfinished_states:
-            query = session.query(type(query)).filter_by(id=query.id)
-            if query.status == QueryStatus.STOPPED:
+            if monitor.is_stopped():
                 cursor.cancel()
                 break
 
             resp = cursor.fetch_logs()
             if resp and resp.log:
-                progress = cls.progress(resp.log)
-                if progress > query.progress:
-                    query.progress = progress
-                session.commit()
-            time.sleep(5)
+                monitor.update_progress(cls.progress(resp.log))
+            monitor.wait()
             polled = cursor.poll()
 
     @classmethod
@@ -664,6 +908,7 @@ class MssqlEngineSpec(BaseEngineSpec):
 
 class RedshiftEngineSpec(PostgresEngineSpec):
     engine = 'redshift'
+    supports_grouping_sets = False
 
 
 class OracleEngineSpec(PostgresEngineSpec):
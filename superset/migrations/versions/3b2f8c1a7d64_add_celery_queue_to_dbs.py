@@ -0,0 +1,26 @@
+"""add celery queue and concurrency limit to dbs, queue position to query
+
+Revision ID: 3b2f8c1a7d64
+Revises: a6c18f869a4e
+Create Date: 2017-04-03 14:27:51.906238
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3b2f8c1a7d64'
+down_revision = 'a6c18f869a4e'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('dbs', sa.Column('celery_queue', sa.String(length=250), nullable=True))
+    op.add_column('dbs', sa.Column('max_concurrent_queries', sa.Integer(), nullable=True))
+    op.add_column('query', sa.Column('queue_position', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('query', 'queue_position')
+    op.drop_column('dbs', 'max_concurrent_queries')
+    op.drop_column('dbs', 'celery_queue')
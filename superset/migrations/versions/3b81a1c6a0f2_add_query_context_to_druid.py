@@ -0,0 +1,24 @@
+"""add query context to druid clusters and datasources
+
+Revision ID: 3b81a1c6a0f2
+Revises: 7f2635b51f5d
+Create Date: 2017-03-23 15:40:07.239405
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3b81a1c6a0f2'
+down_revision = '7f2635b51f5d'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('clusters', sa.Column('query_context_json', sa.Text(), nullable=True))
+    op.add_column('datasources', sa.Column('query_context_json', sa.Text(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('datasources', 'query_context_json')
+    op.drop_column('clusters', 'query_context_json')
@@ -0,0 +1,22 @@
+"""add cardinality to druid column
+
+Revision ID: 7f2635b51f5d
+Revises: b318dfe5fb6c
+Create Date: 2017-03-21 10:12:44.516211
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7f2635b51f5d'
+down_revision = 'b318dfe5fb6c'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('columns', sa.Column('cardinality', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('columns', 'cardinality')
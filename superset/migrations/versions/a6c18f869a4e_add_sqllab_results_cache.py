@@ -0,0 +1,28 @@
+"""add the sql lab results cache columns to dbs and query
+
+Revision ID: a6c18f869a4e
+Revises: 3b81a1c6a0f2
+Create Date: 2017-03-29 10:12:45.118304
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a6c18f869a4e'
+down_revision = '3b81a1c6a0f2'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('dbs', sa.Column('results_cache_timeout', sa.Integer(), nullable=True))
+    op.add_column('query', sa.Column('results_cache_key', sa.String(length=64), nullable=True))
+    op.add_column('query', sa.Column('results_cache_hit', sa.Boolean(), nullable=True))
+    op.create_index(op.f('ix_query_results_cache_key'), 'query', ['results_cache_key'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_query_results_cache_key'), table_name='query')
+    op.drop_column('query', 'results_cache_hit')
+    op.drop_column('query', 'results_cache_key')
+    op.drop_column('dbs', 'results_cache_timeout')
@@ -0,0 +1,22 @@
+"""add results_truncated to query
+
+Revision ID: e8f4a2c5d9b1
+Revises: 3b2f8c1a7d64
+Create Date: 2017-04-07 11:05:32.614720
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e8f4a2c5d9b1'
+down_revision = '3b2f8c1a7d64'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('query', sa.Column('results_truncated', sa.Boolean(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('query', 'results_truncated')
@@ -5,17 +5,19 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import functools
+import hashlib
 import json
 import logging
-import numpy
+import os
 import pickle
 import re
 import textwrap
+import threading
+import uuid
 from future.standard_library import install_aliases
 from copy import copy
 from datetime import datetime, date
 
-import pandas as pd
 import sqlalchemy as sqla
 from sqlalchemy.engine.url import make_url
 from sqlalchemy.orm import subqueryload
@@ -31,11 +33,13 @@ from sqlalchemy import (
 )
 from sqlalchemy.orm import backref, relationship
 from sqlalchemy.orm.session import make_transient
+from sqlalchemy.pool import NullPool
 from sqlalchemy.sql import text
 from sqlalchemy.sql.expression import TextAsFrom
 from sqlalchemy_utils import EncryptedType
 
-from superset import app, db, db_engine_specs, utils, sm
+from superset import (
+    app, cache, dataframe, db, db_engine_specs, utils, sm, pubsub_backend)
 from superset.connectors.connector_registry import ConnectorRegistry
 from superset.viz import viz_types
 from superset.utils import QueryStatus
@@ -45,6 +49,20 @@ from urllib import parse  # noqa
 
 config = app.config
 
+# Engines are kept around so that their connection pools get reused from
+# one query to the next. They are kept by process, since pooled connections
+# can't be shared with forked processes, database and schema, along with a
+# digest of their url and params so that editing the database replaces them.
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def dispose_engines(database_id):
+    """Closes the pooled connections of a database in this process"""
+    with _engines_lock:
+        for key in [key for key in _engines if key[1] == database_id]:
+            _engines.pop(key)[1].dispose()
+
 
 def set_related_perm(mapper, connection, target):  # noqa
     src_class = target.cls_model
@@ -119,12 +137,11 @@ class Slice(Model, AuditMixinNullable, ImportMixin):
         return self.get_datasource
 
     @datasource.getter
-    @utils.memoized
     def get_datasource(self):
-        ds = db.session.query(
-            self.cls_model).filter_by(
-            id=self.datasource_id).first()
-        return ds
+        if getattr(self, '_datasource', None) is None:
+            self._datasource = ConnectorRegistry.get_datasource(
+                self.datasource_type, self.datasource_id, db.session)
+        return self._datasource
 
     @renders('datasource_name')
     def datasource_link(self):
@@ -150,14 +167,6 @@ class Slice(Model, AuditMixinNullable, ImportMixin):
     @property
     def data(self):
         """Data used to render slice in templates"""
-        d = {}
-        self.token = ''
-        try:
-            d = self.viz.data
-            self.token = d.get('token')
-        except Exception as e:
-            logging.exception(e)
-            d['error'] = str(e)
         return {
             'datasource': self.datasource_name,
             'description': self.description,
@@ -318,6 +327,31 @@ class Dashboard(Model, AuditMixinNullable, ImportMixin):
     def datasources(self):
         return {slc.datasource for slc in self.slices}
 
+    @classmethod
+    def get_eager(cls, session, dashboard_id_or_slug):
+        """Fetches a dashboard along with everything rendering it needs
+
+        Its slices and owners are eagerly loaded and the datasources of the
+        slices are fetched with a query per datasource type, which saves a
+        query per slice and per datasource relationship.
+        """
+        qry = session.query(cls).options(
+            subqueryload(cls.slices),
+            subqueryload(cls.owners),
+        )
+        if '{}'.format(dashboard_id_or_slug).isdigit():
+            qry = qry.filter_by(id=int(dashboard_id_or_slug))
+        else:
+            qry = qry.filter_by(slug=dashboard_id_or_slug)
+        dash = qry.one()
+        datasources = ConnectorRegistry.get_eager_datasources(
+            session,
+            {(slc.datasource_type, slc.datasource_id) for slc in dash.slices})
+        for slc in dash.slices:
+            slc._datasource = datasources.get(
+                (slc.datasource_type, slc.datasource_id))
+        return dash
+
     @property
     def sqla_metadata(self):
         metadata = MetaData(bind=self.get_sqla_engine())
@@ -328,6 +362,37 @@ class Dashboard(Model, AuditMixinNullable, ImportMixin):
         return Markup(
             '<a href="{self.url}">{title}</a>'.format(**locals()))
 
+    @property
+    def version(self):
+        """Token changing whenever the dashboard, its slices or their
+        datasources change, None when no cache is configured"""
+        if not cache:
+            return None
+        key = dashboard_version_key(self.id)
+        version = cache.get(key)
+        if version is None:
+            version = uuid.uuid4().hex
+            cache.set(key, version)
+        return version
+
+    def get_cached_json_data(self):
+        """Returns the json_data of the dashboard and its ETag
+
+        They are cached for the current version of the dashboard.
+        """
+        version = self.version
+        key = 'dashboard_json_{}_{}'.format(self.id, version)
+        cached = cache.get(key) if version else None
+        if cached is None:
+            json_data = self.json_data
+            etag = hashlib.md5(json_data.encode('utf-8')).hexdigest()
+            cached = (json_data, etag)
+            if version:
+                cache.set(
+                    key, cached,
+                    timeout=config.get('DASHBOARD_JSON_CACHE_TIMEOUT'))
+        return cached
+
     @property
     def json_data(self):
         positions = self.position_json
@@ -497,6 +562,70 @@ class Dashboard(Model, AuditMixinNullable, ImportMixin):
         })
 
 
+def dashboard_version_key(dashboard_id):
+    return 'dashboard_version_{}'.format(dashboard_id)
+
+
+def invalidate_dashboards(target, dashboard_ids):
+    """Marks dashboards for their cached JSON to be dropped on commit
+
+    The versions only change once the changes are committed, so that the
+    JSON cached in between doesn't reflect uncommitted changes.
+    """
+    session = sqla.orm.object_session(target)
+    if session is not None:
+        session.info.setdefault('changed_dashboards', set()).update(
+            dashboard_ids)
+
+
+def dashboard_changed(mapper, connection, target):
+    invalidate_dashboards(target, [target.id])
+
+
+def slice_changed(mapper, connection, target):
+    qry = (
+        sqla.select([dashboard_slices.c.dashboard_id])
+        .where(dashboard_slices.c.slice_id == target.id)
+    )
+    invalidate_dashboards(
+        target, [row[0] for row in connection.execute(qry)])
+
+
+def datasource_changed(mapper, connection, target):
+    slices = Slice.__table__
+    qry = (
+        sqla.select([dashboard_slices.c.dashboard_id])
+        .select_from(dashboard_slices.join(
+            slices, slices.c.id == dashboard_slices.c.slice_id))
+        .where(sqla.and_(
+            slices.c.datasource_type == target.type,
+            slices.c.datasource_id == target.id))
+    )
+    invalidate_dashboards(
+        target, [row[0] for row in connection.execute(qry)])
+
+
+def bump_dashboard_versions(session):
+    dashboard_ids = session.info.pop('changed_dashboards', None)
+    if cache and dashboard_ids:
+        for dashboard_id in dashboard_ids:
+            cache.set(dashboard_version_key(dashboard_id), uuid.uuid4().hex)
+
+
+def discard_dashboard_changes(session):
+    session.info.pop('changed_dashboards', None)
+
+
+sqla.event.listen(Dashboard, 'after_update', dashboard_changed)
+sqla.event.listen(Dashboard, 'after_delete', dashboard_changed)
+sqla.event.listen(Slice, 'after_update', slice_changed)
+# the links to the dashboards are gone after the delete
+sqla.event.listen(Slice, 'before_delete', slice_changed)
+sqla.event.listen(sqla.orm.Session, 'after_commit', bump_dashboard_versions)
+sqla.event.listen(
+    sqla.orm.Session, 'after_rollback', discard_dashboard_changes)
+
+
 class Database(Model, AuditMixinNullable):
 
     """An ORM object that stores Database related information"""
@@ -516,6 +645,13 @@ class Database(Model, AuditMixinNullable):
     allow_ctas = Column(Boolean, default=False)
     allow_dml = Column(Boolean, default=False)
     force_ctas_schema = Column(String(250))
+    # SQL Lab reuses the stored results of an identical query run within
+    # this many seconds, results aren't reused when not set
+    results_cache_timeout = Column(Integer)
+    # Celery queue the async SQL Lab queries are routed to, and the number
+    # of those that can run at the same time
+    celery_queue = Column(String(250))
+    max_concurrent_queries = Column(Integer)
     extra = Column(Text, default=textwrap.dedent("""\
     {
         "metadata_params": {},
@@ -545,12 +681,34 @@ class Database(Model, AuditMixinNullable):
         conn.password = password_mask if conn.password else None
         self.sqlalchemy_uri = str(conn)  # hides the password
 
-    def get_sqla_engine(self, schema=None):
+    def get_sqla_engine(self, schema=None, nullpool=False):
+        """Returns an engine, pooled unless ``nullpool`` is set
+
+        SQL Lab doesn't pool its connections, which carry the session state
+        (SET, USE, temporary tables) left by the queries of the users.
+        """
         extra = self.get_extra()
         url = make_url(self.sqlalchemy_uri_decrypted)
         params = extra.get('engine_params', {})
         url.database = self.get_database_for_various_backend(url, schema)
-        return create_engine(url, **params)
+        if nullpool:
+            return create_engine(url, poolclass=NullPool, **params)
+        if self.id is None:
+            return create_engine(url, **params)
+
+        digest = hashlib.md5(json.dumps(
+            [str(url), params], sort_keys=True, default=str,
+        ).encode('utf-8')).hexdigest()
+        key = (os.getpid(), self.id, schema)
+        with _engines_lock:
+            cached = _engines.get(key)
+            if cached and cached[0] == digest:
+                return cached[1]
+            if cached:
+                cached[1].dispose()
+            engine = create_engine(url, **params)
+            _engines[key] = (digest, engine)
+        return engine
 
     def get_database_for_various_backend(self, uri, default_database=None):
         database = uri.database
@@ -578,21 +736,31 @@ class Database(Model, AuditMixinNullable):
         sql = sql.strip().strip(';')
         eng = self.get_sqla_engine(schema=schema)
         cur = eng.execute(sql, schema=schema)
-        cols = [col[0] for col in cur.cursor.description]
-        df = pd.DataFrame(cur.fetchall(), columns=cols)
-
-        def needs_conversion(df_series):
-            if df_series.empty:
-                return False
-            for df_type in [list, dict]:
-                if isinstance(df_series[0], df_type):
-                    return True
-            return False
-
-        for k, v in df.dtypes.iteritems():
-            if v.type == numpy.object_ and needs_conversion(df[k]):
-                df[k] = df[k].apply(utils.json_dumps_w_dates)
-        return df
+        builder = dataframe.DataFrameBuilder(
+            cur.cursor.description, self.db_engine_spec)
+        return builder.build(cur.fetchall())
+
+    def iter_dfs(self, sql, schema, chunk_size):
+        """Yields the results of a query in DataFrames of ``chunk_size`` rows
+
+        Rows are read through a server-side cursor with the drivers that
+        support it, so that the whole result set is never held in memory.
+        At least one DataFrame, possibly empty, is yielded.
+        """
+        sql = sql.strip().strip(';')
+        eng = self.get_sqla_engine(schema=schema)
+        with eng.connect() as conn:
+            cur = conn.execution_options(stream_results=True).execute(sql)
+            builder = dataframe.DataFrameBuilder(
+                cur.cursor.description, self.db_engine_spec)
+            rows = cur.fetchmany(chunk_size)
+            while True:
+                yield builder.build(rows)
+                if len(rows) < chunk_size:
+                    break
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
 
     def compile_sqla_query(self, qry, schema=None):
         eng = self.get_sqla_engine(schema=schema)
@@ -630,7 +798,8 @@ class Database(Model, AuditMixinNullable):
             tables_dict = self.db_engine_spec.fetch_result_sets(
                 self, 'table', force=force)
             return tables_dict.get("", [])
-        return sorted(self.inspector.get_table_names(schema))
+        return self.db_engine_spec.fetch_schema_result_sets(
+            self, 'table', schema, force=force)
 
     def all_view_names(self, schema=None, force=False):
         if not schema:
@@ -639,7 +808,8 @@ class Database(Model, AuditMixinNullable):
             return views_dict.get("", [])
         views = []
         try:
-            views = self.inspector.get_view_names(schema)
+            views = self.db_engine_spec.fetch_schema_result_sets(
+                self, 'view', schema, force=force)
         except Exception:
             pass
         return views
@@ -711,8 +881,15 @@ class Database(Model, AuditMixinNullable):
         return (
             "[{obj.database_name}].(id:{obj.id})").format(obj=self)
 
+
+def database_changed(mapper, connection, target):
+    dispose_engines(target.id)
+
+
 sqla.event.listen(Database, 'after_insert', set_perm)
 sqla.event.listen(Database, 'after_update', set_perm)
+sqla.event.listen(Database, 'after_update', database_changed)
+sqla.event.listen(Database, 'after_delete', database_changed)
 
 
 class Log(Model):
@@ -811,15 +988,23 @@ class Query(Model):
     limit = Column(Integer)
     limit_used = Column(Boolean, default=False)
     limit_reached = Column(Boolean, default=False)
+    # whether fetching stopped at SQLLAB_RESULTS_MAX_BYTES
+    results_truncated = Column(Boolean, default=False)
     select_as_cta = Column(Boolean)
     select_as_cta_used = Column(Boolean, default=False)
 
     progress = Column(Integer, default=0)  # 1..100
+    # position in the database's queue while the query is queued
+    queue_position = Column(Integer)
     # # of rows in the result set or rows modified.
     rows = Column(Integer)
     error_message = Column(Text)
     # key used to store the results in the results backend
     results_key = Column(String(64), index=True)
+    # identifies the queries whose results can be reused, and whether the
+    # results of this one were taken from an identical earlier query
+    results_cache_key = Column(String(64), index=True)
+    results_cache_hit = Column(Boolean, default=False)
 
     # Using Numeric in place of DateTime for sub-second precision
     # stored as seconds since epoch, allowing for milliseconds
@@ -858,6 +1043,7 @@ class Query(Model):
             'id': self.client_id,
             'limit': self.limit,
             'progress': self.progress,
+            'queuePosition': self.queue_position,
             'rows': self.rows,
             'schema': self.schema,
             'ctas': self.select_as_cta,
@@ -871,7 +1057,9 @@ class Query(Model):
             'userId': self.user_id,
             'user': self.user.username,
             'limit_reached': self.limit_reached,
+            'results_truncated': self.results_truncated,
             'resultsKey': self.results_key,
+            'resultsCacheHit': self.results_cache_hit,
         }
 
     @property
@@ -882,6 +1070,46 @@ class Query(Model):
         tab = re.sub(r'\W+', '', tab)
         return "sqllab_{tab}_{ts}".format(**locals())
 
+    @staticmethod
+    def get_updates_channel(user_id):
+        """Name of the pubsub channel the changes of a user's queries go to"""
+        return 'sqllab_queries_{}'.format(user_id)
+
+
+# attributes whose changes are pushed to SQL Lab
+QUERY_PUSHED_ATTRIBUTES = (
+    'status', 'progress', 'rows', 'error_message', 'results_key',
+    'queue_position', 'end_time', 'select_sql', 'tmp_table_name')
+
+
+def collect_query_updates(session, flush_context):
+    """Keeps the state of the queries changed in a flush until the commit"""
+    if not pubsub_backend:
+        return
+    updates = session.info.setdefault('query_updates', {})
+    for obj in session.new | session.dirty:
+        if not isinstance(obj, Query) or not obj.user_id:
+            continue
+        state = sqla.inspect(obj)
+        if obj in session.new or any(
+                state.attrs[attr].history.has_changes()
+                for attr in QUERY_PUSHED_ATTRIBUTES):
+            updates[obj.id] = (obj.user_id, obj.to_dict())
+
+
+def publish_query_updates(session):
+    for user_id, query in session.info.pop('query_updates', {}).values():
+        pubsub_backend.publish(Query.get_updates_channel(user_id), query)
+
+
+def discard_query_updates(session):
+    session.info.pop('query_updates', None)
+
+
+sqla.event.listen(sqla.orm.Session, 'after_flush', collect_query_updates)
+sqla.event.listen(sqla.orm.Session, 'after_commit', publish_query_updates)
+sqla.event.listen(sqla.orm.Session, 'after_rollback', discard_query_updates)
+
 
 class DatasourceAccessRequest(Model, AuditMixinNullable):
     """ORM model for the access requests for datasources and dbs."""
@@ -0,0 +1,131 @@
+"""Publish/subscribe channels used to push events to the web clients
+
+Events published on a channel are numbered, subscribers long poll a channel
+for the events following the last one they got. ``InProcessPubSub`` only
+reaches the subscribers of the process the events are published from, while
+``CachePubSub`` goes through a cache shared by the web servers and the
+workers.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from collections import deque
+import threading
+import time
+
+
+class PubSub(object):
+
+    """Interface of the publish/subscribe backends"""
+
+    def publish(self, channel, event):
+        raise NotImplementedError()
+
+    def last_seq(self, channel):
+        """Returns the sequence number of the last event of a channel"""
+        raise NotImplementedError()
+
+    def listen(self, channel, since, timeout):
+        """Waits for events published after the ``since`` sequence number
+
+        Returns the last sequence number of the channel and the list of
+        ``(seq, event)`` tuples published after ``since``, which is empty
+        if none were within ``timeout`` seconds.
+        """
+        raise NotImplementedError()
+
+
+class InProcessPubSub(PubSub):
+
+    """Keeps the last events of each channel in memory"""
+
+    def __init__(self, max_events=1000):
+        self.max_events = max_events
+        self.condition = threading.Condition()
+        self.channels = {}
+        self.seqs = {}
+
+    def publish(self, channel, event):
+        with self.condition:
+            seq = self.seqs.get(channel, 0) + 1
+            self.seqs[channel] = seq
+            events = self.channels.setdefault(
+                channel, deque(maxlen=self.max_events))
+            events.append((seq, event))
+            self.condition.notify_all()
+
+    def last_seq(self, channel):
+        return self.seqs.get(channel, 0)
+
+    def listen(self, channel, since, timeout):
+        deadline = time.time() + timeout
+        with self.condition:
+            while True:
+                events = [
+                    (seq, event)
+                    for seq, event in self.channels.get(channel, [])
+                    if seq > since]
+                remaining = deadline - time.time()
+                if events or remaining <= 0:
+                    return self.last_seq(channel), events
+                self.condition.wait(remaining)
+
+
+class CachePubSub(PubSub):
+
+    """Stores the events in a werkzeug cache shared across processes
+
+    The sequence number of a channel is a counter in the cache and each event
+    is stored under its own key for ``timeout`` seconds. Subscribers check
+    the counter every ``poll_interval`` seconds.
+    """
+
+    def __init__(
+            self, cache, timeout=300, poll_interval=0.25, max_events=1000):
+        self.cache = cache
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.max_events = max_events
+
+    @staticmethod
+    def seq_key(channel):
+        return 'pubsub_{}_seq'.format(channel)
+
+    @staticmethod
+    def event_key(channel, seq):
+        return 'pubsub_{}_{}'.format(channel, seq)
+
+    def publish(self, channel, event):
+        seq = self.cache.inc(self.seq_key(channel))
+        if seq is None:
+            # memcached doesn't increment missing keys
+            self.cache.add(self.seq_key(channel), 0)
+            seq = self.cache.inc(self.seq_key(channel))
+        self.cache.set(
+            self.event_key(channel, seq), event, timeout=self.timeout)
+
+    def last_seq(self, channel):
+        return int(self.cache.get(self.seq_key(channel)) or 0)
+
+    def listen(self, channel, since, timeout):
+        deadline = time.time() + timeout
+        while True:
+            last_seq = self.last_seq(channel)
+            if last_seq < since:
+                # the counter expired and started over
+                since = 0
+            if last_seq > since:
+                seqs = list(range(
+                    max(since + 1, last_seq - self.max_events + 1),
+                    last_seq + 1))
+                events = self.cache.get_many(
+                    *[self.event_key(channel, seq) for seq in seqs])
+                return last_seq, [
+                    (seq, event)
+                    for seq, event in zip(seqs, events)
+                    if event is not None]
+            if time.time() >= deadline:
+                return last_seq, []
+            time.sleep(self.poll_interval)
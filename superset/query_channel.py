@@ -0,0 +1,118 @@
+"""Progress and kill signal channel for the running SQL Lab queries
+
+Running queries publish their progress to the cache and look there for the
+kill signal, which keeps the polling loops of the engine specs off the
+metadata database. The ``Query`` row is only written to when the progress
+moves significantly, and read from every ``SQLLAB_STOP_DB_CHECK_INTERVAL``
+seconds in case the cache isn't shared between the web servers and the
+workers. When no cache is configured, the metadata database is the channel.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import time
+
+from superset import app, cache
+from superset.utils import QueryStatus
+
+config = app.config
+
+
+def progress_key(query_id):
+    return 'sqllab_query_progress_{}'.format(query_id)
+
+
+def stop_key(query_id):
+    return 'sqllab_query_stop_{}'.format(query_id)
+
+
+def get_progress(query_ids):
+    """Returns the progress published by running queries, by query id"""
+    if not cache or not query_ids:
+        return {}
+    values = cache.get_many(*[progress_key(i) for i in query_ids])
+    return {
+        query_id: progress
+        for query_id, progress in zip(query_ids, values)
+        if progress is not None
+    }
+
+
+def request_stop(query_id):
+    """Sends the kill signal to a running query"""
+    if cache:
+        cache.set(
+            stop_key(query_id), True,
+            timeout=config.get('SQLLAB_CHANNEL_TIMEOUT'))
+
+
+class QueryMonitor(object):
+
+    """Watches over a query while its engine spec polls the cursor
+
+    Engine specs call ``update_progress`` with the progress they get from the
+    database, ``is_stopped`` to know whether to cancel the query and ``wait``
+    in between polls. The time waited grows while the query makes no
+    progress, from ``SQLLAB_POLL_INTERVAL_MIN`` up to
+    ``SQLLAB_POLL_INTERVAL_MAX`` seconds, and goes back to the minimum when
+    it does.
+    """
+
+    def __init__(self, query, session):
+        self.query = query
+        self.session = session
+        self.poll_interval = config.get('SQLLAB_POLL_INTERVAL_MIN')
+        self.progress = query.progress or 0
+        self.progressed = False
+        self.last_db_check = time.time()
+
+    def update_progress(self, progress):
+        progress = int(progress)
+        if progress <= self.progress:
+            return
+        self.progress = progress
+        self.progressed = True
+        if cache:
+            cache.set(
+                progress_key(self.query.id), progress,
+                timeout=config.get('SQLLAB_CHANNEL_TIMEOUT'))
+        step = config.get('SQLLAB_PROGRESS_WRITE_STEP')
+        if not cache or progress - (self.query.progress or 0) >= step:
+            self.query.progress = progress
+            self.session.commit()
+
+    def is_stopped(self):
+        if not self.stop_requested():
+            return False
+        # the query is wrapped up as stopped rather than as done
+        self.query.status = QueryStatus.STOPPED
+        return True
+
+    def stop_requested(self):
+        if cache and cache.get(stop_key(self.query.id)):
+            return True
+        now = time.time()
+        if (
+                cache and now - self.last_db_check <
+                config.get('SQLLAB_STOP_DB_CHECK_INTERVAL')):
+            return False
+        self.last_db_check = now
+        # ends the transaction of the worker, which wouldn't see the status
+        # written by the web server under repeatable read isolation
+        self.session.commit()
+        status = (
+            self.session.query(type(self.query).status)
+            .filter_by(id=self.query.id)
+            .scalar()
+        )
+        return status == QueryStatus.STOPPED
+
+    def wait(self):
+        if self.progressed:
+            self.poll_interval = config.get('SQLLAB_POLL_INTERVAL_MIN')
+        time.sleep(self.poll_interval)
+        self.poll_interval = min(
+            self.poll_interval * 1.5, config.get('SQLLAB_POLL_INTERVAL_MAX'))
+        self.progressed = False
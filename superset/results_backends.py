@@ -12,16 +12,140 @@ try:
 except ImportError:
     import pickle
 
-import io
+from contextlib import contextmanager
+import hashlib
 import logging
+import mmap
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
 
 import boto3
+from botocore.exceptions import ClientError
 from werkzeug.contrib.cache import BaseCache
 
 from superset import app
 
 config = app.config
 
+# S3 object metadata telling how the value of a key is encoded
+ENCODING_METADATA_KEY = 'superset-encoding'
+RAW_ENCODING = 'raw'
+PICKLE_ENCODING = 'pickle'
+
+NOT_FOUND_ERROR_CODES = ('NoSuchKey', '404', 'NotFound')
+NOT_MODIFIED_ERROR_CODES = ('304', 'NotModified')
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def error_code(e):
+    if isinstance(e, ClientError):
+        return e.response.get('Error', {}).get('Code')
+
+
+def is_not_found(e):
+    """Whether a botocore error is about a missing object"""
+    return error_code(e) in NOT_FOUND_ERROR_CODES
+
+
+def is_not_modified(e):
+    """Whether a botocore error tells the object still has the same ETag"""
+    return error_code(e) in NOT_MODIFIED_ERROR_CODES
+
+
+def encode(value):
+    """Returns the bytes to store for a value and their encoding
+
+    Bytes, like the compressed results SQL Lab stores, are stored as is while
+    other values are pickled.
+    """
+    if isinstance(value, bytes):
+        return value, RAW_ENCODING
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL), PICKLE_ENCODING
+
+
+def decode(data, encoding):
+    if encoding == RAW_ENCODING:
+        return data
+    return pickle.loads(data)
+
+
+class LocalFileCache(object):
+
+    """Size bounded directory of files, evicting the least recently read
+
+    Each file starts with the ETag and the encoding of the value it holds,
+    one per line, so that the copy can be checked against the object.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def _path(self, key):
+        name = hashlib.md5(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, name)
+
+    def get(self, key):
+        """Returns the data, encoding and ETag of a key, None if missing"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                etag = f.readline().rstrip(b'\n').decode('utf-8')
+                encoding = f.readline().rstrip(b'\n').decode('utf-8')
+                data = f.read()
+        except (IOError, OSError):
+            return None
+        # the access time is what eviction goes by
+        os.utime(path, None)
+        return data, encoding, etag
+
+    def write(self, key, encoding, etag, chunks):
+        """Stores the data streamed as chunks, atomically"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write('{}\n{}\n'.format(etag, encoding).encode('utf-8'))
+            for chunk in chunks:
+                f.write(chunk)
+        path = self._path(key)
+        os.rename(tmp_path, path)
+        self.evict(keep=path)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except (IOError, OSError):
+            pass
+
+    def evict(self, keep=None):
+        """Removes the least recently used files above the size limit"""
+        entries = []
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if path == keep:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total_bytes = sum(size for _, size, _ in entries)
+        if keep:
+            total_bytes += os.stat(keep).st_size
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_bytes -= size
+
 
 class S3Cache(BaseCache):
 
@@ -33,70 +157,107 @@ class S3Cache(BaseCache):
     Timeout parameters are ignored as S3 doesn't support key-level expiration.
     To expire keys, set up an expiration policy as described in
     https://aws.amazon.com/blogs/aws/amazon-s3-object-expiration/.
+
+    Bytes values are stored as is and other values are pickled, the encoding
+    being recorded in the object metadata. The following options are read
+    from the config:
+
+    - ``S3_CACHE_BUCKET`` and ``S3_CACHE_KEY_PREFIX``, where objects go
+    - ``S3_CACHE_ENDPOINT_URL``, to use an S3 compatible store other than
+      AWS, a local stand-in for instance
+    - ``S3_CACHE_LOCAL_DIR``, a directory where the values read are kept in
+      a read-through cache, of at most ``S3_CACHE_LOCAL_MAX_BYTES`` bytes.
+      The copies are revalidated against the ETag of their object on every
+      read, which skips the transfer of values that didn't change, and
+      dropped along with the objects deleted or overwritten.
+
+    Values are uploaded in a single request. They are held in memory whole,
+    SQL Lab bounds their size by storing its results page by page.
     """
 
     def __init__(self, default_timeout=300):
         self.default_timeout = default_timeout
 
-        self.s3_client = boto3.client('s3')
+        client_kwargs = {}
+        if config.get('S3_CACHE_ENDPOINT_URL'):
+            client_kwargs['endpoint_url'] = config.get('S3_CACHE_ENDPOINT_URL')
+        self.s3_client = boto3.client('s3', **client_kwargs)
 
         self.bucket = config.get('S3_CACHE_BUCKET')
         self.key_prefix = config.get('S3_CACHE_KEY_PREFIX')
 
+        self.local_cache = None
+        if config.get('S3_CACHE_LOCAL_DIR'):
+            self.local_cache = LocalFileCache(
+                config.get('S3_CACHE_LOCAL_DIR'),
+                config.get('S3_CACHE_LOCAL_MAX_BYTES', 1024 ** 3))
+
     def get(self, key):
         """Look up key in the cache and return the value for it.
 
         :param key: the key to be looked up.
         :returns: The value if it exists and is readable, else ``None``.
         """
-        if not self._key_exists(key):
-            return None
-        else:
-            value_file = io.BytesIO()
-
-            try:
-                self.s3_client.download_fileobj(
-                    self.bucket,
-                    self._full_s3_key(key),
-                    value_file
-                )
-            except Exception as e:
-                logging.warn('Error while trying to get key %s', key)
-                logging.exception(e)
-
-                return None
+        cached = self.local_cache.get(key) if self.local_cache else None
+        kwargs = {}
+        if cached and cached[2]:
+            kwargs['IfNoneMatch'] = cached[2]
+        try:
+            response = self.s3_client.get_object(
+                Bucket=self.bucket,
+                Key=self._full_s3_key(key),
+                **kwargs
+            )
+            encoding = response.get('Metadata', {}).get(
+                ENCODING_METADATA_KEY, PICKLE_ENCODING)
+            if self.local_cache:
+                # streamed to disk rather than buffered
+                self.local_cache.write(
+                    key, encoding, response.get('ETag', ''),
+                    self._iter_body(response['Body']))
+                data, encoding, _ = self.local_cache.get(key)
             else:
-                value_file.seek(0)
-                return pickle.load(value_file)
+                data = response['Body'].read()
+        except Exception as e:
+            if cached and is_not_modified(e):
+                data, encoding, _ = cached
+            else:
+                if self.local_cache:
+                    self.local_cache.delete(key)
+                if not is_not_found(e):
+                    logging.warn('Error while trying to get key %s', key)
+                    logging.exception(e)
+                return None
+        try:
+            return decode(data, encoding)
+        except Exception as e:
+            logging.warn('Error while trying to decode key %s', key)
+            logging.exception(e)
+            return None
 
     def delete(self, key):
         """Delete `key` from the cache.
 
+        S3 deletes are idempotent and don't report whether the key existed.
+
         :param key: the key to delete.
-        :returns: Whether the key existed and has been deleted.
+        :returns: Whether the key has been deleted.
         :rtype: boolean
         """
-        if not self._key_exists(key):
+        if self.local_cache:
+            self.local_cache.delete(key)
+        try:
+            self.s3_client.delete_object(
+                Bucket=self.bucket,
+                Key=self._full_s3_key(key),
+            )
+        except Exception as e:
+            logging.warn('Error while trying to delete key %s', key)
+            logging.exception(e)
+
             return False
         else:
-            try:
-                self.s3_client.delete_objects(
-                    Bucket=self.bucket,
-                    Delete={
-                        'Objects': [
-                            {
-                                'Key': self._full_s3_key(key)
-                            }
-                        ]
-                    }
-                )
-            except Exception as e:
-                logging.warn('Error while trying to delete key %s', key)
-                logging.exception(e)
-
-                return False
-            else:
-                return True
+            return True
 
     def set(self, key, value, timeout=None):
         """Add a new key/value to the cache.
@@ -113,15 +274,17 @@ class S3Cache(BaseCache):
                   ``pickle.PickleError``.
         :rtype: boolean
         """
-        value_file = io.BytesIO()
-        pickle.dump(value, value_file)
+        data, encoding = encode(value)
+        if self.local_cache:
+            self.local_cache.delete(key)
 
         try:
-            value_file.seek(0)
-            self.s3_client.upload_fileobj(
-                value_file,
-                self.bucket,
-                self._full_s3_key(key)
+            # the bytes are sent as they are, without another buffer
+            self.s3_client.put_object(
+                Bucket=self.bucket,
+                Key=self._full_s3_key(key),
+                Body=data,
+                Metadata={ENCODING_METADATA_KEY: encoding},
             )
         except Exception as e:
             logging.warn('Error while trying to set key %s', key)
@@ -161,6 +324,14 @@ class S3Cache(BaseCache):
         """Convert a cache key to a full S3 key, including the key prefix."""
         return '%s%s' % (self.key_prefix, key)
 
+    @staticmethod
+    def _iter_body(body):
+        while True:
+            chunk = body.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
     def _key_exists(self, key):
         """Determine whether the given key exists in the bucket."""
         try:
@@ -173,3 +344,209 @@ class S3Cache(BaseCache):
             return False
         else:
             return True
+
+
+class FileResultsCache(BaseCache):
+
+    """Results cache storing each value in a file of a local or shared volume
+
+    The values are read through ``mmap`` and their metadata is tracked in a
+    SQLite index next to the files, so that the web servers and the workers
+    sharing the volume see the same entries. Keys expire after their timeout
+    and, when ``max_bytes`` is set, the least recently read values are
+    evicted once the files take more than ``max_bytes`` bytes. Expired keys
+    are removed as they are read and by :meth:`sweep`, which the
+    ``superset clean_results`` command calls.
+    """
+
+    INDEX_FILENAME = 'index.db'
+
+    def __init__(self, path, default_timeout=300, max_bytes=None):
+        self.path = path
+        self.default_timeout = default_timeout
+        self.max_bytes = max_bytes
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.index_path = os.path.join(path, self.INDEX_FILENAME)
+        with self._index() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'key TEXT PRIMARY KEY, filename TEXT, encoding TEXT, '
+                'size INTEGER, expires REAL, accessed REAL)')
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS ix_entries_accessed '
+                'ON entries (accessed)')
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS ix_entries_expires '
+                'ON entries (expires)')
+
+    @contextmanager
+    def _index(self):
+        conn = sqlite3.connect(self.index_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _file_path(self, filename):
+        return os.path.join(self.path, filename)
+
+    def _remove_files(self, filenames):
+        for filename in filenames:
+            try:
+                os.remove(self._file_path(filename))
+            except OSError:
+                pass
+
+    def _expires(self, timeout):
+        if timeout is None:
+            timeout = self.default_timeout
+        if not timeout:
+            return 0
+        return time.time() + timeout
+
+    def _get_entry(self, key):
+        """Returns the filename and encoding of a live key, None otherwise"""
+        now = time.time()
+        with self._index() as conn:
+            row = conn.execute(
+                'SELECT filename, encoding, expires FROM entries '
+                'WHERE key = ?', (key,)).fetchone()
+            if not row:
+                return None
+            filename, encoding, expires = row
+            if expires and expires <= now:
+                conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                self._remove_files([filename])
+                return None
+            conn.execute(
+                'UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+        return filename, encoding
+
+    def _read(self, filename):
+        """Reads a file through a memory map"""
+        with open(self._file_path(filename), 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return b''
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return mapped[:]
+            finally:
+                mapped.close()
+
+    def get(self, key):
+        """Look up key in the cache and return the value for it.
+
+        :param key: the key to be looked up.
+        :returns: The value if it exists and is readable, else ``None``.
+        """
+        entry = self._get_entry(key)
+        if not entry:
+            return None
+        filename, encoding = entry
+        try:
+            return decode(self._read(filename), encoding)
+        except Exception as e:
+            # the file may have been evicted by another process meanwhile
+            logging.warn('Error while trying to get key %s', key)
+            logging.exception(e)
+            return None
+
+    def has(self, key):
+        return self._get_entry(key) is not None
+
+    def set(self, key, value, timeout=None):
+        data, encoding = encode(value)
+        filename = '{}.{}'.format(uuid.uuid4().hex, encoding)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            # readers of a previous value keep reading its own file
+            os.rename(tmp_path, self._file_path(filename))
+            now = time.time()
+            with self._index() as conn:
+                row = conn.execute(
+                    'SELECT filename FROM entries WHERE key = ?',
+                    (key,)).fetchone()
+                conn.execute(
+                    'INSERT OR REPLACE INTO entries '
+                    '(key, filename, encoding, size, expires, accessed) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (key, filename, encoding, len(data),
+                     self._expires(timeout), now))
+            if row:
+                self._remove_files([row[0]])
+        except Exception as e:
+            logging.warn('Error while trying to set key %s', key)
+            logging.exception(e)
+            return False
+        self.evict()
+        return True
+
+    def add(self, key, value, timeout=None):
+        if self.has(key):
+            return False
+        return self.set(key, value, timeout=timeout)
+
+    def delete(self, key):
+        with self._index() as conn:
+            row = conn.execute(
+                'SELECT filename FROM entries WHERE key = ?',
+                (key,)).fetchone()
+            if not row:
+                return False
+            conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+        self._remove_files([row[0]])
+        return True
+
+    def clear(self):
+        with self._index() as conn:
+            filenames = [
+                row[0] for row in conn.execute('SELECT filename FROM entries')]
+            conn.execute('DELETE FROM entries')
+        self._remove_files(filenames)
+        return True
+
+    def evict(self):
+        """Removes the least recently read values above the size limit
+
+        :returns: The number of keys removed.
+        """
+        if not self.max_bytes:
+            return 0
+        filenames = []
+        with self._index() as conn:
+            total_bytes = conn.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if total_bytes <= self.max_bytes:
+                return 0
+            rows = conn.execute(
+                'SELECT key, filename, size FROM entries '
+                'ORDER BY accessed')
+            for key, filename, size in rows.fetchall():
+                if total_bytes <= self.max_bytes:
+                    break
+                conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                filenames.append(filename)
+                total_bytes -= size
+        self._remove_files(filenames)
+        return len(filenames)
+
+    def sweep(self):
+        """Removes the expired keys and enforces the size limit
+
+        :returns: The number of keys removed.
+        """
+        now = time.time()
+        with self._index() as conn:
+            filenames = [
+                row[0] for row in conn.execute(
+                    'SELECT filename FROM entries '
+                    'WHERE expires > 0 AND expires <= ?', (now,))]
+            conn.execute(
+                'DELETE FROM entries WHERE expires > 0 AND expires <= ?',
+                (now,))
+        self._remove_files(filenames)
+        return len(filenames) + self.evict()
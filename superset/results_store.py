@@ -0,0 +1,335 @@
+"""Layout of the SQL Lab results kept in the results backend
+
+Results are stored as a sequence of independently compressed pages along
+with an index. The index lives under the results key and holds the query
+metadata, the column descriptions and the list of pages, each page being
+stored under its own key derived from the results key. The index and the
+pages are all kept for ``SQLLAB_RESULTS_TIMEOUT`` seconds, whatever the
+default timeout of the backend.
+
+Pages are either stored as JSON, column by column, or, when
+``RESULTS_STORAGE_FORMAT`` is set to ``arrow``, as Arrow IPC streams which
+keep numeric and temporal columns in their native types and dictionary
+encode the string columns. Pages written before the columnar JSON layout hold
+a list of records.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import logging
+import uuid
+import zlib
+
+import pandas as pd
+
+from superset import app, dataframe, utils
+
+config = app.config
+
+STORAGE_FORMATS = ('json', 'arrow')
+
+
+def encode(obj):
+    """Serializes an object to compressed JSON"""
+    payload = json.dumps(obj, default=utils.json_iso_dttm_ser)
+    return zlib.compress(payload.encode('utf-8'))
+
+
+def decode(blob):
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+
+def results_timeout():
+    return config.get('SQLLAB_RESULTS_TIMEOUT')
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise utils.SupersetException(
+            "The arrow results storage format requires pyarrow to be "
+            "installed")
+    return pyarrow
+
+
+def encode_arrow(df):
+    """Serializes a DataFrame to a compressed Arrow IPC stream"""
+    pa = import_pyarrow()
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype == object:
+            df[col] = df[col].astype('category')
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    writer = pa.RecordBatchStreamWriter(sink, table.schema)
+    writer.write_table(table)
+    writer.close()
+    return zlib.compress(sink.getvalue().to_pybytes())
+
+
+def decode_arrow(blob):
+    pa = import_pyarrow()
+    reader = pa.RecordBatchStreamReader(pa.BufferReader(zlib.decompress(blob)))
+    df = reader.read_all().to_pandas()
+    for col in df.columns:
+        if str(df[col].dtype) == 'category':
+            df[col] = df[col].astype(object)
+    return df
+
+
+class ResultsWriter(object):
+
+    """Writes the results of a query to the results backend page by page"""
+
+    def __init__(self, backend, key=None, storage_format='json'):
+        if storage_format not in STORAGE_FORMATS:
+            raise utils.SupersetException(
+                "Unknown results storage format: {}".format(storage_format))
+        if storage_format == 'arrow':
+            import_pyarrow()
+        self.backend = backend
+        self.key = key or '{}'.format(uuid.uuid4())
+        self.storage_format = storage_format
+        self.pages = []
+
+    @property
+    def rows(self):
+        return sum(page['rows'] for page in self.pages)
+
+    def page_key(self, page_number):
+        return '{}_page_{}'.format(self.key, page_number)
+
+    def write_page(self, df):
+        """Stores a DataFrame as the next page"""
+        key = self.page_key(len(self.pages))
+        storage_format = self.storage_format
+        blob = None
+        if storage_format == 'arrow':
+            try:
+                blob = encode_arrow(df)
+            except Exception as e:
+                # columns holding values of mixed types can't be converted
+                logging.warning(
+                    "Storing results page as json, arrow conversion failed: "
+                    "{}".format(e))
+                storage_format = 'json'
+        if storage_format == 'json':
+            # columns rather than records, which saves a dict per row
+            cdf = dataframe.SupersetDataFrame(df)
+            blob = encode({
+                'columns': cdf.column_names,
+                'values': cdf.columnar_data,
+            })
+            storage_format = 'json_columns'
+        logging.info("Storing results page, key: {}".format(key))
+        self.backend.set(key, blob, timeout=results_timeout())
+        self.pages.append({
+            'key': key,
+            'rows': len(df.index),
+            'format': storage_format,
+        })
+
+    def write_index(self, payload, complete=True):
+        """Stores the index, ``payload`` being the query metadata
+
+        The index can be written while pages are still being added, with
+        ``complete`` set to False, so that readers can get to the first
+        pages before the query is done fetching.
+        """
+        index = dict(payload)
+        index['pages'] = list(self.pages)
+        index['rows'] = self.rows
+        index['complete'] = complete
+        index['format'] = self.storage_format
+        logging.info("Storing results index, key: {}".format(self.key))
+        self.backend.set(
+            self.key, encode(index), timeout=results_timeout())
+
+
+def get_index(backend, key):
+    """Returns the index stored under ``key``, None if it expired"""
+    blob = backend.get(key)
+    if not blob:
+        return None
+    index = decode(blob)
+    if 'pages' not in index:
+        # results stored before the paged layout hold all their rows inline
+        data = index.pop('data', None) or []
+        index['pages'] = [{'data': data, 'rows': len(data)}]
+        index['rows'] = len(data)
+        index['complete'] = True
+    return index
+
+
+def store_index(backend, key, index, payload):
+    """Stores ``index`` updated with the query metadata under ``key``"""
+    new_index = dict(index)
+    new_index.update(payload)
+    logging.info("Storing results index, key: {}".format(key))
+    backend.set(key, encode(new_index), timeout=results_timeout())
+
+
+def copy_pages(backend, index):
+    """Copies the pages of ``index`` under a new results key
+
+    The copies outlive the results they are copied from, which expire and
+    get deleted on their own. Returns the new key and an index listing the
+    copies, raises ResultsExpiredException if a page is already gone.
+    """
+    key = '{}'.format(uuid.uuid4())
+    pages = []
+    for i, page in enumerate(index['pages']):
+        if 'data' not in page:
+            blob = get_page_blob(backend, page)
+            page = dict(page, key='{}_page_{}'.format(key, i))
+            backend.set(page['key'], blob, timeout=results_timeout())
+        pages.append(page)
+    new_index = dict(index)
+    new_index['pages'] = pages
+    return key, new_index
+
+
+def delete_results(backend, key):
+    """Deletes an index and the pages it owns"""
+    index = get_index(backend, key)
+    for page in (index or {}).get('pages', []):
+        if page.get('key', '').startswith('{}_page_'.format(key)):
+            backend.delete(page['key'])
+    backend.delete(key)
+
+
+def get_column_names(index):
+    return [col['name'] for col in index.get('columns') or []]
+
+
+def get_page_blob(backend, page):
+    blob = backend.get(page['key'])
+    if not blob:
+        raise utils.ResultsExpiredException(
+            "Results page {} is missing".format(page['key']))
+    return blob
+
+
+def get_page(backend, page):
+    """Returns the records of a page listed in an index"""
+    if 'data' in page:
+        return page['data']
+    blob = get_page_blob(backend, page)
+    if page.get('format') == 'arrow':
+        return dataframe.SupersetDataFrame(decode_arrow(blob)).data
+    if page.get('format') == 'json_columns':
+        page_data = decode(blob)
+        return dataframe.records_from_columns(
+            page_data['columns'], page_data['values'])
+    return decode(blob)
+
+
+def get_page_columns(backend, page, columns):
+    """Returns the list of the values of each column of a page"""
+    if page.get('format') == 'json_columns':
+        return decode(get_page_blob(backend, page))['values']
+    if page.get('format') == 'arrow':
+        return dataframe.SupersetDataFrame(
+            decode_arrow(get_page_blob(backend, page))).columnar_data
+    records = get_page(backend, page)
+    return [[record.get(col) for record in records] for col in columns]
+
+
+def get_page_df(backend, page, columns):
+    """Returns a page listed in an index as a DataFrame"""
+    if page.get('format') == 'arrow':
+        return decode_arrow(get_page_blob(backend, page))
+    if page.get('format') == 'json_columns':
+        page_data = decode(get_page_blob(backend, page))
+        return pd.DataFrame(
+            dict(zip(page_data['columns'], page_data['values'])),
+            columns=page_data['columns'])
+    return pd.DataFrame.from_records(
+        get_page(backend, page), columns=columns)
+
+
+def iter_page_ranges(index, offset=0, limit=None):
+    """Yields the pages overlapping a range of rows and their slice bounds
+
+    >>> index = {'pages': [{'rows': 3}, {'rows': 2}, {'rows': 4}]}
+    >>> [(p['rows'], s, e) for p, s, e in iter_page_ranges(index, 2, 2)]
+    [(3, 2, 3), (2, 0, 1)]
+    >>> [(p['rows'], s, e) for p, s, e in iter_page_ranges(index, 3)]
+    [(2, 0, 2), (4, 0, 4)]
+    """
+    page_start = 0
+    for page in index['pages']:
+        page_end = page_start + page['rows']
+        if limit is not None and offset + limit <= page_start:
+            break
+        if page_end > offset:
+            start = max(offset - page_start, 0)
+            end = page['rows']
+            if limit is not None:
+                end = min(end, offset + limit - page_start)
+            yield page, start, end
+        page_start = page_end
+
+
+def iter_pages(backend, index, offset=0, limit=None):
+    """Yields the records from ``offset`` on, reading only the pages needed
+
+    >>> index = {'pages': [
+    ...     {'data': [1, 2, 3], 'rows': 3}, {'data': [4, 5], 'rows': 2}]}
+    >>> list(iter_pages(None, index, offset=2, limit=2))
+    [[3], [4]]
+    """
+    for page, start, end in iter_page_ranges(index, offset, limit):
+        yield get_page(backend, page)[start:end]
+
+
+def iter_columns(backend, index, offset=0, limit=None):
+    """Yields the lists of the values of each column, page by page"""
+    columns = get_column_names(index)
+    for page, start, end in iter_page_ranges(index, offset, limit):
+        yield [
+            values[start:end]
+            for values in get_page_columns(backend, page, columns)]
+
+
+def iter_dataframes(backend, index, offset=0, limit=None):
+    """Yields the pages from ``offset`` on as DataFrames"""
+    columns = get_column_names(index)
+    for page, start, end in iter_page_ranges(index, offset, limit):
+        yield get_page_df(backend, page, columns).iloc[start:end]
+
+
+def load_payload(backend, index, offset=0, limit=None, orient='records'):
+    """Loads the payload of a query with ``limit`` rows from ``offset``
+
+    With ``orient`` set to ``columns``, the data maps the column names to the
+    lists of their values instead of being a list of records.
+    """
+    if orient == 'columns':
+        columns = get_column_names(index)
+        values = [[] for _ in columns]
+        for page_values in iter_columns(backend, index, offset, limit):
+            for column_values, page_column_values in zip(values, page_values):
+                column_values += page_column_values
+        data = dict(zip(columns, values))
+    else:
+        data = []
+        for records in iter_pages(backend, index, offset, limit):
+            data += records
+    payload = dict(index)
+    del payload['pages']
+    payload['data'] = data
+    payload['offset'] = offset
+    return payload
+
+
+def load_dataframe(backend, index):
+    """Loads all of the results of a query into a single DataFrame"""
+    dfs = list(iter_dataframes(backend, index))
+    if not dfs:
+        return pd.DataFrame(columns=get_column_names(index))
+    return pd.concat(dfs, ignore_index=True)
@@ -4,9 +4,13 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import logging
+import uuid
+
+from flask import g, has_app_context
 from flask_appbuilder.security.sqla import models as ab_models
+import sqlalchemy as sqla
 
-from superset import conf, db, sm
+from superset import cache, conf, db, sm
 from superset.models import core as models
 from superset.connectors.connector_registry import ConnectorRegistry
 
@@ -67,6 +71,9 @@ OBJECT_SPEC_PERMISSIONS = set([
 ])
 
 
+PERMISSIONS_VERSION_KEY = 'permissions_version'
+
+
 def merge_perm(sm, permission_name, view_menu_name):
     # Implementation copied from sm.find_permission_view_menu.
     # TODO: use sm.find_permission_view_menu once issue
@@ -227,3 +234,117 @@ def sync_role_definitions():
 
     # commit role and view menu updates
     sm.get_session.commit()
+
+
+def get_permissions_version():
+    """Token changing whenever roles or their permissions change"""
+    version = cache.get(PERMISSIONS_VERSION_KEY)
+    if version is None:
+        version = uuid.uuid4().hex
+        cache.set(PERMISSIONS_VERSION_KEY, version)
+    return version
+
+
+def query_permissions(role_ids, public_role=None):
+    """Returns the (permission, view_menu) names granted to roles"""
+    role_filter = ab_models.Role.id.in_(role_ids) if role_ids else None
+    if public_role:
+        public_filter = ab_models.Role.name == public_role
+        role_filter = (
+            sqla.or_(role_filter, public_filter)
+            if role_filter is not None else public_filter)
+    if role_filter is None:
+        return set()
+    qry = (
+        db.session.query(ab_models.Permission.name, ab_models.ViewMenu.name)
+        .select_from(ab_models.PermissionView)
+        .join(ab_models.PermissionView.permission)
+        .join(ab_models.PermissionView.view_menu)
+        .filter(ab_models.PermissionView.role.any(role_filter))
+    )
+    return set((perm, view_menu) for perm, view_menu in qry)
+
+
+def get_user_permissions(user):
+    """Returns the set of (permission, view_menu) names granted to a user
+
+    Those are the permissions of the roles of the user along with the ones
+    of the public role. The set is kept for the rest of the request and,
+    when a cache is configured, for ``PERMISSIONS_CACHE_TIMEOUT`` seconds
+    across requests, until roles or permissions change.
+    """
+    if user.is_anonymous():
+        user_key = 'anonymous'
+    else:
+        user_key = 'user_{}'.format(user.id)
+
+    request_perms = None
+    if has_app_context():
+        request_perms = getattr(g, 'user_permissions', None)
+        if request_perms is None:
+            request_perms = g.user_permissions = {}
+        if user_key in request_perms:
+            return request_perms[user_key]
+
+    key = None
+    perms = None
+    if cache:
+        key = 'permissions_{}_{}'.format(get_permissions_version(), user_key)
+        perms = cache.get(key)
+    if perms is None:
+        role_ids = [] if user.is_anonymous() else [r.id for r in user.roles]
+        perms = frozenset(
+            query_permissions(role_ids, conf.get('AUTH_ROLE_PUBLIC')))
+        if key:
+            cache.set(
+                key, perms, timeout=conf.get('PERMISSIONS_CACHE_TIMEOUT'))
+
+    if request_perms is not None:
+        request_perms[user_key] = perms
+    return perms
+
+
+def can_access(permission_name, view_name, user):
+    """Whether a user or the public role has a permission on a view menu"""
+    return (permission_name, view_name) in get_user_permissions(user)
+
+
+def invalidate_permissions(target):
+    """Marks the cached permission sets to be dropped on commit"""
+    session = sqla.orm.object_session(target)
+    if session is not None:
+        session.info['permissions_changed'] = True
+
+
+def permissions_changed(mapper, connection, target):
+    invalidate_permissions(target)
+
+
+def user_roles_changed(mapper, connection, target):
+    # logging in updates users too, only their roles matter here
+    if sqla.inspect(target).attrs.roles.history.has_changes():
+        invalidate_permissions(target)
+
+
+def bump_permissions_version(session):
+    if session.info.pop('permissions_changed', None):
+        if cache:
+            cache.set(PERMISSIONS_VERSION_KEY, uuid.uuid4().hex)
+        if has_app_context():
+            g.user_permissions = {}
+
+
+def discard_permission_changes(session):
+    session.info.pop('permissions_changed', None)
+
+
+for model in (ab_models.Role, ab_models.PermissionView):
+    sqla.event.listen(model, 'after_insert', permissions_changed)
+    sqla.event.listen(model, 'after_update', permissions_changed)
+    sqla.event.listen(model, 'after_delete', permissions_changed)
+for model in (ab_models.Permission, ab_models.ViewMenu):
+    sqla.event.listen(model, 'after_update', permissions_changed)
+sqla.event.listen(ab_models.User, 'after_update', user_roles_changed)
+sqla.event.listen(sqla.orm.Session, 'after_commit', bump_permissions_version)
+sqla.event.listen(
+    sqla.orm.Session, 'after_rollback', discard_permission_changes)
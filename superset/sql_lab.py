@@ -1,17 +1,15 @@
 import celery
-from datetime import datetime
+from celery.signals import task_postrun, worker_process_init
+from datetime import datetime, timedelta
+import hashlib
 import json
 import logging
-import pandas as pd
 import sqlalchemy
-import uuid
-import zlib
 
-from sqlalchemy.pool import NullPool
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
 
 from superset import (
-    app, db, utils, dataframe, results_backend)
+    app, db, utils, dataframe, results_backend, results_store, table_index)
 from superset.models import core as models
 from superset.sql_parse import SupersetQuery
 from superset.db_engine_specs import LimitMethod
@@ -20,6 +18,41 @@ from superset.utils import QueryStatus
 
 celery_app = celery.Celery(config_source=app.config.get('CELERY_CONFIG'))
 
+# Session factory for the metadata database, created once per worker process
+# so that the tasks it runs share its connection pool
+worker_session = None
+
+
+@worker_process_init.connect
+def init_worker_session(**kwargs):
+    """Sets up the metadata database engine and session of a worker process
+
+    The engine is created after the worker process is forked as pooled
+    connections can't be shared across processes. Connections are pinged on
+    checkout so that the ones the database closed in between tasks are
+    replaced.
+    """
+    global worker_session
+    engine = sqlalchemy.create_engine(
+        app.config.get('SQLALCHEMY_DATABASE_URI'),
+        pool_recycle=app.config.get('SQLLAB_WORKER_POOL_RECYCLE'))
+    utils.pessimistic_connection_handling(engine.pool)
+    worker_session = scoped_session(sessionmaker(bind=engine))
+
+
+@task_postrun.connect
+def remove_worker_session(**kwargs):
+    """Returns the connection of the task's session to the pool"""
+    if worker_session:
+        worker_session.remove()
+
+
+def get_worker_session():
+    # worker_process_init isn't sent by the pools that don't fork
+    if not worker_session:
+        init_worker_session()
+    return worker_session()
+
 
 def dedup(l, suffix='__'):
     """De-duplicates a list of string by suffixing a counter
@@ -42,19 +75,130 @@ def dedup(l, suffix='__'):
     return new_l
 
 
+def get_results_cache_key(query):
+    """Returns the key under which identical queries can share results
+
+    The key is None for statements whose results shouldn't be reused, either
+    because they modify data or because they call non-deterministic
+    functions.
+    """
+    superset_query = SupersetQuery(query.executed_sql)
+    if (
+            not superset_query.is_select() or
+            not superset_query.is_deterministic()):
+        return None
+    key = json.dumps([
+        query.database_id,
+        query.schema,
+        query.limit,
+        superset_query.normalized(),
+    ])
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+
+def get_cached_results(session, query, timeout, store_results=False):
+    """Returns the results of an identical query run recently
+
+    Returns the results index along with the key its pages were copied to
+    when the results are stored, the pages of the query being reused
+    expiring on their own. Results with pages already gone don't count, nor
+    do the queries which reused results themselves, which would otherwise
+    keep results alive past ``timeout`` from one hit to the next.
+    """
+    min_end_time = utils.now_as_float() - timeout * 1000
+    cached_queries = (
+        session.query(models.Query)
+        .filter(
+            models.Query.results_cache_key == query.results_cache_key,
+            models.Query.status == QueryStatus.SUCCESS,
+            models.Query.results_key.isnot(None),
+            sqlalchemy.or_(
+                models.Query.results_cache_hit.is_(None),
+                models.Query.results_cache_hit == sqlalchemy.false()),
+            models.Query.end_time >= min_end_time,
+            models.Query.id != query.id,
+        )
+        .order_by(models.Query.end_time.desc())
+    )
+    for cached_query in cached_queries.limit(5):
+        index = results_store.get_index(
+            results_backend, cached_query.results_key)
+        if not index or not index['complete']:
+            continue
+        try:
+            if store_results:
+                return results_store.copy_pages(results_backend, index)
+            for page in index['pages']:
+                if 'data' not in page:
+                    results_store.get_page_blob(results_backend, page)
+            return None, index
+        except utils.ResultsExpiredException as e:
+            logging.info("Results of query {} can't be reused: {}".format(
+                cached_query.id, e))
+    return None, None
+
+
+def get_tmp_table_name(query):
+    start_dttm = datetime.fromtimestamp(query.start_time)
+    return 'tmp_{}_table_{}'.format(
+        query.user_id,
+        start_dttm.strftime('%Y_%m_%d_%H_%M_%S'))
+
+
+def get_queue_position(session, query):
+    """Returns the position of a query waiting for its database, 0 if it can
+    run now
+
+    Databases with ``max_concurrent_queries`` set run that many queries at
+    once, the queries queued first taking the slots being freed first. The
+    row of the database stays locked until the caller commits the status of
+    the query so that two workers can't take the same slot. Running queries
+    left untouched for longer than ``SQLLAB_ASYNC_TIME_LIMIT_SEC``, whose
+    worker most likely died, don't hold a slot anymore.
+    """
+    max_concurrent_queries = query.database.max_concurrent_queries
+    if not max_concurrent_queries:
+        return 0
+    (
+        session.query(models.Database.id)
+        .filter_by(id=query.database_id)
+        .with_for_update()
+        .one()
+    )
+    stale_before = datetime.utcnow() - timedelta(
+        seconds=app.config.get('SQLLAB_ASYNC_TIME_LIMIT_SEC'))
+    database_queries = (
+        session.query(models.Query)
+        .filter(
+            models.Query.database_id == query.database_id,
+            models.Query.id != query.id,
+        )
+    )
+    running = database_queries.filter(
+        models.Query.status == QueryStatus.RUNNING,
+        models.Query.changed_on >= stale_before,
+    ).count()
+    queued_before = database_queries.filter(
+        models.Query.status == QueryStatus.QUEUED,
+        models.Query.id < query.id,
+    ).count()
+    free_slots = max_concurrent_queries - running
+    if queued_before < free_slots:
+        return 0
+    return queued_before - max(free_slots, 0) + 1
+
+
 @celery_app.task(bind=True)
 def get_sql_results(self, query_id, return_results=True, store_results=False):
     """Executes the sql query returns the results."""
     if not self.request.called_directly:
-        engine = sqlalchemy.create_engine(
-            app.config.get('SQLALCHEMY_DATABASE_URI'), poolclass=NullPool)
-        session_class = sessionmaker()
-        session_class.configure(bind=engine)
-        session = session_class()
+        session = get_worker_session()
     else:
         session = db.session()
         session.commit()  # HACK
     query = session.query(models.Query).filter_by(id=query_id).one()
+    if query.status == QueryStatus.STOPPED:
+        return
     database = query.database
     db_engine_spec = database.db_engine_spec
     db_engine_spec.patch()
@@ -82,10 +226,7 @@ def get_sql_results(self, query_id, return_results=True, store_results=False):
                 "Only `SELECT` statements can be used with the CREATE TABLE "
                 "feature.")
         if not query.tmp_table_name:
-            start_dttm = datetime.fromtimestamp(query.start_time)
-            query.tmp_table_name = 'tmp_{}_table_{}'.format(
-                query.user_id,
-                start_dttm.strftime('%Y_%m_%d_%H_%M_%S'))
+            query.tmp_table_name = get_tmp_table_name(query)
         executed_sql = superset_query.as_create_table(query.tmp_table_name)
         query.select_as_cta_used = True
     elif (
@@ -104,8 +245,65 @@ def get_sql_results(self, query_id, return_results=True, store_results=False):
         handle_error(msg)
 
     query.executed_sql = executed_sql
+
+    if results_backend and not query.select_as_cta:
+        query.results_cache_key = get_results_cache_key(query)
+    results_key, index = None, None
+    if query.results_cache_key and database.results_cache_timeout:
+        results_key, index = get_cached_results(
+            session, query, database.results_cache_timeout,
+            store_results=store_results)
+    if index:
+        logging.info("Reusing the results of an identical query")
+        query.results_cache_hit = True
+        query.rows = index['rows']
+        query.progress = 100
+        query.status = QueryStatus.SUCCESS
+        query.end_time = utils.now_as_float()
+        payload = {
+            'query_id': query.id,
+            'status': query.status,
+            'columns': index.get('columns') or [],
+            'query': query.to_dict(),
+        }
+        if results_key:
+            results_store.store_index(
+                results_backend, results_key, index, payload)
+            query.results_key = results_key
+        session.commit()
+        if return_results:
+            payload['data'] = results_store.load_payload(
+                results_backend, index)['data']
+            return json.dumps(payload, default=utils.json_iso_dttm_ser)
+        return
+
+    if not self.request.called_directly:
+        queue_position = get_queue_position(session, query)
+        if queue_position:
+            max_retries = app.config.get('SQLLAB_QUEUED_MAX_RETRIES')
+            if self.request.retries >= max_retries:
+                query.queue_position = None
+                handle_error(
+                    "The query waited too long for its database to run "
+                    "fewer than {} queries".format(
+                        database.max_concurrent_queries))
+            logging.info(
+                "Query queued, position {}".format(queue_position))
+            query.status = QueryStatus.QUEUED
+            query.queue_position = queue_position
+            session.commit()
+            session.close()
+            raise self.retry(
+                countdown=app.config.get('SQLLAB_QUEUED_RETRY_DELAY'),
+                max_retries=max_retries)
+        # marked as running before executing so that it takes its slot in
+        # the database's concurrency limit right away
+        query.status = QueryStatus.RUNNING
+        query.queue_position = None
+        session.commit()
+
     logging.info("Running query: \n{}".format(executed_sql))
-    engine = database.get_sqla_engine(schema=query.schema)
+    engine = database.get_sqla_engine(schema=query.schema, nullpool=True)
     conn = engine.raw_connection()
     cursor = conn.cursor()
     try:
@@ -118,11 +316,66 @@ def get_sql_results(self, query_id, return_results=True, store_results=False):
 
     query.status = QueryStatus.RUNNING
     session.flush()
+
+    column_names = []
+    columns = None
+    data = []
+    rows = 0
+    results_bytes = 0
+    max_bytes = app.config.get('SQLLAB_RESULTS_MAX_BYTES')
+    writer = None
+    if store_results:
+        writer = results_store.ResultsWriter(
+            results_backend,
+            storage_format=app.config.get('RESULTS_STORAGE_FORMAT', 'json'))
     try:
         logging.info("Handling cursor")
         db_engine_spec.handle_cursor(cursor, query, session)
         logging.info("Fetching data: {}".format(query.to_dict()))
-        data = db_engine_spec.fetch_data(cursor, query.limit)
+        column_names = dedup(
+            [col[0] for col in cursor.description]
+            if cursor.description else [])
+        # Rows are fetched, encoded and stored a page at a time so that the
+        # memory used doesn't grow with the size of the result set
+        batches = db_engine_spec.fetch_data_in_batches(
+            cursor, query.limit, app.config.get('RESULTS_PAGE_SIZE'))
+        builder = dataframe.DataFrameBuilder(
+            cursor.description, db_engine_spec, names=column_names,
+            serialize_nested=False)
+        for batch in batches:
+            df = builder.build(batch)
+            cdf = dataframe.SupersetDataFrame(df)
+            if columns is None:
+                columns = cdf.columns
+            if writer:
+                writer.write_page(df)
+                if len(writer.pages) == 1:
+                    # Publishing the index as soon as the first page is in
+                    # lets the client show it while the rest is fetched
+                    writer.write_index({
+                        'query_id': query.id,
+                        'status': query.status,
+                        'columns': columns,
+                        'query': query.to_dict(),
+                    }, complete=False)
+                    query.results_key = writer.key
+                    session.commit()
+            if return_results:
+                data += cdf.data
+            rows += cdf.size
+            # The row limit doesn't bound the size of wide rows, fetching
+            # stops once the results grow past the size limit
+            results_bytes += df.memory_usage(deep=True).sum()
+            if max_bytes and results_bytes > max_bytes:
+                logging.info(
+                    "Results truncated at {} rows, {} bytes".format(
+                        rows, results_bytes))
+                query.results_truncated = True
+                query.results_cache_key = None
+                break
+        if columns is None and column_names:
+            # without rows the types come from the cursor description only
+            columns = dataframe.infer_columns(builder.build([]))
     except Exception as e:
         logging.exception(e)
         conn.close()
@@ -131,20 +384,51 @@ def get_sql_results(self, query_id, return_results=True, store_results=False):
     conn.commit()
     conn.close()
 
+    if (
+            query.results_truncated and database.allow_ctas and
+            app.config.get('SQLLAB_SPILL_TO_CTAS') and
+            superset_query.is_select() and not query.select_as_cta and
+            query.status != QueryStatus.STOPPED):
+        # The truncated results are kept as a preview, the whole results go
+        # into a table the user can query
+        tmp_table_name = get_tmp_table_name(query)
+        if database.force_ctas_schema:
+            tmp_table_name = '{}.{}'.format(
+                database.force_ctas_schema, tmp_table_name)
+        ctas_sql = superset_query.as_create_table(tmp_table_name)
+        try:
+            ctas_sql = db_engine_spec.sql_preprocessor(
+                template_processor.process_template(ctas_sql))
+            logging.info("Spilling the results: \n{}".format(ctas_sql))
+            conn = engine.raw_connection()
+            cursor = conn.cursor()
+            cursor.execute(ctas_sql, **db_engine_spec.cursor_execute_kwargs)
+            db_engine_spec.handle_cursor(cursor, query, session)
+            conn.commit()
+            conn.close()
+            query.tmp_table_name = tmp_table_name
+            query.select_as_cta = True
+            query.select_as_cta_used = True
+        except Exception as e:
+            logging.exception(e)
+
     if query.status == utils.QueryStatus.STOPPED:
+        if writer and writer.pages:
+            # the rows fetched before the stop are all there is, readers
+            # polling for more pages stop there
+            writer.write_index({
+                'query_id': query.id,
+                'status': query.status,
+                'columns': columns or [],
+                'query': query.to_dict(),
+            })
         return json.dumps({
             'query_id': query.id,
             'status': query.status,
             'query': query.to_dict(),
         }, default=utils.json_iso_dttm_ser)
 
-    column_names = (
-        [col[0] for col in cursor.description] if cursor.description else [])
-    column_names = dedup(column_names)
-    cdf = dataframe.SupersetDataFrame(pd.DataFrame(
-        list(data), columns=column_names))
-
-    query.rows = cdf.size
+    query.rows = rows
     query.progress = 100
     query.status = QueryStatus.SUCCESS
     if query.select_as_cta:
@@ -159,20 +443,29 @@ def get_sql_results(self, query_id, return_results=True, store_results=False):
     payload = {
         'query_id': query.id,
         'status': query.status,
-        'data': cdf.data if cdf.data else [],
-        'columns': cdf.columns if cdf.columns else [],
+        'columns': columns or [],
         'query': query.to_dict(),
     }
-    payload = json.dumps(payload, default=utils.json_iso_dttm_ser)
 
-    if store_results:
-        key = '{}'.format(uuid.uuid4())
-        logging.info("Storing results in results backend, key: {}".format(key))
-        results_backend.set(key, zlib.compress(payload))
-        query.results_key = key
+    if writer:
+        writer.write_index(payload)
+        query.results_key = writer.key
 
     session.flush()
     session.commit()
 
     if return_results:
-        return payload
+        payload['data'] = data
+        return json.dumps(payload, default=utils.json_iso_dttm_ser)
+
+
+@celery_app.task
+def refresh_table_index(database_id, schema=None):
+    """Rebuilds and publishes the index of the table names of a schema"""
+    session = get_worker_session()
+    try:
+        database = (
+            session.query(models.Database).filter_by(id=database_id).one())
+        table_index.refresh_index(database, schema, force=False)
+    finally:
+        session.close()
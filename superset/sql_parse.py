@@ -4,6 +4,10 @@ from sqlparse.tokens import DML, Keyword, Name
 
 RESULT_OPERATIONS = {'UNION', 'INTERSECT', 'EXCEPT'}
 PRECEDES_TABLE_NAME = {'FROM', 'JOIN', 'DESC', 'DESCRIBE', 'WITH'}
+NON_DETERMINISTIC_FUNCTIONS = {
+    'CURRENT_DATE', 'CURRENT_TIME', 'CURRENT_TIMESTAMP', 'GETDATE',
+    'LOCALTIME', 'LOCALTIMESTAMP', 'NEWID', 'NOW', 'RAND', 'RANDOM',
+    'SYSDATE', 'UNIX_TIMESTAMP', 'UUID'}
 
 
 # TODO: some sql_lab logic here.
@@ -32,6 +36,22 @@ class SupersetQuery(object):
                 sql = sql[:-1]
             return sql
 
+    def is_deterministic(self):
+        """Whether the statement calls functions returning varying values"""
+        for statement in self._parsed:
+            for token in statement.flatten():
+                if (
+                        (token.ttype in Name or token.ttype in Keyword) and
+                        token.value.upper() in NON_DETERMINISTIC_FUNCTIONS):
+                    return False
+        return True
+
+    def normalized(self):
+        """The statement without comments nor insignificant whitespaces"""
+        sql = sqlparse.format(
+            self.stripped() or '', strip_comments=True, strip_whitespace=True)
+        return sql.rstrip('; \n\t')
+
     @staticmethod
     def __precedes_table_name(token_value):
         for keyword in PRECEDES_TABLE_NAME:
@@ -0,0 +1,230 @@
+"""Searchable indexes of the table and view names of a database schema
+
+SQL Lab looks the tables up as the user types. Rather than scanning every
+name of the schema on each keystroke, the names are indexed once, sorted for
+prefix lookups and by trigrams for substring lookups.
+
+Each process keeps the indexes of the schemas recently searched. When the
+table names cache is configured, the indexes are built by
+``update_datasources_cache`` or by a Celery worker and shared through the
+cache, the processes keep searching their stale copy of an index until the
+new one is published. Processes only build an index in the request when
+they have no copy of it at all, or when there's no cache to share them
+through.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from bisect import bisect_left
+from collections import namedtuple, OrderedDict
+import threading
+import time
+import uuid
+
+from superset import app, tables_cache
+
+config = app.config
+
+TRIGRAM_SIZE = 3
+
+# the beginning of the name or of any of its dot or underscore separated parts
+WORD_BOUNDARY = '._- '
+
+# how well a name matches the searched string, the lower the better
+EXACT, PREFIX, WORD_PREFIX, SUBSTRING = range(4)
+
+IndexEntry = namedtuple('IndexEntry', ['version', 'built_on', 'index'])
+
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+
+def trigrams(s):
+    """Returns the set of the substrings of 3 characters of a string
+
+    >>> print(' '.join(sorted(trigrams('abcd'))))
+    abc bcd
+    >>> len(trigrams('ab'))
+    0
+    """
+    return set(s[i:i + TRIGRAM_SIZE] for i in range(len(s) - TRIGRAM_SIZE + 1))
+
+
+class TableNameIndex(object):
+
+    """Index of the table and view names of a schema"""
+
+    def __init__(self, table_names, view_names=()):
+        entries = sorted(
+            set((name, False) for name in table_names) |
+            set((name, True) for name in view_names),
+            key=lambda entry: (entry[0].lower(), entry[0], entry[1]))
+        self.names = [name for name, is_view in entries]
+        self.is_view = [is_view for name, is_view in entries]
+        self.lower_names = [name.lower() for name in self.names]
+
+        self.postings = {}
+        for i, name in enumerate(self.lower_names):
+            for trigram in trigrams(name):
+                self.postings.setdefault(trigram, []).append(i)
+
+    def __len__(self):
+        return len(self.names)
+
+    def prefix_bounds(self, prefix):
+        """Bounds of the positions of the names starting with a prefix"""
+        start = bisect_left(self.lower_names, prefix)
+        end = start
+        while (end < len(self.lower_names) and
+                self.lower_names[end].startswith(prefix)):
+            end += 1
+        return start, end
+
+    def substring_matches(self, substr):
+        """Positions of the names containing a string"""
+        grams = trigrams(substr)
+        if not grams:
+            # too short to be indexed, few enough characters to scan for
+            return [
+                i for i, name in enumerate(self.lower_names)
+                if substr in name]
+        postings = sorted(
+            (self.postings.get(gram, []) for gram in grams), key=len)
+        candidates = set(postings[0])
+        for positions in postings[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(positions)
+        # the trigrams may be in a different order in the name
+        return [i for i in candidates if substr in self.lower_names[i]]
+
+    def rank(self, i, substr):
+        name = self.lower_names[i]
+        if name == substr:
+            return EXACT
+        if name.startswith(substr):
+            return PREFIX
+        pos = name.find(substr)
+        while pos > 0:
+            if name[pos - 1] in WORD_BOUNDARY:
+                return WORD_PREFIX
+            pos = name.find(substr, pos + 1)
+        return SUBSTRING
+
+    def search(self, substr=None):
+        """Returns the (name, is_view) pairs of the names containing a string
+
+        The search isn't case sensitive. The names matching all of the string
+        come first, followed by the ones starting with it, by the ones with a
+        part starting with it and the ones merely containing it, shorter
+        names first.
+        """
+        if not substr:
+            positions = range(len(self.names))
+        else:
+            substr = substr.lower()
+            start, end = self.prefix_bounds(substr)
+            others = [
+                i for i in self.substring_matches(substr)
+                if not start <= i < end]
+
+            def sort_key(i):
+                return self.rank(i, substr), len(self.names[i]), i
+            positions = (
+                sorted(range(start, end), key=sort_key) +
+                sorted(others, key=sort_key))
+        return [(self.names[i], self.is_view[i]) for i in positions]
+
+
+def index_key(database, schema):
+    return 'table_index_{}_{}'.format(database.id, schema or '')
+
+
+def build_index(database, schema=None, force=False):
+    return TableNameIndex(
+        database.all_table_names(schema, force=force),
+        database.all_view_names(schema, force=force))
+
+
+def store_index(key, version, built_on, index):
+    with _lock:
+        _indexes.pop(key, None)
+        _indexes[key] = IndexEntry(version, built_on, index)
+        while len(_indexes) > config.get('TABLE_NAMES_INDEX_MAX_SCHEMAS'):
+            _indexes.popitem(last=False)
+
+
+def is_expired(built_on):
+    return time.time() - built_on >= config.get('TABLE_NAMES_INDEX_TIMEOUT')
+
+
+def schedule_refresh(database, schema=None):
+    """Has a Celery worker rebuild and publish the index of a schema
+
+    Returns whether the index will be rebuilt outside of the request, which
+    takes the table names cache to share it and Celery to build it.
+    """
+    if not (tables_cache and config.get('CELERY_CONFIG')):
+        return False
+    key = index_key(database, schema)
+    # a single rebuild at a time, the flag expires in case the worker dies
+    if tables_cache.add(
+            key + '_refreshing', True,
+            timeout=config.get('TABLE_NAMES_INDEX_TIMEOUT')):
+        from superset import sql_lab
+        sql_lab.refresh_table_index.delay(database.id, schema)
+    return True
+
+
+def get_index(database, schema=None):
+    """Returns the index of the tables and views of a schema
+
+    An empty schema indexes the full names of the tables and views of all
+    the schemas.
+    """
+    key = index_key(database, schema)
+    version = tables_cache.get(key) if tables_cache else None
+    with _lock:
+        # the least recently searched indexes are dropped first
+        entry = _indexes.pop(key, None)
+        if entry:
+            _indexes[key] = entry
+    if entry and entry.version == version and not is_expired(entry.built_on):
+        return entry.index
+
+    published = None
+    if version is not None:
+        published = tables_cache.get('{}_{}'.format(key, version))
+    if published:
+        built_on, index = published
+        store_index(key, version, built_on, index)
+        if not is_expired(built_on):
+            return index
+        entry = IndexEntry(version, built_on, index)
+
+    if entry and schedule_refresh(database, schema):
+        # searching the stale index until the new one is published
+        return entry.index
+    return refresh_index(database, schema, force=False)
+
+
+def refresh_index(database, schema=None, force=True):
+    """Rebuilds the index of a schema, refreshing its names when forced
+
+    The index is published through the table names cache, the other
+    processes pick it up on their next search.
+    """
+    key = index_key(database, schema)
+    index = build_index(database, schema, force=force)
+    built_on = time.time()
+    version = None
+    if tables_cache:
+        version = uuid.uuid4().hex
+        # the index goes first so that it's there once the version changes
+        tables_cache.set('{}_{}'.format(key, version), (built_on, index))
+        tables_cache.set(key, version, timeout=0)
+        tables_cache.delete(key + '_refreshing')
+    store_index(key, version, built_on, index)
+    return index
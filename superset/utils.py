@@ -16,9 +16,10 @@ import smtplib
 import sqlalchemy as sa
 import signal
 import uuid
+import zlib
 
 from builtins import object
-from datetime import date, datetime, time
+from datetime import date, datetime, time, timedelta
 from dateutil.parser import parse
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
@@ -70,13 +71,8 @@ class SupersetTemplateException(SupersetException):
     pass
 
 
-def can_access(sm, permission_name, view_name, user):
-    """Protecting from has_access failing from missing perms/view"""
-    return (
-        sm.is_item_public(permission_name, view_name) or
-        (not user.is_anonymous() and
-         sm._has_view_access(user, permission_name, view_name))
-    )
+class ResultsExpiredException(SupersetException):
+    pass
 
 
 def flasher(msg, severity=None):
@@ -284,6 +280,16 @@ def datetime_to_epoch(dttm):
     return (dttm - EPOCH).total_seconds() * 1000
 
 
+def floor_datetime(dttm, seconds):
+    """Truncates a naive datetime to a multiple of ``seconds`` since epoch
+
+    >>> floor_datetime(datetime(2017, 3, 1, 10, 42, 17), 3600)
+    datetime.datetime(2017, 3, 1, 10, 0)
+    """
+    delta = int((dttm - EPOCH).total_seconds())
+    return EPOCH + timedelta(seconds=delta - delta % seconds)
+
+
 def now_as_float():
     return datetime_to_epoch(datetime.utcnow())
 
@@ -308,6 +314,33 @@ def json_dumps_w_dates(payload):
     return json.dumps(payload, default=json_int_dttm_ser)
 
 
+def df_to_csv_chunks(dfs, **kwargs):
+    """Yields the CSV of a sequence of DataFrames, with a single header"""
+    header = True
+    for df in dfs:
+        yield df.to_csv(header=header, encoding='utf-8', **kwargs)
+        header = False
+
+
+def gzip_chunks(chunks, compresslevel=6):
+    """Compresses a stream of strings into the chunks of a gzip stream
+
+    >>> import gzip, io
+    >>> blob = b''.join(gzip_chunks(['foo,bar\\n', '1,2\\n']))
+    >>> gzip.GzipFile(fileobj=io.BytesIO(blob)).read() == b'foo,bar\\n1,2\\n'
+    True
+    """
+    compressor = zlib.compressobj(
+        compresslevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        if not isinstance(chunk, bytes):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
 def error_msg_from_exception(e):
     """Translate exception into error message
 
@@ -445,6 +478,7 @@ class QueryStatus(object):
     STOPPED = 'stopped'
     FAILED = 'failed'
     PENDING = 'pending'
+    QUEUED = 'queued'
     RUNNING = 'running'
     SCHEDULED = 'scheduled'
     SUCCESS = 'success'
@@ -9,9 +9,8 @@ from flask_appbuilder import ModelView
 from flask_appbuilder.widgets import ListWidget
 from flask_appbuilder.actions import action
 from flask_appbuilder.models.sqla.filters import BaseFilter
-from flask_appbuilder.security.sqla import models as ab_models
 
-from superset import appbuilder, conf, db, utils, sm, sql_parse
+from superset import appbuilder, conf, db, utils, security, sql_parse
 from superset.connectors.connector_registry import ConnectorRegistry
 
 
@@ -30,8 +29,7 @@ class BaseSupersetView(BaseView):
     def can_access(self, permission_name, view_name, user=None):
         if not user:
             user = g.user
-        return utils.can_access(
-            appbuilder.sm, permission_name, view_name, user)
+        return security.can_access(permission_name, view_name, user)
 
     def all_datasource_access(self, user=None):
         return self.can_access(
@@ -63,8 +61,7 @@ class BaseSupersetView(BaseView):
             return True
 
         schema_perm = utils.get_schema_perm(database, schema)
-        if schema and utils.can_access(
-                sm, 'schema_access', schema_perm, g.user):
+        if schema and self.can_access('schema_access', schema_perm):
             return True
 
         datasources = ConnectorRegistry.query_datasources_by_name(
@@ -97,21 +94,13 @@ class BaseSupersetView(BaseView):
             return datasource_names
 
         schema_perm = utils.get_schema_perm(database, schema)
-        if schema and utils.can_access(
-                sm, 'schema_access', schema_perm, g.user):
+        if schema and self.can_access('schema_access', schema_perm):
             return datasource_names
 
-        role_ids = set([role.id for role in g.user.roles])
-        # TODO: cache user_perms or user_datasources
-        user_pvms = (
-            db.session.query(ab_models.PermissionView)
-            .join(ab_models.Permission)
-            .filter(ab_models.Permission.name == 'datasource_access')
-            .filter(ab_models.PermissionView.role.any(
-                ab_models.Role.id.in_(role_ids)))
-            .all()
-        )
-        user_perms = set([pvm.view_menu.name for pvm in user_pvms])
+        user_perms = set([
+            view_menu for perm, view_menu in
+            security.get_user_permissions(g.user)
+            if perm == 'datasource_access'])
         user_datasources = ConnectorRegistry.query_datasources_by_permissions(
             db.session, database, user_perms)
         full_names = set([d.full_name for d in user_datasources])
@@ -151,8 +140,8 @@ class SupersetFilter(BaseFilter):
     """Add utility function to make BaseFilter easy and fast
 
     These utility function exist in the SecurityManager, but would do
-    a database round trip at every check. Here we cache the role objects
-    to be able to make multiple checks but query the db only once
+    a database round trip at every check. Here we use the cached
+    permission set of the user to make multiple checks
     """
 
     def get_user_roles(self):
@@ -160,12 +149,7 @@ class SupersetFilter(BaseFilter):
 
     def get_all_permissions(self):
         """Returns a set of tuples with the perm name and view menu name"""
-        perms = set()
-        for role in self.get_user_roles():
-            for perm_view in role.permissions:
-                t = (perm_view.permission.name, perm_view.view_menu.name)
-                perms.add(t)
-        return perms
+        return security.get_user_permissions(g.user)
 
     def has_role(self, role_name_or_list):
         """Whether the user has this role name"""
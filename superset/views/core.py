@@ -12,13 +12,15 @@ import re
 import sys
 import time
 import traceback
-import zlib
 
 import functools
+import hashlib
 import sqlalchemy as sqla
 
 from flask import (
-    g, request, redirect, flash, Response, render_template, Markup)
+    g, request, redirect, flash, Response, render_template, Markup,
+    stream_with_context)
+from flask import session as flask_session
 from flask_appbuilder import expose
 from flask_appbuilder.actions import action
 from flask_appbuilder.models.sqla.interface import SQLAInterface
@@ -33,7 +35,8 @@ from werkzeug.routing import BaseConverter
 
 from superset import (
     appbuilder, cache, db, viz, utils, app,
-    sm, sql_lab, results_backend, security,
+    sm, sql_lab, results_backend, results_store, query_channel, security,
+    pubsub_backend, table_index,
 )
 from superset.legacy import cast_form_data
 from superset.utils import has_access
@@ -48,7 +51,6 @@ from .base import (
 
 config = app.config
 log_this = models.Log.log_this
-can_access = utils.can_access
 QueryStatus = models.QueryStatus
 DAR = models.DatasourceAccessRequest
 
@@ -195,8 +197,8 @@ class DashboardFilter(SupersetFilter):
         return query
 
 
-def generate_download_headers(extension):
-    filename = datetime.now().strftime("%Y%m%d_%H%M%S")
+def generate_download_headers(extension, filename=None):
+    filename = filename or datetime.now().strftime("%Y%m%d_%H%M%S")
     content_disp = "attachment; filename={}.{}".format(filename, extension)
     headers = {
         "Content-Disposition": content_disp,
@@ -204,6 +206,19 @@ def generate_download_headers(extension):
     return headers
 
 
+def stream_csv_response(chunks, headers, mimetype='text/csv'):
+    """Streams the chunks of a CSV, gzipped if the client accepts it"""
+    headers = dict(headers)
+    if config.get('CSV_EXPORT_GZIP'):
+        # caches keep the compressed and uncompressed responses apart
+        headers['Vary'] = 'Accept-Encoding'
+        if 'gzip' in request.accept_encodings:
+            chunks = utils.gzip_chunks(chunks)
+            headers['Content-Encoding'] = 'gzip'
+    return Response(
+        stream_with_context(chunks), headers=headers, mimetype=mimetype)
+
+
 class DatabaseView(SupersetModelView, DeleteMixin):  # noqa
     datamodel = SQLAInterface(models.Database)
     list_columns = [
@@ -212,7 +227,8 @@ class DatabaseView(SupersetModelView, DeleteMixin):  # noqa
     add_columns = [
         'database_name', 'sqlalchemy_uri', 'cache_timeout', 'extra',
         'expose_in_sqllab', 'allow_run_sync', 'allow_run_async',
-        'allow_ctas', 'allow_dml', 'force_ctas_schema']
+        'allow_ctas', 'allow_dml', 'force_ctas_schema',
+        'results_cache_timeout', 'celery_queue', 'max_concurrent_queries']
     search_exclude_columns = ('password',)
     edit_columns = add_columns
     show_columns = [
@@ -254,6 +270,20 @@ class DatabaseView(SupersetModelView, DeleteMixin):  # noqa
         'force_ctas_schema': _(
             "When allowing CREATE TABLE AS option in SQL Lab, "
             "this option forces the table to be created in this schema"),
+        'results_cache_timeout': _(
+            "Number of seconds during which SQL Lab serves the stored "
+            "results of an identical query instead of running it again. "
+            "Queries that modify data or call non-deterministic functions "
+            "such as NOW() are always run. Leave empty to disable"),
+        'celery_queue': _(
+            "Name of the Celery queue the asynchronous queries against this "
+            "database are sent to, workers are bound to queues with the "
+            "--queues option of `superset worker`. Leave empty to use the "
+            "default queue"),
+        'max_concurrent_queries': _(
+            "Maximum number of asynchronous queries running at the same "
+            "time against this database, the queries above that limit are "
+            "queued. Leave empty for no limit"),
         'extra': utils.markdown(
             "JSON string containing extra configuration elements. "
             "The ``engine_params`` object gets unpacked into the "
@@ -274,6 +304,9 @@ class DatabaseView(SupersetModelView, DeleteMixin):  # noqa
         'changed_on_': _("Last Changed"),
         'sqlalchemy_uri': _("SQLAlchemy URI"),
         'cache_timeout': _("Cache Timeout"),
+        'results_cache_timeout': _("SQL Lab Results Cache Timeout"),
+        'celery_queue': _("Celery Queue"),
+        'max_concurrent_queries': _("Max Concurrent Queries"),
         'extra': _("Extra"),
     }
 
@@ -974,9 +1007,8 @@ class Superset(BaseSupersetView):
             return json_error_response(DATASOURCE_ACCESS_ERR, status=404)
 
         if request.args.get("csv") == "true":
-            return Response(
-                viz_obj.get_csv(),
-                status=200,
+            return stream_csv_response(
+                viz_obj.get_csv_chunks(),
                 headers=generate_download_headers("csv"),
                 mimetype="application/csv")
 
@@ -1279,34 +1311,37 @@ class Superset(BaseSupersetView):
     @has_access_api
     @expose("/tables/<db_id>/<schema>/<substr>/")
     def tables(self, db_id, schema, substr):
-        """Endpoint to fetch the list of tables for given database"""
+        """Endpoint to search the tables and views of a database
+
+        The best matches come first, ``offset`` and ``limit`` page through
+        them."""
         schema = utils.js_string_to_python(schema)
         substr = utils.js_string_to_python(substr)
+        try:
+            offset = int(request.args.get('offset', 0))
+            limit = int(
+                request.args.get('limit') or config.get('MAX_TABLE_NAMES') or 0)
+        except ValueError:
+            return json_error_response(
+                "offset and limit must be integers", status=400)
         database = db.session.query(models.Database).filter_by(id=db_id).one()
-        table_names = self.accessible_by_user(
-            database, database.all_table_names(schema), schema)
-        view_names = self.accessible_by_user(
-            database, database.all_view_names(schema), schema)
-
-        if substr:
-            table_names = [tn for tn in table_names if substr in tn]
-            view_names = [vn for vn in view_names if substr in vn]
-
-        max_items = config.get('MAX_TABLE_NAMES') or len(table_names)
-        total_items = len(table_names) + len(view_names)
-        max_tables = len(table_names)
-        max_views = len(view_names)
-        if total_items and substr:
-            max_tables = max_items * len(table_names) // total_items
-            max_views = max_items * len(view_names) // total_items
-
-        table_options = [{'value': tn,  'label': tn}
-                         for tn in table_names[:max_tables]]
-        table_options.extend([{'value': vn, 'label': '[view] {}'.format(vn)}
-                              for vn in view_names[:max_views]])
+
+        matches = table_index.get_index(database, schema).search(substr)
+        names = [name for name, is_view in matches]
+        accessible_names = self.accessible_by_user(database, names, schema)
+        if len(accessible_names) < len(names):
+            accessible_names = set(accessible_names)
+            matches = [m for m in matches if m[0] in accessible_names]
+
+        page = matches[offset:offset + limit] if limit else matches[offset:]
+        options = [{
+            'value': name,
+            'label': '[view] {}'.format(name) if is_view else name,
+        } for name, is_view in page]
         payload = {
-            'tableLength': len(table_names) + len(view_names),
-            'options': table_options,
+            'tableLength': len(matches),
+            'offset': offset,
+            'options': options,
         }
         return json_success(json.dumps(payload))
 
@@ -1676,13 +1711,7 @@ class Superset(BaseSupersetView):
     def dashboard(self, dashboard_id):
         """Server side rendering for a dashboard"""
         session = db.session()
-        qry = session.query(models.Dashboard)
-        if dashboard_id.isdigit():
-            qry = qry.filter_by(id=int(dashboard_id))
-        else:
-            qry = qry.filter_by(slug=dashboard_id)
-
-        dash = qry.one()
+        dash = models.Dashboard.get_eager(session, dashboard_id)
         datasources = {slc.datasource for slc in dash.slices}
         for datasource in datasources:
             if not self.datasource_access(datasource):
@@ -1703,18 +1732,32 @@ class Superset(BaseSupersetView):
         dash_save_perm = \
             dash_edit_perm and self.can_access('can_save_dash', 'Superset')
         standalone = request.args.get("standalone") == "true"
-        context = dict(
+        context = json.dumps(dict(
             user_id=g.user.get_id(),
             dash_save_perm=dash_save_perm,
             dash_edit_perm=dash_edit_perm,
             standalone_mode=standalone,
-        )
-        return self.render_template(
-            "superset/dashboard.html",
-            dashboard=dash,
-            context=json.dumps(context),
-            standalone_mode=standalone,
-        )
+        ))
+        dashboard_data, data_etag = dash.get_cached_json_data()
+        # the page changes with the dashboard, the user and the release
+        etag = hashlib.md5('{}{}{}'.format(
+            data_etag, context, config.get('VERSION_STRING'),
+        ).encode('utf-8')).hexdigest()
+        if (
+                request.if_none_match.contains(etag) and
+                '_flashes' not in flask_session):
+            response = Response(status=304)
+        else:
+            response = Response(self.render_template(
+                "superset/dashboard.html",
+                dashboard=dash,
+                dashboard_data=dashboard_data,
+                context=context,
+                standalone_mode=standalone,
+            ))
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
 
     @has_access
     @expose("/sync_druid/", methods=['POST'])
@@ -1787,10 +1830,23 @@ class Superset(BaseSupersetView):
         q = SupersetQuery(data.get('sql'))
         table.sql = q.stripped()
         db.session.add(table)
+        # the types inferred when the results were stored are the defaults,
+        # the settings picked in the visualize modal take precedence
+        schema = {}
+        if results_backend and data.get('resultsKey'):
+            index = results_store.get_index(
+                results_backend, data.get('resultsKey'))
+            schema = {
+                col['name']: col for col in (index or {}).get('columns') or []}
+        columns = {
+            column_name: dict(schema.get(column_name, {}), **config)
+            for column_name, config in (data.get('columns') or {}).items()}
+        for column_name, config in schema.items():
+            columns.setdefault(column_name, config)
         cols = []
         dims = []
         metrics = []
-        for column_name, config in data.get('columns').items():
+        for column_name, config in columns.items():
             is_dim = config.get('is_dim', False)
             SqlaTable = ConnectorRegistry.sources['table']
             TableColumn = SqlaTable.column_cls
@@ -1934,8 +1990,8 @@ class Superset(BaseSupersetView):
         if not results_backend:
             return json_error_response("Results backend isn't configured")
 
-        blob = results_backend.get(key)
-        if not blob:
+        index = results_store.get_index(results_backend, key)
+        if not index:
             return json_error_response(
                 "Data could not be retrieved. "
                 "You may want to re-run the query.",
@@ -1949,11 +2005,28 @@ class Superset(BaseSupersetView):
             return json_error_response(get_datasource_access_error_msg(
                 '{}'.format(rejected_tables)))
 
-        payload = zlib.decompress(blob)
+        offset = request.args.get('offset', 0, type=int)
+        limit = request.args.get('limit', type=int)
         display_limit = app.config.get('DISPLAY_SQL_MAX_ROW', None)
-        if display_limit:
-            payload_json = json.loads(payload)
-            payload_json['data'] = payload_json['data'][:display_limit]
+        if display_limit and (not limit or limit > display_limit):
+            limit = display_limit
+        # `orient=columns` returns the values column by column, which is
+        # lighter to build and to parse than a dict per row
+        orient = request.args.get('orient', 'records')
+        if orient not in ('records', 'columns'):
+            return json_error_response(
+                "Unknown orient: {}".format(orient), status=400)
+        try:
+            payload_json = results_store.load_payload(
+                results_backend, index, offset=max(offset, 0), limit=limit,
+                orient=orient)
+        except utils.ResultsExpiredException as e:
+            logging.warning(e)
+            return json_error_response(
+                "Data could not be retrieved. "
+                "You may want to re-run the query.",
+                status=410
+            )
         return json_success(
             json.dumps(payload_json, default=utils.json_iso_dttm_ser))
 
@@ -1969,6 +2042,7 @@ class Superset(BaseSupersetView):
                 "Only original author can stop the query.")
         query.status = utils.QueryStatus.STOPPED
         db.session.commit()
+        query_channel.request_stop(query.id)
         return Response(201)
 
     @has_access_api
@@ -2022,10 +2096,23 @@ class Superset(BaseSupersetView):
 
         # Async request.
         if async:
+            # CTAS queries are batch jobs, they run after the interactive
+            # ones when the broker supports priorities
+            options = {
+                'priority': config.get(
+                    'SQLLAB_BATCH_PRIORITY' if query.select_as_cta
+                    else 'SQLLAB_INTERACTIVE_PRIORITY'),
+            }
+            if mydb.celery_queue:
+                options['queue'] = mydb.celery_queue
             # Ignore the celery future object and the request may time out.
-            sql_lab.get_sql_results.delay(
-                query_id, return_results=False,
-                store_results=not query.select_as_cta)
+            sql_lab.get_sql_results.apply_async(
+                args=(query_id,),
+                kwargs={
+                    'return_results': False,
+                    'store_results': not query.select_as_cta,
+                },
+                **options)
             return json_success(json.dumps(
                 {'query': query.to_dict()}, default=utils.json_int_dttm_ser,
                 allow_nan=False), status=202)
@@ -2062,24 +2149,22 @@ class Superset(BaseSupersetView):
         if rejected_tables:
             flash(get_datasource_access_error_msg('{}'.format(rejected_tables)))
             return redirect('/')
-        blob = None
+        index = None
         if results_backend and query.results_key:
-            blob = results_backend.get(query.results_key)
-        if blob:
-            json_payload = zlib.decompress(blob)
-            obj = json.loads(json_payload)
-            columns = [c['name'] for c in obj['columns']]
-            df = pd.DataFrame.from_records(obj['data'], columns=columns)
-            csv = df.to_csv(index=False, encoding='utf-8')
+            index = results_store.get_index(
+                results_backend, query.results_key)
+        # rows are read and sent a page or a chunk at a time, truncated
+        # results holding only the first rows are fetched again, from the
+        # table they were spilled to if any
+        if index and index['complete'] and not query.results_truncated:
+            dfs = results_store.iter_dataframes(results_backend, index)
         else:
             sql = query.select_sql or query.executed_sql
-            df = query.database.get_df(sql, query.schema)
-            # TODO(bkyryliuk): add compression=gzip for big files.
-            csv = df.to_csv(index=False, encoding='utf-8')
-        response = Response(csv, mimetype='text/csv')
-        response.headers['Content-Disposition'] = (
-            'attachment; filename={}.csv'.format(query.name))
-        return response
+            dfs = query.database.iter_dfs(
+                sql, query.schema, config.get('CSV_EXPORT_CHUNK_SIZE'))
+        return stream_csv_response(
+            utils.df_to_csv_chunks(dfs, index=False),
+            headers=generate_download_headers('csv', query.name))
 
     @has_access
     @expose("/fetch_datasource_metadata")
@@ -2117,18 +2202,65 @@ class Superset(BaseSupersetView):
         # UTC date time, same that is stored in the DB.
         last_updated_dt = utils.EPOCH + timedelta(seconds=last_updated_ms_int / 1000)
 
+        # running queries publish their progress through the query channel
+        # rather than through the query table
         sql_queries = (
             db.session.query(models.Query)
             .filter(
                 models.Query.user_id == g.user.get_id(),
-                models.Query.changed_on >= last_updated_dt,
+                sqla.or_(
+                    models.Query.changed_on >= last_updated_dt,
+                    models.Query.status == QueryStatus.RUNNING,
+                ),
+            )
+            .options(
+                sqla.orm.joinedload(models.Query.database),
+                sqla.orm.joinedload(models.Query.user),
             )
             .all()
         )
         dict_queries = {q.client_id: q.to_dict() for q in sql_queries}
+        progress = query_channel.get_progress([
+            q.id for q in sql_queries if q.status == QueryStatus.RUNNING])
+        for q in sql_queries:
+            if q.id in progress:
+                dict_queries[q.client_id]['progress'] = max(
+                    progress[q.id], q.progress or 0)
         return json_success(
             json.dumps(dict_queries, default=utils.json_int_dttm_ser))
 
+    @has_access
+    @expose("/queries_updates/")
+    @expose("/queries_updates/<int:seq>")
+    def queries_updates(self, seq=None):
+        """Long polls the changes of the user's queries
+
+        Returns the sequence number to poll from next along with the queries
+        changed after ``seq``, waiting for changes up to
+        SQLLAB_LONG_POLL_TIMEOUT seconds. Without ``seq``, returns the
+        current sequence number right away.
+        """
+        if not g.user.get_id():
+            return json_error_response(
+                "Please login to access the queries.", status=403)
+        if not pubsub_backend:
+            # SQL Lab polls /superset/queries/ instead
+            return json_error_response(
+                "Query updates aren't pushed, PUBSUB_BACKEND isn't set",
+                status=501)
+        channel = models.Query.get_updates_channel(g.user.get_id())
+        queries = {}
+        if seq is None:
+            seq = pubsub_backend.last_seq(channel)
+        else:
+            seq, events = pubsub_backend.listen(
+                channel, seq, config.get('SQLLAB_LONG_POLL_TIMEOUT'))
+            for _, query in events:
+                queries[query['id']] = query
+        return json_success(json.dumps(
+            {'seq': seq, 'queries': queries},
+            default=utils.json_int_dttm_ser))
+
     @has_access
     @expose("/search_queries")
     @log_this
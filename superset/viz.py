@@ -17,10 +17,12 @@ import zlib
 
 from collections import OrderedDict, defaultdict
 from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
 
 import pandas as pd
 import numpy as np
-from flask import request
+from flask import (
+    copy_current_request_context, has_request_context, request)
 from flask_babel import lazy_gettext as _
 from markdown import markdown
 import simplejson as json
@@ -99,41 +101,99 @@ class BaseViz(object):
         self.error_msg = ""
         self.results = None
 
+        # The datasource here can be different backend but the interface is common
+        self.results = self.datasource.query(query_obj)
+        return self.process_results(self.results, query_obj)
+
+    def get_dfs(self, query_objs):
+        """Runs independent queries concurrently
+
+        Returns one dataframe per query object, in the same order. At most
+        ``VIZ_QUERY_CONCURRENCY`` queries run at the same time so the
+        latency is set by the slowest query rather than by the sum of all
+        of them. The queries of datasources which can't run them on threads
+        run one after the other.
+        """
+        pool_size = min(
+            len(query_objs), config.get('VIZ_QUERY_CONCURRENCY') or 1)
+        if pool_size <= 1 or not self.datasource.concurrent_queries:
+            return [self.get_df(query_obj) for query_obj in query_objs]
+
+        # The ORM objects are shared with the worker threads, their
+        # relationships are loaded here so that threads don't lazy load
+        # them through the request's session
+        self.datasource.columns
+        self.datasource.metrics
+        self.datasource.database
+
+        run_query = self.datasource.query
+        tasks = []
+        for query_obj in query_objs:
+            func = run_query
+            if has_request_context():
+                # each task needs its own copy of the request context
+                func = copy_current_request_context(run_query)
+            tasks.append((func, query_obj))
+
+        pool = ThreadPool(pool_size)
+        try:
+            all_results = pool.map(lambda task: task[0](task[1]), tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+        self.error_msg = ""
+        dfs = []
+        queries = []
+        failure = None
+        for query_obj, results in zip(query_objs, all_results):
+            self.results = results
+            dfs.append(self.process_results(results, query_obj))
+            queries.append(self.query)
+            if not failure and self.error_message:
+                failure = (self.status, self.error_message)
+        self.query = "\n\n".join(queries)
+        if failure:
+            self.status, self.error_message = failure
+        return dfs
+
+    def process_results(self, results, query_obj):
+        """Turns the results of a datasource query into a dataframe"""
+        self.query = results.query
+        self.status = results.status
+        self.error_message = results.error_message
+
+        df = results.df
+        if df is None or df.empty:
+            self.status = utils.QueryStatus.FAILED
+            if not self.error_message:
+                self.error_message = "No data."
+            return pd.DataFrame()
+        return self.process_df(df, query_obj)
+
+    def process_df(self, df, query_obj):
+        """Converts the timestamps of the rows of a query and fills the nulls"""
         timestamp_format = None
         if self.datasource.type == 'table':
             dttm_col = self.datasource.get_col(query_obj['granularity'])
             if dttm_col:
                 timestamp_format = dttm_col.python_date_format
 
-        # The datasource here can be different backend but the interface is common
-        self.results = self.datasource.query(query_obj)
-        self.query = self.results.query
-        self.status = self.results.status
-        self.error_message = self.results.error_message
-
-        df = self.results.df
         # Transform the timestamp we received from database to pandas supported
         # datetime format. If no python_date_format is specified, the pattern will
         # be considered as the default ISO date format
         # If the datetime format is unix, the parse will use the corresponding
         # parsing logic.
-        if df is None or df.empty:
-            self.status = utils.QueryStatus.FAILED
-            if not self.error_message:
-                self.error_message = "No data."
-            return pd.DataFrame()
-        else:
-            if DTTM_ALIAS in df.columns:
-                if timestamp_format in ("epoch_s", "epoch_ms"):
-                    df[DTTM_ALIAS] = pd.to_datetime(df[DTTM_ALIAS], utc=False)
-                else:
-                    df[DTTM_ALIAS] = pd.to_datetime(
-                        df[DTTM_ALIAS], utc=False, format=timestamp_format)
-                if self.datasource.offset:
-                    df[DTTM_ALIAS] += timedelta(hours=self.datasource.offset)
-            df.replace([np.inf, -np.inf], np.nan)
-            df = df.fillna(0)
-        return df
+        if DTTM_ALIAS in df.columns:
+            if timestamp_format in ("epoch_s", "epoch_ms"):
+                df[DTTM_ALIAS] = pd.to_datetime(df[DTTM_ALIAS], utc=False)
+            else:
+                df[DTTM_ALIAS] = pd.to_datetime(
+                    df[DTTM_ALIAS], utc=False, format=timestamp_format)
+            if self.datasource.offset:
+                df[DTTM_ALIAS] += timedelta(hours=self.datasource.offset)
+        df.replace([np.inf, -np.inf], np.nan)
+        return df.fillna(0)
 
     def get_extra_filters(self):
         extra_filters = self.form_data.get('extra_filters', [])
@@ -319,10 +379,21 @@ class BaseViz(object):
         }
         return content
 
+    def get_csv_chunks(self):
+        """Returns an iterator over the CSV of the data, a chunk at a time
+
+        The rows are read from the datasource a chunk at a time too, the SQL
+        datasources never holding all of them in memory.
+        """
+        query_obj = self.query_obj()
+        dfs = (
+            self.process_df(df, query_obj)
+            for df in self.datasource.iter_query(
+                query_obj, config.get('CSV_EXPORT_CHUNK_SIZE')))
+        return utils.df_to_csv_chunks(dfs, index=False)
+
     def get_csv(self):
-        df = self.get_df()
-        include_index = not isinstance(df.index, pd.RangeIndex)
-        return df.to_csv(index=include_index, encoding="utf-8")
+        return ''.join(self.get_csv_chunks())
 
     def get_values_for_column(self, column):
         """
@@ -347,7 +418,11 @@ class BaseViz(object):
             column_name=column,
             from_dttm=from_dttm,
             to_dttm=to_dttm,
+            prefix=form_data.get("prefix"),
+            page_after=form_data.get("page_after"),
         )
+        if form_data.get("limit"):
+            kwargs['limit'] = int(form_data.get("limit"))
         df = self.datasource.values_for_column(**kwargs)
         return df[column].to_json()
 
@@ -897,6 +972,26 @@ class NVD3TimeSeriesViz(NVD3Viz):
             chart_data.append(d)
         return chart_data
 
+    time_compare_df = None
+
+    def time_compare_query_obj(self):
+        query_object = self.query_obj()
+        delta = utils.parse_human_timedelta(self.form_data.get('time_compare'))
+        query_object['inner_from_dttm'] = query_object['from_dttm']
+        query_object['inner_to_dttm'] = query_object['to_dttm']
+        query_object['from_dttm'] -= delta
+        query_object['to_dttm'] -= delta
+        return query_object
+
+    def get_df(self, query_obj=None):
+        if query_obj or not self.form_data.get('time_compare'):
+            return super(NVD3TimeSeriesViz, self).get_df(query_obj)
+        # the comparison query doesn't depend on the main one, both are
+        # fetched at once
+        df, self.time_compare_df = self.get_dfs(
+            [self.query_obj(), self.time_compare_query_obj()])
+        return df
+
     def get_data(self, df):
         fd = self.form_data
         df = df.fillna(0)
@@ -957,14 +1052,10 @@ class NVD3TimeSeriesViz(NVD3Viz):
 
         time_compare = fd.get('time_compare')
         if time_compare:
-            query_object = self.query_obj()
             delta = utils.parse_human_timedelta(time_compare)
-            query_object['inner_from_dttm'] = query_object['from_dttm']
-            query_object['inner_to_dttm'] = query_object['to_dttm']
-            query_object['from_dttm'] -= delta
-            query_object['to_dttm'] -= delta
-
-            df2 = self.get_df(query_object)
+            df2 = self.time_compare_df
+            if df2 is None:
+                df2 = self.get_df(self.time_compare_query_obj())
             df2[DTTM_ALIAS] += delta
             df2 = df2.pivot_table(
                 index=DTTM_ALIAS,
@@ -1353,10 +1444,12 @@ class FilterBoxViz(BaseViz):
     def get_data(self, df):
         qry = self.query_obj()
         filters = [g for g in self.form_data['groupby']]
+        if len(filters) > 1 and self.supports_grouping_sets:
+            dfs = self.get_grouping_sets_dfs(qry, filters)
+        else:
+            dfs = self.get_dfs([dict(qry, groupby=[flt]) for flt in filters])
         d = {}
-        for flt in filters:
-            qry['groupby'] = [flt]
-            df = super(FilterBoxViz, self).get_df(qry)
+        for flt, df in zip(filters, dfs):
             d[flt] = [{
                 'id': row[0],
                 'text': row[0],
@@ -1366,6 +1459,37 @@ class FilterBoxViz(BaseViz):
             ]
         return d
 
+    @property
+    def supports_grouping_sets(self):
+        return (
+            self.datasource.type == 'table' and
+            self.datasource.database.db_engine_spec.supports_grouping_sets)
+
+    def get_grouping_sets_dfs(self, qry, filters):
+        """Computes the values of all the filters in a single scan
+
+        Each filter column gets its own grouping set, the rows of a set are
+        the ones where its column is the only non NULL one. NULL values
+        can't be told apart between sets and are left out. The scan returns
+        up to ``row_limit`` rows for each of the filters.
+        """
+        metric = qry['metrics'][0]
+        row_limit = qry['row_limit']
+        df = self.get_df(dict(
+            qry, groupby=filters, row_limit=row_limit * len(filters),
+            grouping_sets=True))
+        dfs = []
+        for flt in filters:
+            if df.empty:
+                dfs.append(df)
+                continue
+            mask = self.results.df[flt].notnull()
+            for other in filters:
+                if other != flt:
+                    mask &= self.results.df[other].isnull()
+            dfs.append(df[mask][[flt, metric]].head(row_limit))
+        return dfs
+
 
 class IFrameViz(BaseViz):
 
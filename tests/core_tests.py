@@ -5,7 +5,9 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import csv
+from datetime import datetime
 import doctest
+import gzip
 import json
 import logging
 import io
@@ -13,8 +15,14 @@ import random
 import unittest
 
 from flask import escape
-
-from superset import db, utils, appbuilder, sm, jinja_context, sql_lab
+import mock
+import pandas as pd
+import sqlalchemy as sqla
+from werkzeug.contrib.cache import SimpleCache
+
+from superset import (
+    app, db, utils, appbuilder, sm, jinja_context, sql_lab, results_store,
+    dataframe, db_engine_specs, table_index)
 from superset.models import core as models
 from superset.views.core import DatabaseView
 from superset.connectors.sqla.models import SqlaTable
@@ -76,6 +84,49 @@ class CoreTests(SupersetTestCase):
             '/superset/slice/{}/?standalone=true'.format(slc.id))
         assert 'List Roles' not in resp
 
+    def test_viz_get_dfs(self):
+        slc = self.get_slice("Girls", db.session)
+        viz = slc.viz
+        qry = viz.query_obj()
+        dfs = viz.get_dfs([qry, dict(qry, row_limit=1)])
+        self.assertEqual(2, len(dfs))
+        self.assertEqual(len(viz.get_df(qry)), len(dfs[0]))
+        self.assertEqual(1, len(dfs[1]))
+
+    def test_grouping_sets_query_str(self):
+        tbl = self.get_table_by_name('birth_names')
+        sql = tbl.get_query_str(
+            tbl.database.get_sqla_engine(), datetime.now(),
+            groupby=['name', 'gender'],
+            metrics=['sum__num'],
+            granularity='ds',
+            from_dttm=datetime(1960, 1, 1),
+            to_dttm=datetime(2000, 1, 1),
+            filter=[],
+            is_timeseries=False,
+            extras={},
+            grouping_sets=True)
+        self.assertIn('GROUPING SETS ((name), (gender))', sql)
+        self.assertNotIn('LIMIT', sql)
+
+        with mock.patch.object(
+                models.Database, 'db_engine_spec',
+                new_callable=mock.PropertyMock) as db_engine_spec:
+            db_engine_spec.return_value = db_engine_specs.HiveEngineSpec
+            sql = tbl.get_query_str(
+                tbl.database.get_sqla_engine(), datetime.now(),
+                groupby=['name', 'gender'],
+                metrics=['sum__num'],
+                granularity='ds',
+                from_dttm=datetime(1960, 1, 1),
+                to_dttm=datetime(2000, 1, 1),
+                filter=[],
+                is_timeseries=False,
+                extras={},
+                grouping_sets=True)
+        self.assertIn(
+            'GROUP BY name, gender GROUPING SETS ((name), (gender))', sql)
+
     def test_slice_json_endpoint(self):
         self.login(username='admin')
         slc = self.get_slice("Girls", db.session)
@@ -98,6 +149,25 @@ class CoreTests(SupersetTestCase):
         resp = self.get_resp(csv_endpoint)
         assert 'Jennifer,' in resp
 
+        # the rows are read and written a few at a time
+        chunk_size = app.config['CSV_EXPORT_CHUNK_SIZE']
+        app.config['CSV_EXPORT_CHUNK_SIZE'] = 2
+        try:
+            with mock.patch.object(
+                    models.Database, 'iter_dfs', autospec=True,
+                    side_effect=models.Database.iter_dfs) as iter_dfs:
+                chunked_resp = self.get_resp(csv_endpoint)
+        finally:
+            app.config['CSV_EXPORT_CHUNK_SIZE'] = chunk_size
+        self.assertEquals(1, iter_dfs.call_count)
+        self.assertEquals(2, iter_dfs.call_args[0][3])
+        self.assertEquals(resp, chunked_resp)
+
+        resp = self.client.get(
+            csv_endpoint, headers={'Accept-Encoding': 'gzip'})
+        self.assertEquals('gzip', resp.headers['Content-Encoding'])
+        self.assertEquals('Accept-Encoding', resp.headers['Vary'])
+
     def test_admin_only_permissions(self):
         def assert_admin_permission_in(role_name, assert_func):
             role = sm.find_role(role_name)
@@ -255,8 +325,51 @@ class CoreTests(SupersetTestCase):
         for title, url in urls.items():
             assert escape(title) in self.client.get(url).data.decode('utf-8')
 
+    def test_dashboard_etag(self):
+        self.login(username='admin')
+        dash = db.session.query(models.Dashboard).filter_by(
+            slug='births').first()
+        resp = self.client.get(dash.url)
+        self.assertEquals(200, resp.status_code)
+        etag = resp.headers['ETag']
+
+        resp = self.client.get(dash.url, headers={'If-None-Match': etag})
+        self.assertEquals(304, resp.status_code)
+
+        dash.css = '.changed {}'
+        db.session.commit()
+        resp = self.client.get(dash.url, headers={'If-None-Match': etag})
+        self.assertEquals(200, resp.status_code)
+        self.assertNotEquals(etag, resp.headers['ETag'])
+        dash.css = ''
+        db.session.commit()
+
+    def test_dashboard_eager_loading(self):
+        statements = []
+
+        def count_statements(*args, **kwargs):
+            statements.append(args[2])
+
+        with app.test_request_context():
+            db.session.expunge_all()
+            dash = models.Dashboard.get_eager(db.session, 'births')
+            sqla.event.listen(
+                db.engine, 'before_cursor_execute', count_statements)
+            try:
+                for slc in dash.slices:
+                    slc.datasource.database.perm
+                    slc.datasource.column_names
+                    slc.datasource.metrics_combo
+                dash.json_data
+            finally:
+                sqla.event.remove(
+                    db.engine, 'before_cursor_execute', count_statements)
+        self.assertTrue(dash.slices)
+        self.assertEquals([], statements)
+
     def test_doctests(self):
-        modules = [utils, models, sql_lab]
+        modules = [
+            utils, models, sql_lab, results_store, dataframe, table_index]
         for mod in modules:
             failed, tests = doctest.testmod(mod)
             if failed:
@@ -266,6 +379,19 @@ class CoreTests(SupersetTestCase):
         assert self.get_resp('/health') == "OK"
         assert self.get_resp('/ping') == "OK"
 
+    def test_tables_search(self):
+        self.login(username='admin')
+        database = self.get_main_database(db.session)
+        url = '/superset/tables/{}/main/{}/'
+        data = self.get_json_resp(url.format(database.id, 'birth_names'))
+        self.assertEquals('birth_names', data['options'][0]['value'])
+
+        data = self.get_json_resp(
+            url.format(database.id, 'undefined') + '?offset=1&limit=2')
+        self.assertEquals(1, data['offset'])
+        self.assertEquals(2, len(data['options']))
+        self.assertGreater(data['tableLength'], 3)
+
     def test_testconn(self):
         database = self.get_main_database(db.session)
 
@@ -456,6 +582,40 @@ class CoreTests(SupersetTestCase):
             io.StringIO("first_name,last_name\nadmin, user\n"))
 
         self.assertEqual(list(expected_data), list(data))
+
+        resp = self.client.get(
+            '/superset/csv/{}'.format(client_id),
+            headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual('gzip', resp.headers['Content-Encoding'])
+        data = gzip.GzipFile(fileobj=io.BytesIO(resp.data)).read()
+        self.assertIn('admin', data.decode('utf-8'))
+        self.logout()
+
+    def test_csv_endpoint_stored_results(self):
+        self.login('admin')
+        sql = "SELECT first_name FROM ab_user WHERE first_name='admin'"
+        client_id = "{}".format(random.getrandbits(64))[:10]
+        self.run_sql(sql, client_id, raise_on_error=True)
+        query = db.session.query(models.Query).filter_by(
+            client_id=client_id).one()
+
+        backend = SimpleCache()
+        writer = results_store.ResultsWriter(backend)
+        writer.write_page(pd.DataFrame({'first_name': ['stored']}))
+        writer.write_index({})
+        query.results_key = writer.key
+        db.session.commit()
+        with mock.patch('superset.views.core.results_backend', backend):
+            resp = self.get_resp('/superset/csv/{}'.format(client_id))
+            self.assertIn('stored', resp)
+
+            # truncated results are only part of the rows, the query runs
+            # again instead
+            query.results_truncated = True
+            db.session.commit()
+            resp = self.get_resp('/superset/csv/{}'.format(client_id))
+            self.assertIn('admin', resp)
+            self.assertNotIn('stored', resp)
         self.logout()
 
     def test_public_user_dashboard_access(self):
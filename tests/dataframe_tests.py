@@ -0,0 +1,62 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+
+from superset import dataframe, db_engine_specs
+
+
+class DataFrameBuilderTests(unittest.TestCase):
+
+    def build(self, description, rows, **kwargs):
+        builder = dataframe.DataFrameBuilder(
+            description, db_engine_specs.PrestoEngineSpec, **kwargs)
+        return builder.build(rows)
+
+    def test_typed_columns(self):
+        description = [
+            ('id', 'bigint'),
+            ('score', 'double'),
+            ('active', 'boolean'),
+            ('name', 'varchar'),
+        ]
+        df = self.build(description, [
+            (1, 1.5, True, 'a'),
+            (2, None, False, None),
+        ])
+        self.assertEquals(['id', 'score', 'active', 'name'], list(df.columns))
+        self.assertEquals('int64', df['id'].dtype.name)
+        self.assertEquals('float64', df['score'].dtype.name)
+        self.assertEquals('bool', df['active'].dtype.name)
+        self.assertEquals('object', df['name'].dtype.name)
+        self.assertEquals([1, 2], list(df['id']))
+        self.assertEquals('a', df['name'][0])
+
+    def test_nulls_and_overflows(self):
+        df = self.build(
+            [('a', 'bigint'), ('b', 'boolean'), ('c', 'bigint')],
+            [(1, None, 2 ** 70), (None, True, 1)])
+        # nulls turn int columns into floats, as pandas does
+        self.assertEquals('float64', df['a'].dtype.name)
+        self.assertEquals('object', df['b'].dtype.name)
+        self.assertIsNone(df['b'][0])
+        self.assertEquals(2 ** 70, df['c'][0])
+
+    def test_nested_columns(self):
+        description = [('tags', 'array(varchar)'), ('other', None)]
+        rows = [(['a', 'b'], {'k': 1}), (None, {'k': 2})]
+        df = self.build(description, rows)
+        self.assertEquals('["a", "b"]', df['tags'][0])
+        self.assertIsNone(df['tags'][1])
+        # columns of unknown kinds are converted when they start with one
+        self.assertEquals('{"k": 2}', df['other'][1])
+
+        df = self.build(description, rows, serialize_nested=False)
+        self.assertEquals(['a', 'b'], df['tags'][0])
+
+    def test_empty(self):
+        df = self.build([('a', 'bigint'), ('a', 'varchar')], [])
+        self.assertEquals(0, len(df.index))
+        self.assertEquals(['a', 'a'], list(df.columns))
@@ -5,6 +5,9 @@ from __future__ import unicode_literals
 
 import unittest
 
+import mock
+from werkzeug.contrib.cache import SimpleCache
+
 from superset import db_engine_specs
 
 
@@ -85,3 +88,80 @@ class DbEngineSpecsTestCase(unittest.TestCase):
             17/02/07 19:16:09 INFO exec.Task: 2017-02-07 19:16:09,173 Stage-1 map = 40%,  reduce = 0%
         """
         self.assertEquals(60, db_engine_specs.HiveEngineSpec.progress(log))
+
+    def test_get_column_kind(self):
+        kinds = db_engine_specs.ColumnKind
+        presto = db_engine_specs.PrestoEngineSpec
+        self.assertEquals(kinds.INT, presto.get_column_kind('bigint'))
+        self.assertEquals(kinds.FLOAT, presto.get_column_kind('double'))
+        self.assertEquals(
+            kinds.NESTED, presto.get_column_kind('array(varchar)'))
+        self.assertIsNone(presto.get_column_kind('varchar'))
+        self.assertEquals(
+            kinds.INT,
+            db_engine_specs.HiveEngineSpec.get_column_kind('INT_TYPE'))
+
+        postgres = db_engine_specs.PostgresEngineSpec
+        self.assertEquals(kinds.BOOL, postgres.get_column_kind(16))
+        self.assertEquals(kinds.NESTED, postgres.get_column_kind(3802))
+        self.assertIsNone(postgres.get_column_kind(25))
+        self.assertIsNone(postgres.get_column_kind(None))
+
+    def test_fetch_result_sets(self):
+        inspector = mock.Mock()
+        inspector.get_schema_names.return_value = ['b', 'a']
+        inspector.get_table_names.side_effect = (
+            lambda schema: [schema + '2', schema + '1'])
+        database = mock.Mock(id=1, inspector=inspector)
+        with mock.patch('sqlalchemy.inspect', return_value=inspector):
+            result_sets = db_engine_specs.BaseEngineSpec.fetch_result_sets(
+                database, 'table')
+        self.assertEquals({
+            'a': ['a1', 'a2'],
+            'b': ['b1', 'b2'],
+            '': ['a.a1', 'a.a2', 'b.b1', 'b.b2'],
+        }, result_sets)
+
+    @mock.patch('superset.db_engine_specs.tables_cache', SimpleCache())
+    def test_refresh_result_sets(self):
+        spec = db_engine_specs.MySQLEngineSpec
+        database = mock.Mock(id=1)
+        with mock.patch.object(spec, 'fetch_schema_names') as schema_names, \
+                mock.patch.object(spec, 'fetch_change_markers') as markers, \
+                mock.patch.object(spec, 'fetch_schemas_result_sets') as fetch:
+            schema_names.return_value = ['a', 'b', 'c']
+            markers.return_value = {'a': '1:1', 'b': '2:3'}
+            self.assertEquals(
+                ['a', 'b', 'c'], spec.refresh_result_sets(database, 'table'))
+
+            # only the schemas whose marker changed are listed again
+            markers.return_value = {'a': '1:1', 'b': '2:4', 'c': '1:2'}
+            self.assertEquals(
+                ['b', 'c'], spec.refresh_result_sets(database, 'table'))
+            fetch.assert_called_with(database, 'table', ['b', 'c'], force=True)
+
+    @mock.patch('superset.db_engine_specs.tables_cache', SimpleCache())
+    def test_refresh_result_sets_from_listings(self):
+        spec = db_engine_specs.PrestoEngineSpec
+        database = mock.Mock(id=2)
+        with mock.patch.object(spec, 'fetch_schema_names') as schema_names, \
+                mock.patch.object(spec, 'fetch_result_sets') as fetch:
+            schema_names.return_value = ['a', 'b', 'c']
+            fetch.return_value = {'a': ['t1'], 'b': ['t2'], '': []}
+            self.assertEquals(
+                ['a', 'b', 'c'], spec.refresh_result_sets(database, 'table'))
+            fetch.assert_called_once_with(database, 'table', force=True)
+
+            # without change markers, the listings tell what changed
+            fetch.return_value = {'a': ['t1'], 'b': ['t2', 't3'], '': []}
+            self.assertEquals(
+                ['b'], spec.refresh_result_sets(database, 'table'))
+
+    def test_grouping_sets_clause(self):
+        self.assertEquals(
+            'GROUPING SETS ((a), (b))',
+            db_engine_specs.PrestoEngineSpec.grouping_sets_clause(['a', 'b']))
+        # Hive needs the expressions ahead of the sets
+        self.assertEquals(
+            'a, b GROUPING SETS ((a), (b))',
+            db_engine_specs.HiveEngineSpec.grouping_sets_clause(['a', 'b']))
@@ -11,7 +11,8 @@ import unittest
 from mock import Mock, patch
 
 from superset import db, sm, security
-from superset.connectors.druid.models import DruidCluster, DruidDatasource
+from superset.connectors.druid.models import (
+    DruidCluster, DruidColumn, DruidDatasource)
 from superset.connectors.druid.models import PyDruid
 
 from .base_tests import SupersetTestCase
@@ -104,6 +105,11 @@ class DruidTests(SupersetTestCase):
         cluster.refresh_datasources(merge_flag=True)
         datasource_id = cluster.datasources[0].id
         db.session.commit()
+        cardinalities = {
+            c.column_name: c.cardinality
+            for c in cluster.datasources[0].columns}
+        self.assertEqual(1944, cardinalities['dim1'])
+        self.assertEqual(1504, cardinalities['dim2'])
 
         nres = [
             list(v['event'].items()) + [('timestamp', v['timestamp'])]
@@ -158,6 +164,133 @@ class DruidTests(SupersetTestCase):
         resp = self.get_json_resp(url)
         self.assertEqual("Canada", resp['data']['records'][0]['dim1'])
 
+    def test_query_plan(self):
+        datasource = DruidDatasource(datasource_name='plan_datasource')
+        datasource.columns = [
+            DruidColumn(column_name='country', cardinality=200),
+            DruidColumn(column_name='gender', cardinality=3),
+            DruidColumn(column_name='user_id', cardinality=5000000),
+            DruidColumn(column_name='unknown'),
+        ]
+
+        plan = datasource.get_query_plan([], 'all')
+        self.assertEqual('timeseries', plan.query_type)
+
+        plan = datasource.get_query_plan(
+            ['country'], 'all', having_filters=Mock())
+        self.assertEqual('groupBy', plan.query_type)
+
+        plan = datasource.get_query_plan(['country'], 'all', row_limit=50)
+        self.assertEqual('topN', plan.query_type)
+        self.assertEqual(50, plan.threshold)
+        self.assertEqual({}, plan.context)
+
+        plan = datasource.get_query_plan(['user_id'], 'all', row_limit=50)
+        self.assertEqual('topN', plan.query_type)
+        self.assertEqual(50, plan.threshold)
+        self.assertEqual(10000, plan.context['minTopNThreshold'])
+
+        plan = datasource.get_query_plan(
+            ['country', 'gender'], 'all', row_limit=50)
+        self.assertEqual('groupBy', plan.query_type)
+        self.assertTrue(plan.context['forceLimitPushDown'])
+
+        plan = datasource.get_query_plan(
+            ['country', 'user_id'], 'all', row_limit=50)
+        self.assertEqual({}, plan.context)
+
+        plan = datasource.get_query_plan(
+            ['country', 'unknown'], 'all', row_limit=50)
+        self.assertEqual('groupBy', plan.query_type)
+        self.assertEqual({}, plan.context)
+
+    def test_query_context(self):
+        cluster = DruidCluster(
+            cluster_name='context_cluster',
+            query_context_json=json.dumps({'timeout': 1000, 'priority': 1}))
+        datasource = DruidDatasource(
+            datasource_name='context_datasource',
+            cluster=cluster,
+            query_context_json=json.dumps({'priority': 10, 'useCache': False}))
+        self.assertEqual({
+            'timeout': 1000,
+            'priority': 10,
+            'useCache': False,
+            'queryId': 'some_id',
+        }, datasource.get_query_context('some_id'))
+
+        cluster.get_pydruid_client = Mock()
+        cluster.cancel_query = Mock()
+        datasource.get_query_str = Mock(side_effect=Exception('Boom'))
+        with self.assertRaises(Exception):
+            datasource.query({})
+        query_id = datasource.get_query_str.call_args[1]['query_id']
+        self.assertTrue(query_id.startswith('superset-'))
+        self.assertEqual(
+            [((DruidDatasource.pre_query_id(query_id),),), ((query_id,),)],
+            cluster.cancel_query.call_args_list)
+
+    @patch('superset.connectors.druid.models.utils.timeout')
+    def test_query_timeout_budget(self, timeout):
+        from superset.utils import SupersetTimeoutException
+        cluster = DruidCluster(
+            cluster_name='budget_cluster',
+            query_context_json=json.dumps({'timeout': 1500}))
+        datasource = DruidDatasource(
+            datasource_name='budget_datasource', cluster=cluster)
+        cluster.get_pydruid_client = Mock()
+        cluster.cancel_query = Mock()
+        datasource.get_query_str = Mock(
+            side_effect=SupersetTimeoutException('Druid query timed out'))
+        with self.assertRaises(SupersetTimeoutException):
+            datasource.query({})
+        # the broker gets a second on top of the context's timeout
+        timeout.assert_called_once_with(
+            seconds=3, error_message='Druid query timed out')
+        query_id = datasource.get_query_str.call_args[1]['query_id']
+        self.assertEqual(
+            [((DruidDatasource.pre_query_id(query_id),),), ((query_id,),)],
+            cluster.cancel_query.call_args_list)
+
+        # without a budget the query runs without a client side timeout
+        timeout.reset_mock()
+        cluster.query_context_json = None
+        cluster.cancel_query.reset_mock()
+        with self.assertRaises(SupersetTimeoutException):
+            datasource.query({})
+        self.assertFalse(timeout.called)
+        self.assertEqual(2, cluster.cancel_query.call_count)
+
+    def test_values_for_column(self):
+        import pandas as pd
+        cluster = DruidCluster(cluster_name='values_cluster')
+        datasource = DruidDatasource(
+            datasource_name='values_datasource', cluster=cluster)
+        client = Mock()
+        client.export_pandas.return_value = pd.DataFrame(
+            {'dim1': ['Canada', 'Chile'], 'count': [2, 1]})
+        cluster.get_pydruid_client = Mock(return_value=client)
+
+        df = datasource.values_for_column(
+            'dim1',
+            datetime(2017, 3, 1, 10, 42),
+            datetime(2017, 3, 2, 10, 42),
+            limit=2,
+            prefix='c',
+            page_after='Brazil')
+        self.assertEqual(['Canada', 'Chile'], list(df['dim1']))
+        qry = client.topn.call_args[1]
+        self.assertEqual(
+            {'type': 'lexicographic', 'previousStop': 'Brazil'},
+            qry['metric'])
+        self.assertEqual(2, qry['threshold'])
+        self.assertEqual(
+            '2017-03-01T10:00:00+00:00/2017-03-02T11:00:00+00:00',
+            qry['intervals'])
+        self.assertEqual(
+            '(?i)^\\Qc\\E', qry['filter'].filter['filter']['pattern'])
+        self.assertTrue(qry['context']['queryId'].startswith('superset-'))
+
     def test_druid_sync_from_config(self):
         CLUSTER_NAME = 'new_druid'
         self.login()
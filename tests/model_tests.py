@@ -2,7 +2,7 @@ import unittest
 
 from sqlalchemy.engine.url import make_url
 
-from superset.models.core import Database
+from superset.models.core import Database, dispose_engines
 
 
 class DatabaseModelTestCase(unittest.TestCase):
@@ -46,3 +46,14 @@ class DatabaseModelTestCase(unittest.TestCase):
         assert db == 'superset'
         db = model.get_database_for_various_backend(url, 'adhoc')
         assert db == 'adhoc'
+
+    def test_get_sqla_engine(self):
+        model = Database(id=1000, sqlalchemy_uri='sqlite:////tmp/a.db')
+        engine = model.get_sqla_engine()
+        self.assertIs(engine, model.get_sqla_engine())
+        self.assertIsNot(engine, model.get_sqla_engine(nullpool=True))
+
+        # editing the database replaces its engine
+        model.sqlalchemy_uri = 'sqlite:////tmp/b.db'
+        self.assertIsNot(engine, model.get_sqla_engine())
+        dispose_engines(1000)
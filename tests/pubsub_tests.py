@@ -0,0 +1,57 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import threading
+import unittest
+
+from werkzeug.contrib.cache import SimpleCache
+
+from superset import pubsub
+
+
+class PubSubTestMixin(object):
+
+    def test_publish_and_listen(self):
+        self.assertEquals(0, self.pubsub.last_seq('foo'))
+        self.pubsub.publish('foo', {'id': 1})
+        self.pubsub.publish('bar', {'id': 2})
+        self.pubsub.publish('foo', {'id': 3})
+
+        seq, events = self.pubsub.listen('foo', 0, timeout=0)
+        self.assertEquals(2, seq)
+        self.assertEquals([(1, {'id': 1}), (2, {'id': 3})], events)
+
+        seq, events = self.pubsub.listen('foo', 1, timeout=0)
+        self.assertEquals([(2, {'id': 3})], events)
+
+        seq, events = self.pubsub.listen('foo', 2, timeout=0)
+        self.assertEquals(2, seq)
+        self.assertEquals([], events)
+
+    def test_listen_waits_for_events(self):
+        timer = threading.Timer(
+            0.1, self.pubsub.publish, args=('foo', {'id': 1}))
+        timer.start()
+        seq, events = self.pubsub.listen('foo', 0, timeout=5)
+        timer.join()
+        self.assertEquals([(1, {'id': 1})], events)
+
+
+class InProcessPubSubTests(PubSubTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.pubsub = pubsub.InProcessPubSub()
+
+
+class CachePubSubTests(PubSubTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.pubsub = pubsub.CachePubSub(SimpleCache(), poll_interval=0.01)
+
+    def test_counter_reset(self):
+        self.pubsub.publish('foo', {'id': 1})
+        seq, events = self.pubsub.listen('foo', 10, timeout=0)
+        self.assertEquals(1, seq)
+        self.assertEquals([(1, {'id': 1})], events)
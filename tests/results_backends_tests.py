@@ -3,6 +3,12 @@ try:
 except ImportError:
     import pickle
 
+import io
+import os
+import shutil
+import tempfile
+
+from botocore.exceptions import ClientError
 import mock
 
 from superset import app, results_backends
@@ -26,8 +32,14 @@ class ResultsBackendsTests(SupersetTestCase):
         self.s3_cache._key_exists = ResultsBackendsTests._mock_key_exists
 
     @staticmethod
-    def _mock_download_fileobj(bucket, key, value_file):
-        value_file.write(pickle.dumps('%s:%s' % (bucket, key)))
+    def _mock_get_object(Bucket, Key, Range=None):
+        if Key != 'test-prefix/test-key':
+            raise ClientError(
+                {'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        return {
+            'Body': io.BytesIO(pickle.dumps('%s:%s' % (Bucket, Key))),
+            'Metadata': {'superset-encoding': 'pickle'},
+        }
 
     @staticmethod
     def _mock_key_exists(key):
@@ -36,89 +48,238 @@ class ResultsBackendsTests(SupersetTestCase):
     def test_s3_cache_initilization(self):
         self.mock_boto3_client.assert_called_with('s3')
 
+    @mock.patch('boto3.client')
+    def test_s3_cache_endpoint_url(self, mock_boto3_client):
+        app.config['S3_CACHE_ENDPOINT_URL'] = 'http://localhost:4572'
+        try:
+            results_backends.S3Cache()
+        finally:
+            del app.config['S3_CACHE_ENDPOINT_URL']
+        mock_boto3_client.assert_called_with(
+            's3', endpoint_url='http://localhost:4572')
+
     def test_s3_cache_set(self):
         result = self.s3_cache.set('test-key', 'test-value')
 
         self.assertTrue(result)
-        self.mock_s3_client.upload_fileobj.assert_called_once()
+        self.mock_s3_client.put_object.assert_called_once()
+
+        call_args = self.mock_s3_client.put_object.call_args_list[0][1]
 
-        call_args = self.mock_s3_client.upload_fileobj.call_args_list[0][0]
+        self.assertEquals(pickle.loads(call_args['Body']), 'test-value')
+        self.assertEquals(call_args['Bucket'], 'test-bucket')
+        self.assertEquals(call_args['Key'], 'test-prefix/test-key')
+        self.assertEquals(
+            call_args['Metadata'], {'superset-encoding': 'pickle'})
 
-        self.assertEquals(pickle.loads(call_args[0].getvalue()), 'test-value')
-        self.assertEquals(call_args[1], 'test-bucket')
-        self.assertEquals(call_args[2], 'test-prefix/test-key')
+    def test_s3_cache_set_bytes(self):
+        result = self.s3_cache.set('test-key', b'\x78\x9c')
+
+        self.assertTrue(result)
+        call_args = self.mock_s3_client.put_object.call_args_list[0][1]
+        # bytes are stored as is rather than pickled
+        self.assertEquals(call_args['Body'], b'\x78\x9c')
+        self.assertEquals(call_args['Metadata'], {'superset-encoding': 'raw'})
 
     def test_s3_cache_set_exception(self):
-        self.mock_s3_client.upload_fileobj.side_effect = Exception('Something bad happened!')
+        self.mock_s3_client.put_object.side_effect = Exception('Something bad happened!')
         result = self.s3_cache.set('test-key', 'test-value')
 
         self.assertFalse(result)
-        self.mock_s3_client.upload_fileobj.assert_called_once()
+        self.mock_s3_client.put_object.assert_called_once()
 
     def test_s3_cache_get_exists(self):
-        self.mock_s3_client.download_fileobj.side_effect = (
-            ResultsBackendsTests._mock_download_fileobj)
+        self.mock_s3_client.get_object.side_effect = (
+            ResultsBackendsTests._mock_get_object)
         result = self.s3_cache.get('test-key')
 
         self.assertEquals(result, 'test-bucket:test-prefix/test-key')
-        self.mock_s3_client.download_fileobj.assert_called_once()
+        self.mock_s3_client.get_object.assert_called_once_with(
+            Bucket='test-bucket', Key='test-prefix/test-key')
+        self.assertFalse(self.mock_s3_client.head_object.called)
+
+    def test_s3_cache_get_raw(self):
+        self.mock_s3_client.get_object.return_value = {
+            'Body': io.BytesIO(b'\x78\x9c'),
+            'Metadata': {'superset-encoding': 'raw'},
+        }
+        self.assertEquals(self.s3_cache.get('test-key'), b'\x78\x9c')
 
     def test_s3_cache_get_does_not_exist(self):
+        self.mock_s3_client.get_object.side_effect = (
+            ResultsBackendsTests._mock_get_object)
         result = self.s3_cache.get('test-key2')
 
         self.assertEquals(result, None)
-        self.assertFalse(self.mock_s3_client.download_fileobj.called)
+        self.mock_s3_client.get_object.assert_called_once()
 
     def test_s3_cache_get_exception(self):
-        self.mock_s3_client.download_fileobj.side_effect = Exception('Something bad happened')
+        self.mock_s3_client.get_object.side_effect = Exception('Something bad happened')
         result = self.s3_cache.get('test-key')
 
         self.assertEquals(result, None)
-        self.mock_s3_client.download_fileobj.assert_called_once()
-
-    def test_s3_cache_delete_exists(self):
+        self.mock_s3_client.get_object.assert_called_once()
+
+    def test_s3_cache_local_cache(self):
+        local_dir = tempfile.mkdtemp()
+        app.config['S3_CACHE_LOCAL_DIR'] = local_dir
+        app.config['S3_CACHE_LOCAL_MAX_BYTES'] = 10
+        try:
+            with mock.patch('boto3.client') as mock_boto3_client:
+                mock_boto3_client.return_value = self.mock_s3_client
+                s3_cache = results_backends.S3Cache()
+
+            objects = {
+                'test-prefix/key-01': (b'key-01', '"etag-1"'),
+                'test-prefix/key-02': (b'key-02', '"etag-2"'),
+            }
+
+            def get_object(Bucket, Key, IfNoneMatch=None):
+                if Key not in objects:
+                    raise ClientError(
+                        {'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+                value, etag = objects[Key]
+                if IfNoneMatch == etag:
+                    raise ClientError(
+                        {'Error': {'Code': '304'}}, 'GetObject')
+                return {
+                    'Body': io.BytesIO(value),
+                    'ETag': etag,
+                    'Metadata': {'superset-encoding': 'raw'},
+                }
+            self.mock_s3_client.get_object.side_effect = get_object
+
+            self.assertEquals(s3_cache.get('key-01'), b'key-01')
+            self.assertEquals(s3_cache.get('key-01'), b'key-01')
+            # the copy is revalidated rather than downloaded again
+            self.mock_s3_client.get_object.assert_called_with(
+                Bucket='test-bucket', Key='test-prefix/key-01',
+                IfNoneMatch='"etag-1"')
+
+            # a value rewritten by another process is downloaded again
+            objects['test-prefix/key-01'] = (b'key-1b', '"etag-3"')
+            self.assertEquals(s3_cache.get('key-01'), b'key-1b')
+
+            # the least recently read values are evicted past the size limit
+            self.assertEquals(s3_cache.get('key-02'), b'key-02')
+            self.assertIsNone(s3_cache.local_cache.get('key-01'))
+
+            # a value deleted by another process is dropped
+            del objects['test-prefix/key-02']
+            self.assertIsNone(s3_cache.get('key-02'))
+            self.assertIsNone(s3_cache.local_cache.get('key-02'))
+
+            s3_cache.get('key-01')
+            s3_cache.set('key-01', b'other')
+            self.assertIsNone(s3_cache.local_cache.get('key-01'))
+        finally:
+            del app.config['S3_CACHE_LOCAL_DIR']
+            del app.config['S3_CACHE_LOCAL_MAX_BYTES']
+            shutil.rmtree(local_dir)
+
+    def test_s3_cache_delete(self):
         result = self.s3_cache.delete('test-key')
 
         self.assertTrue(result)
-        self.mock_s3_client.delete_objects.assert_called_once_with(
+        self.mock_s3_client.delete_object.assert_called_once_with(
             Bucket='test-bucket',
-            Delete={'Objects': [{'Key': 'test-prefix/test-key'}]}
+            Key='test-prefix/test-key',
         )
-
-    def test_s3_cache_delete_does_not_exist(self):
-        result = self.s3_cache.delete('test-key2')
-
-        self.assertFalse(result)
-        self.assertFalse(self.mock_s3_client.delete_objects.called)
+        self.assertFalse(self.mock_s3_client.head_object.called)
 
     def test_s3_cache_delete_exception(self):
-        self.mock_s3_client.delete_objects.side_effect = Exception('Something bad happened')
+        self.mock_s3_client.delete_object.side_effect = Exception('Something bad happened')
         result = self.s3_cache.delete('test-key')
 
         self.assertFalse(result)
-        self.mock_s3_client.delete_objects.assert_called_once()
+        self.mock_s3_client.delete_object.assert_called_once()
 
     def test_s3_cache_add_exists(self):
         result = self.s3_cache.add('test-key', 'test-value')
 
         self.assertFalse(result)
-        self.assertFalse(self.mock_s3_client.upload_fileobj.called)
+        self.assertFalse(self.mock_s3_client.put_object.called)
 
     def test_s3_cache_add_does_not_exist(self):
         result = self.s3_cache.add('test-key2', 'test-value')
 
         self.assertTrue(result)
-        self.mock_s3_client.upload_fileobj.assert_called_once()
+        self.mock_s3_client.put_object.assert_called_once()
 
-        call_args = self.mock_s3_client.upload_fileobj.call_args_list[0][0]
+        call_args = self.mock_s3_client.put_object.call_args_list[0][1]
 
-        self.assertEquals(pickle.loads(call_args[0].getvalue()), 'test-value')
-        self.assertEquals(call_args[1], 'test-bucket')
-        self.assertEquals(call_args[2], 'test-prefix/test-key2')
+        self.assertEquals(pickle.loads(call_args['Body']), 'test-value')
+        self.assertEquals(call_args['Bucket'], 'test-bucket')
+        self.assertEquals(call_args['Key'], 'test-prefix/test-key2')
 
     def test_s3_cache_add_exception(self):
-        self.mock_s3_client.upload_fileobj.side_effect = Exception('Something bad happened')
+        self.mock_s3_client.put_object.side_effect = Exception('Something bad happened')
         result = self.s3_cache.add('test-key2', 'test-value')
 
         self.assertFalse(result)
-        self.mock_s3_client.upload_fileobj.assert_called_once()
+        self.mock_s3_client.put_object.assert_called_once()
+
+
+class FileResultsCacheTests(SupersetTestCase):
+    requires_examples = False
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache = results_backends.FileResultsCache(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_set_get(self):
+        self.assertTrue(self.cache.set('raw', b'abcdef'))
+        self.assertTrue(self.cache.set('pickled', {'a': 1}))
+        self.assertEquals(self.cache.get('raw'), b'abcdef')
+        self.assertEquals(self.cache.get('pickled'), {'a': 1})
+        self.assertIsNone(self.cache.get('missing'))
+
+        # a new value replaces the file of the previous one
+        self.cache.set('raw', b'')
+        self.assertEquals(self.cache.get('raw'), b'')
+        self.assertEquals(3, len(os.listdir(self.path)))
+
+    def test_add_delete(self):
+        self.assertTrue(self.cache.add('key', b'a'))
+        self.assertFalse(self.cache.add('key', b'b'))
+        self.assertEquals(self.cache.get('key'), b'a')
+        self.assertTrue(self.cache.delete('key'))
+        self.assertFalse(self.cache.delete('key'))
+        self.assertIsNone(self.cache.get('key'))
+        self.assertEquals(['index.db'], os.listdir(self.path))
+
+    @mock.patch('time.time')
+    def test_expiration(self, mock_time):
+        mock_time.return_value = 1000
+        self.cache.set('short', b'a', timeout=10)
+        self.cache.set('default', b'b')
+        self.cache.set('forever', b'c', timeout=0)
+
+        mock_time.return_value = 1100
+        self.assertIsNone(self.cache.get('short'))
+        self.assertEquals(self.cache.get('default'), b'b')
+
+        mock_time.return_value = 10000
+        self.assertEquals(1, self.cache.sweep())
+        self.assertIsNone(self.cache.get('default'))
+        self.assertEquals(self.cache.get('forever'), b'c')
+
+    @mock.patch('time.time')
+    def test_size_eviction(self, mock_time):
+        cache = results_backends.FileResultsCache(self.path, max_bytes=9)
+        mock_time.return_value = 1000
+        cache.set('key-01', b'123')
+        mock_time.return_value = 1001
+        cache.set('key-02', b'456')
+        mock_time.return_value = 1002
+        cache.get('key-01')
+        mock_time.return_value = 1003
+        cache.set('key-03', b'7890')
+
+        # the least recently read value goes first
+        self.assertIsNone(cache.get('key-02'))
+        self.assertEquals(cache.get('key-01'), b'123')
+        self.assertEquals(cache.get('key-03'), b'7890')
@@ -0,0 +1,192 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from datetime import datetime
+import unittest
+
+import pandas as pd
+from werkzeug.contrib.cache import SimpleCache
+
+from superset import results_store, utils
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+class ResultsStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = SimpleCache()
+
+    def copy_results(self, index, payload):
+        key, copy = results_store.copy_pages(self.backend, index)
+        results_store.store_index(self.backend, key, copy, payload)
+        return key
+
+    def write_results(self, pages, storage_format='json'):
+        writer = results_store.ResultsWriter(
+            self.backend, storage_format=storage_format)
+        for records in pages:
+            writer.write_page(pd.DataFrame.from_records(records))
+        writer.write_index({'query_id': 1, 'columns': [{'name': 'a'}]})
+        return writer
+
+    def test_write_and_load(self):
+        writer = self.write_results([
+            [{'a': 1}, {'a': 2}],
+            [{'a': 3}],
+        ])
+        index = results_store.get_index(self.backend, writer.key)
+        self.assertEquals(3, index['rows'])
+        self.assertEquals(
+            [2, 1], [page['rows'] for page in index['pages']])
+        self.assertEquals(1, index['query_id'])
+
+        payload = results_store.load_payload(self.backend, index)
+        self.assertNotIn('pages', payload)
+        self.assertEquals([1, 2, 3], [r['a'] for r in payload['data']])
+
+        payload = results_store.load_payload(self.backend, index, limit=2)
+        self.assertEquals([1, 2], [r['a'] for r in payload['data']])
+
+    def test_load_range(self):
+        writer = self.write_results([
+            [{'a': 1}, {'a': 2}],
+            [{'a': 3}, {'a': 4}],
+            [{'a': 5}],
+        ])
+        index = results_store.get_index(self.backend, writer.key)
+        self.assertTrue(index['complete'])
+        # pages outside of the range are never read
+        self.backend.delete(writer.page_key(0))
+        payload = results_store.load_payload(
+            self.backend, index, offset=3, limit=2)
+        self.assertEquals([4, 5], [r['a'] for r in payload['data']])
+        self.assertEquals(3, payload['offset'])
+        self.assertEquals(5, payload['rows'])
+
+        payload = results_store.load_payload(self.backend, index, offset=10)
+        self.assertEquals([], payload['data'])
+
+    def test_incomplete_index(self):
+        writer = results_store.ResultsWriter(self.backend)
+        writer.write_page(pd.DataFrame({'a': [1]}))
+        writer.write_index({'query_id': 1}, complete=False)
+        writer.write_page(pd.DataFrame({'a': [2]}))
+        index = results_store.get_index(self.backend, writer.key)
+        self.assertFalse(index['complete'])
+        self.assertEquals(1, index['rows'])
+
+    def test_copy_results(self):
+        writer = self.write_results([[{'a': 1}], [{'a': 2}]])
+        index = results_store.get_index(self.backend, writer.key)
+        key = self.copy_results(index, {'query_id': 2})
+        self.assertNotEquals(writer.key, key)
+        copy = results_store.get_index(self.backend, key)
+        self.assertEquals(2, copy['query_id'])
+        self.assertEquals(
+            [page['rows'] for page in index['pages']],
+            [page['rows'] for page in copy['pages']])
+        self.assertNotEquals(
+            index['pages'][0]['key'], copy['pages'][0]['key'])
+        payload = results_store.load_payload(self.backend, copy)
+        self.assertEquals([1, 2], [r['a'] for r in payload['data']])
+
+    def test_delete_results(self):
+        writer = self.write_results([[{'a': 1}], [{'a': 2}]])
+        index = results_store.get_index(self.backend, writer.key)
+        key = self.copy_results(index, {'query_id': 2})
+
+        # the copy has pages of its own
+        results_store.delete_results(self.backend, writer.key)
+        self.assertIsNone(results_store.get_index(self.backend, writer.key))
+        self.assertIsNone(self.backend.get(writer.page_key(0)))
+        self.assertIsNone(self.backend.get(writer.page_key(1)))
+        copy = results_store.get_index(self.backend, key)
+        payload = results_store.load_payload(self.backend, copy)
+        self.assertEquals([1, 2], [r['a'] for r in payload['data']])
+
+        results_store.delete_results(self.backend, key)
+        self.assertIsNone(results_store.get_index(self.backend, key))
+        self.assertIsNone(self.backend.get(copy['pages'][0]['key']))
+
+    def test_expired_results(self):
+        self.assertIsNone(results_store.get_index(self.backend, 'nope'))
+
+        writer = self.write_results([[{'a': 1}], [{'a': 2}]])
+        index = results_store.get_index(self.backend, writer.key)
+        self.backend.delete(writer.page_key(1))
+        with self.assertRaises(utils.ResultsExpiredException):
+            results_store.load_payload(self.backend, index)
+        with self.assertRaises(utils.ResultsExpiredException):
+            results_store.copy_pages(self.backend, index)
+
+    def test_legacy_results(self):
+        self.backend.set('legacy', results_store.encode({
+            'query_id': 1,
+            'data': [{'a': 1}, {'a': 2}],
+        }))
+        index = results_store.get_index(self.backend, 'legacy')
+        self.assertEquals(2, index['rows'])
+        payload = results_store.load_payload(self.backend, index)
+        self.assertEquals([{'a': 1}, {'a': 2}], payload['data'])
+
+    def test_load_columns(self):
+        writer = self.write_results([
+            [{'a': 1.5}, {'a': None}],
+            [{'a': 3}],
+        ])
+        index = results_store.get_index(self.backend, writer.key)
+        self.assertEquals(
+            ['json_columns', 'json_columns'],
+            [page['format'] for page in index['pages']])
+
+        payload = results_store.load_payload(
+            self.backend, index, offset=1, orient='columns')
+        self.assertEquals({'a': [None, 3]}, payload['data'])
+        # nulls are encoded while serializing, the frame keeps its dtypes
+        payload = results_store.load_payload(self.backend, index)
+        self.assertEquals(
+            [{'a': 1.5}, {'a': None}, {'a': 3}], payload['data'])
+
+    def test_load_dataframe(self):
+        writer = self.write_results([
+            [{'a': 1}, {'a': 2}],
+            [{'a': 3}],
+        ])
+        index = results_store.get_index(self.backend, writer.key)
+        df = results_store.load_dataframe(self.backend, index)
+        self.assertEquals(['a'], list(df.columns))
+        self.assertEquals([1, 2, 3], list(df['a']))
+
+    def test_unknown_storage_format(self):
+        with self.assertRaises(utils.SupersetException):
+            results_store.ResultsWriter(self.backend, storage_format='xml')
+
+    @unittest.skipUnless(pyarrow, "pyarrow isn't installed")
+    def test_arrow_storage_format(self):
+        writer = self.write_results([
+            [
+                {'a': 1, 'b': 'x', 'c': datetime(2017, 1, 1)},
+                {'a': 2, 'b': None, 'c': datetime(2017, 1, 2)},
+            ],
+            [{'a': 3, 'b': 'x', 'c': datetime(2017, 1, 3)}],
+        ], storage_format='arrow')
+        index = results_store.get_index(self.backend, writer.key)
+        self.assertEquals('arrow', index['format'])
+        self.assertEquals(
+            ['arrow', 'arrow'], [page['format'] for page in index['pages']])
+
+        df = results_store.load_dataframe(self.backend, index)
+        self.assertEquals([1, 2, 3], list(df['a']))
+        self.assertEquals('x', df['b'][0])
+        self.assertEquals('datetime64[ns]', df['c'].dtype.name)
+
+        payload = results_store.load_payload(
+            self.backend, index, offset=1, limit=1)
+        self.assertEquals([{'a': 2, 'b': None, 'c': datetime(2017, 1, 2)}],
+                          payload['data'])
@@ -1,4 +1,4 @@
-from superset import security, sm
+from superset import app, security, sm
 
 from .base_tests import SupersetTestCase
 
@@ -171,3 +171,22 @@ class RolePermissionTests(SupersetTestCase):
         self.assert_cannot_gamma(granter_set)
         self.assert_cannot_alpha(granter_set)
 
+    def test_user_permissions(self):
+        gamma = sm.find_user('gamma')
+        pvm = sm.find_permission_view_menu('can_approve', 'Superset')
+        with app.test_request_context():
+            perms = security.get_user_permissions(gamma)
+            self.assertTrue(get_perm_tuples('Gamma') <= perms)
+            self.assertNotIn(('can_approve', 'Superset'), perms)
+            self.assertFalse(
+                security.can_access('can_approve', 'Superset', gamma))
+
+            # committing role changes drops the cached permissions
+            sm.add_permission_role(sm.find_role('Gamma'), pvm)
+            try:
+                self.assertTrue(
+                    security.can_access('can_approve', 'Superset', gamma))
+            finally:
+                sm.del_permission_role(sm.find_role('Gamma'), pvm)
+            self.assertFalse(
+                security.can_access('can_approve', 'Superset', gamma))
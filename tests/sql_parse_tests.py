@@ -293,3 +293,27 @@ class SupersetTestCase(unittest.TestCase):
 
         query = "SELECT * FROM t1; SELECT * FROM t2;"
         self.assertEquals({"t1", "t2"}, self.extract_tables(query))
+
+    def test_is_deterministic(self):
+        def is_deterministic(sql):
+            return sql_parse.SupersetQuery(sql).is_deterministic()
+        self.assertTrue(is_deterministic("SELECT * FROM t WHERE ds = '1'"))
+        self.assertTrue(is_deterministic("SELECT 'now()' FROM t"))
+        self.assertFalse(is_deterministic("SELECT NOW() FROM t"))
+        self.assertFalse(is_deterministic(
+            "SELECT * FROM t WHERE ds > current_date"))
+        self.assertFalse(is_deterministic("SELECT * FROM t ORDER BY rand()"))
+
+    def test_normalized(self):
+        def normalized(sql):
+            return sql_parse.SupersetQuery(sql).normalized()
+        self.assertEquals(
+            normalized("SELECT a, b FROM t WHERE c = 'x  y'"),
+            normalized(
+                "SELECT a,   b\n"
+                "-- pick a table\n"
+                "FROM t\n"
+                "WHERE c = 'x  y';\n"))
+        self.assertNotEquals(
+            normalized("SELECT a FROM t WHERE c = 'x  y'"),
+            normalized("SELECT a FROM t WHERE c = 'x y'"))
@@ -8,8 +8,13 @@ from datetime import datetime, timedelta
 import json
 import unittest
 
+import mock
 from flask_appbuilder.security.sqla import models as ab_models
-from superset import db, utils, appbuilder, sm
+import pandas as pd
+from werkzeug.contrib.cache import SimpleCache
+from superset import (
+    app, db, utils, appbuilder, sm, sql_lab, query_channel, pubsub,
+    results_store)
 from superset.models import core as models
 
 from .base_tests import SupersetTestCase
@@ -52,6 +57,14 @@ class SqlLabTests(SupersetTestCase):
         data = self.run_sql('SELECT * FROM unexistant_table', "2")
         self.assertLess(0, len(data['error']))
 
+    def test_sql_json_no_rows(self):
+        self.login('admin')
+        data = self.run_sql(
+            'SELECT id, username FROM ab_user WHERE 1 = 0', "no_rows")
+        self.assertEquals([], data['data'])
+        self.assertEquals(
+            ['id', 'username'], [col['name'] for col in data['columns']])
+
     def test_sql_json_has_access(self):
         main_db = self.get_main_database(db.session)
         sm.add_permission_view_menu('database_access', main_db.perm)
@@ -117,6 +130,41 @@ class SqlLabTests(SupersetTestCase):
         # Redirects to the login page
         self.assertEquals(403, resp.status_code)
 
+    def test_queries_updates_endpoint(self):
+        self.login('admin')
+        resp = self.client.get('/superset/queries_updates/')
+        self.assertEquals(501, resp.status_code)
+
+        backend = pubsub.InProcessPubSub()
+        with mock.patch('superset.models.core.pubsub_backend', backend), \
+                mock.patch('superset.views.core.pubsub_backend', backend):
+            self.check_queries_updates()
+
+    def check_queries_updates(self):
+        resp = self.get_json_resp('/superset/queries_updates/')
+        self.assertEquals({}, resp['queries'])
+
+        self.run_sql("SELECT * FROM ab_user", client_id='client_id_4')
+        resp = self.get_json_resp(
+            '/superset/queries_updates/{}'.format(resp['seq']))
+        self.assertIn('client_id_4', resp['queries'])
+        self.assertEquals('success', resp['queries']['client_id_4']['state'])
+
+    def test_results_max_bytes(self):
+        self.login('admin')
+        max_bytes = app.config.get('SQLLAB_RESULTS_MAX_BYTES')
+        page_size = app.config.get('RESULTS_PAGE_SIZE')
+        app.config['SQLLAB_RESULTS_MAX_BYTES'] = 1
+        app.config['RESULTS_PAGE_SIZE'] = 1
+        try:
+            data = self.run_sql(
+                "SELECT * FROM ab_permission", client_id='client_id_5')
+        finally:
+            app.config['SQLLAB_RESULTS_MAX_BYTES'] = max_bytes
+            app.config['RESULTS_PAGE_SIZE'] = page_size
+        self.assertEquals(1, len(data['data']))
+        self.assertTrue(data['query']['results_truncated'])
+
     def test_search_query_on_db_id(self):
         self.run_some_queries()
         self.login('admin')
@@ -201,6 +249,137 @@ class SqlLabTests(SupersetTestCase):
             user_name='admin',
             raise_on_error=True)
 
+    def test_queue_position(self):
+        main_db = self.get_main_database(db.session)
+        main_db.max_concurrent_queries = 1
+        queries = []
+        for i, status in enumerate([
+                utils.QueryStatus.RUNNING,
+                utils.QueryStatus.QUEUED,
+                utils.QueryStatus.PENDING]):
+            query = models.Query(
+                client_id='queue_{}'.format(i),
+                database=main_db,
+                sql='SELECT 1',
+                status=status,
+            )
+            db.session.add(query)
+            queries.append(query)
+        db.session.commit()
+        running, queued, pending = queries
+
+        self.assertEquals(1, sql_lab.get_queue_position(db.session, queued))
+        self.assertEquals(2, sql_lab.get_queue_position(db.session, pending))
+
+        # left running by a worker that died
+        time_limit = app.config.get('SQLLAB_ASYNC_TIME_LIMIT_SEC')
+        db.session.query(models.Query).filter_by(id=running.id).update(
+            {'changed_on': datetime.utcnow() - timedelta(
+                seconds=time_limit + 60)},
+            synchronize_session=False)
+        db.session.commit()
+        self.assertEquals(0, sql_lab.get_queue_position(db.session, queued))
+
+        running.status = utils.QueryStatus.SUCCESS
+        db.session.commit()
+        self.assertEquals(0, sql_lab.get_queue_position(db.session, queued))
+        self.assertEquals(1, sql_lab.get_queue_position(db.session, pending))
+
+        main_db.max_concurrent_queries = None
+        db.session.commit()
+        self.assertEquals(0, sql_lab.get_queue_position(db.session, pending))
+
+    def test_cached_results(self):
+        main_db = self.get_main_database(db.session)
+        backend = SimpleCache()
+        queries = []
+        for i, cache_hit in enumerate([False, True, False]):
+            query = models.Query(
+                client_id='cached_{}'.format(i),
+                database=main_db,
+                sql='SELECT 1',
+                status=utils.QueryStatus.SUCCESS,
+                results_cache_key='cached_results',
+                results_cache_hit=cache_hit,
+                end_time=utils.now_as_float(),
+            )
+            db.session.add(query)
+            queries.append(query)
+        db.session.commit()
+        original, hit, new = queries
+
+        with mock.patch('superset.sql_lab.results_backend', backend):
+            # the results of a query reusing results aren't reused
+            hit.results_key = 'hit_results'
+            writer = results_store.ResultsWriter(backend, key=hit.results_key)
+            writer.write_page(pd.DataFrame({'a': [1]}))
+            writer.write_index({})
+            db.session.commit()
+            self.assertEquals(
+                (None, None),
+                sql_lab.get_cached_results(db.session, new, 60))
+
+            original.results_key = 'original_results'
+            writer = results_store.ResultsWriter(
+                backend, key=original.results_key)
+            writer.write_page(pd.DataFrame({'a': [1]}))
+            writer.write_index({})
+            db.session.commit()
+            key, index = sql_lab.get_cached_results(db.session, new, 60)
+            self.assertIsNone(key)
+            self.assertEquals(
+                'original_results_page_0', index['pages'][0]['key'])
+
+        for query in queries:
+            db.session.delete(query)
+        db.session.commit()
+
+    def test_worker_session(self):
+        session = sql_lab.get_worker_session()
+        engine = session.get_bind()
+        self.assertIs(session, sql_lab.get_worker_session())
+        self.assertEquals(
+            1, session.query(models.Database).filter_by(
+                database_name='main').count())
+
+        sql_lab.remove_worker_session()
+        new_session = sql_lab.get_worker_session()
+        self.assertIsNot(session, new_session)
+        self.assertIs(engine, new_session.get_bind())
+        sql_lab.remove_worker_session()
+
+    @mock.patch('superset.query_channel.time.sleep')
+    def test_query_monitor(self, mock_sleep):
+        query = models.Query(
+            client_id='monitored',
+            database=self.get_main_database(db.session),
+            sql='SELECT 1',
+            status=utils.QueryStatus.RUNNING,
+            progress=0,
+        )
+        db.session.add(query)
+        db.session.commit()
+
+        monitor = query_channel.QueryMonitor(query, db.session)
+        monitor.update_progress(42.5)
+        monitor.update_progress(30)
+        self.assertEquals(42, monitor.progress)
+        self.assertFalse(monitor.is_stopped())
+
+        # the poll interval grows while the query doesn't progress
+        monitor.wait()
+        monitor.wait()
+        monitor.update_progress(50)
+        monitor.wait()
+        self.assertEquals(
+            [0.5, 0.75, 0.5], [c[0][0] for c in mock_sleep.call_args_list])
+
+        db.session.query(models.Query).filter_by(id=query.id).update(
+            {'status': utils.QueryStatus.STOPPED})
+        db.session.commit()
+        self.assertTrue(monitor.is_stopped())
+        self.assertEquals(utils.QueryStatus.STOPPED, query.status)
+
 
 if __name__ == '__main__':
     unittest.main()
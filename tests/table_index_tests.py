@@ -0,0 +1,79 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+
+import mock
+
+from superset import table_index
+
+
+class TableNameIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.index = table_index.TableNameIndex(
+            ['orders', 'order_items', 'customer_orders', 'Big_Orders',
+             'users', 'xorderx'],
+            ['orders_v', 'order'])
+
+    def search(self, substr):
+        return [name for name, is_view in self.index.search(substr)]
+
+    def test_ranking(self):
+        self.assertEquals([
+            'order', 'orders', 'orders_v', 'order_items',
+            'Big_Orders', 'customer_orders', 'xorderx',
+        ], self.search('Order'))
+        self.assertEquals(['users'], self.search('ser'))
+        self.assertEquals([], self.search('nope'))
+
+    def test_short_substring(self):
+        self.assertEquals(['users'], self.search('se'))
+        self.assertEquals(['xorderx'], self.search('x'))
+
+    def test_all_names(self):
+        self.assertEquals(8, len(self.index))
+        self.assertEquals(
+            ('Big_Orders', False), self.index.search()[0])
+        self.assertIn(('orders_v', True), self.index.search(''))
+
+    def test_get_index(self):
+        database = mock.Mock(id=1)
+        database.all_table_names.return_value = ['a']
+        database.all_view_names.return_value = []
+        index = table_index.get_index(database, 'schema')
+        self.assertIs(index, table_index.get_index(database, 'schema'))
+        self.assertEquals(1, database.all_table_names.call_count)
+
+        database.all_table_names.return_value = ['a', 'b']
+        index = table_index.refresh_index(database, 'schema')
+        database.all_table_names.assert_called_with('schema', force=True)
+        self.assertEquals(2, len(table_index.get_index(database, 'schema')))
+
+    def test_published_index(self):
+        from werkzeug.contrib.cache import SimpleCache
+        database = mock.Mock(id=2)
+        database.all_table_names.return_value = ['a']
+        database.all_view_names.return_value = []
+        with mock.patch.object(table_index, 'tables_cache', SimpleCache()):
+            index = table_index.refresh_index(database, 'schema')
+
+            # another process loads the published index instead of building
+            table_index._indexes.clear()
+            database.all_table_names.return_value = ['a', 'b']
+            index = table_index.get_index(database, 'schema')
+            self.assertEquals(['a'], index.names)
+            self.assertEquals(1, database.all_table_names.call_count)
+
+            conf = {'TABLE_NAMES_INDEX_TIMEOUT': 0, 'CELERY_CONFIG': object()}
+            with mock.patch.dict(table_index.config, conf), \
+                    mock.patch('superset.sql_lab.refresh_table_index') as task:
+                # the stale index is searched while a worker rebuilds it
+                self.assertEquals(
+                    index.names,
+                    table_index.get_index(database, 'schema').names)
+                table_index.get_index(database, 'schema')
+                task.delay.assert_called_once_with(2, 'schema')
+                self.assertEquals(1, database.all_table_names.call_count)